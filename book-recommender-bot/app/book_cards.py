@@ -0,0 +1,122 @@
+import html
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+from .catalog import catalog_version
+from .redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BOOK_CARD_CACHE_SIZE = int(os.getenv('BOOK_CARD_CACHE_SIZE', '10000'))
+# Общий кэш карточек в Redis для нескольких процессов бота
+BOOK_CARD_CACHE_REDIS = os.getenv('BOOK_CARD_CACHE_REDIS', 'False').lower() == 'true'
+BOOK_CARD_CACHE_TTL = int(os.getenv('BOOK_CARD_CACHE_TTL', '86400'))
+
+def _text(value: Any) -> str:
+    return html.escape(str(value), quote=False)
+
+def render_book_card(book: Dict[str, Any]) -> str:
+    """Карточка книги в HTML; значения из каталога экранируются"""
+    return f"""
+📚 <b>{_text(book['title'])}</b>
+👤 <i>{_text(book['author'])}</i>
+
+🎭 <b>Жанр:</b> {_text(book.get('genre', 'Не указан'))}
+⭐ <b>Рейтинг:</b> {book.get('rating', 'Нет')}/5
+💰 <b>Цена:</b> {book['price']} {_text(book['currency'])}
+🗣️ <b>Язык:</b> {_text(book.get('language', 'Не указан'))}
+📅 <b>Год:</b> {book.get('publication_year', 'Не указан')}
+📖 <b>Страниц:</b> {book.get('pages', 'Не указано')}
+
+📝 <b>Описание:</b> {_text(book.get('description', 'Нет описания'))}
+
+🏷️ <b>Теги:</b> {_text(', '.join(book.get('tags', [])))}
+📚 <b>Форматы:</b> {_text(', '.join(book.get('available_formats', [])))}
+
+📖 ISBN: {_text(book.get('isbn', 'Не указан'))}
+🏢 Издательство: {_text(book.get('publisher', 'Не указано'))}
+"""
+
+class BookCardCache:
+    """LRU-кэш готовых карточек книг по (версия каталога, id книги).
+
+    Смена версии каталога делает старые записи недостижимыми - они
+    вытесняются как давно не использованные. При BOOK_CARD_CACHE_REDIS
+    промахи сначала ищутся в Redis (один MGET на страницу), а новые
+    карточки записываются туда для других процессов.
+    """
+
+    def __init__(self, max_size: int = BOOK_CARD_CACHE_SIZE, redis: Optional[Redis] = None,
+                 prefix: str = 'card'):
+        self.max_size = max_size
+        self._cards: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._redis = redis
+        self.prefix = prefix
+        self.shared = BOOK_CARD_CACHE_REDIS or redis is not None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def _put(self, key: Tuple[str, int], card: str):
+        self._cards[key] = card
+        if len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+
+    def card(self, book: Dict[str, Any], version: Optional[str] = None) -> str:
+        """Карточка книги из кэша или только что отрисованная.
+
+        version - версия снимка каталога, из которого взята книга
+        (по умолчанию текущая).
+        """
+        key = (version or catalog_version(), book['id'])
+        card = self._cards.get(key)
+        if card is not None:
+            self._cards.move_to_end(key)
+            self.hits += 1
+            return card
+        self.misses += 1
+        card = render_book_card(book)
+        self._put(key, card)
+        return card
+
+    async def prefetch(self, books: List[Dict[str, Any]], version: Optional[str] = None):
+        """Загрузка недостающих карточек страницы из общего кэша Redis"""
+        if not self.shared:
+            return
+        version = version or catalog_version()
+        missing = [b for b in books if (version, b['id']) not in self._cards]
+        if not missing:
+            return
+
+        redis_keys = [f"{self.prefix}:{version}:{b['id']}" for b in missing]
+        try:
+            cached = await self.redis.mget(redis_keys)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for book, redis_key, value in zip(missing, redis_keys, cached):
+                    if value is not None:
+                        self._put((version, book['id']), value.decode('utf-8'))
+                    else:
+                        card = render_book_card(book)
+                        self._put((version, book['id']), card)
+                        pipe.set(redis_key, card, ex=BOOK_CARD_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            # Общий кэш необязателен: карточки отрисуются локально
+            logger.warning(f"Book card cache unavailable: {e}")
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+book_cards = BookCardCache()
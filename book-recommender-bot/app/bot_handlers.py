@@ -1,16 +1,36 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+import asyncio
+import datetime
+import html
 import json
-from typing import Dict, Any, List
+import os
+from typing import Dict, Any, List, AsyncIterator, Optional
 
 from .keyboards import *
 from .openai_client import OpenAIClient
-from .data.books_data import BOOKS_DATABASE
+from .catalog import CatalogSnapshot, book_ids, current_catalog, search_backend
+from .db_search import fetch_books_page, fetch_books_count
+from .search_sessions import SearchSessionStore
+from .quick_lists import get_quick_lists
+from .book_cards import book_cards
+from .recommender import get_recommender
+from .cooccurrence import fetch_neighbours, COOCCURRENCE_BASKET_LIMIT
+from .models import SearchSession, Recommendation
+from .write_behind import write_behind
+from .search_events import record_search, get_preference_summary, summary_preferences
+from .saved_searches import (
+    SAVED_SEARCH_LIMIT, save_search, list_saved_searches, delete_saved_search, describe_params
+)
+from .llm_cache import canonical_search_params
+from .metrics import CARD_LATENCY, SEARCH_LATENCY
 from .database import get_db
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = Router()
 openai_client = OpenAIClient()
@@ -20,57 +40,26 @@ class SearchStates(StatesGroup):
     waiting_for_author = State()
     waiting_for_year = State()
 
-# Хранение параметров поиска в памяти (в продакшене используйте Redis)
-search_params: Dict[int, Dict[str, Any]] = {}
+# Критерии и результаты поиска пользователей хранятся в Redis
+search_sessions = SearchSessionStore()
 
-def search_books(params: Dict) -> List[Dict]:
-    """Поиск книг по параметрам"""
-    filtered_books = BOOKS_DATABASE.copy()
-    
-    # Фильтрация по жанру
-    if params.get('genre'):
-        filtered_books = [b for b in filtered_books if params['genre'] in b.get('tags', [])]
-    
-    # Фильтрация по рейтингу
-    if params.get('rating'):
-        if params['rating'] == '4.5':
-            filtered_books = [b for b in filtered_books if b.get('rating', 0) >= 4.5]
-        elif params['rating'] == '4.0':
-            filtered_books = [b for b in filtered_books if b.get('rating', 0) >= 4.0]
-        elif params['rating'] == '3.5':
-            filtered_books = [b for b in filtered_books if b.get('rating', 0) >= 3.5]
-    
-    # Фильтрация по цене
-    if params.get('price'):
-        if params['price'] == '0_500':
-            filtered_books = [b for b in filtered_books if b.get('price', 0) <= 500]
-        elif params['price'] == '500_1000':
-            filtered_books = [b for b in filtered_books if 500 < b.get('price', 0) <= 1000]
-        elif params['price'] == '1000_2000':
-            filtered_books = [b for b in filtered_books if 1000 < b.get('price', 0) <= 2000]
-        elif params['price'] == '2000':
-            filtered_books = [b for b in filtered_books if b.get('price', 0) > 2000]
-    
-    # Фильтрация по языку
-    if params.get('language'):
-        lang_map = {'ru': 'Русский', 'en': 'Английский', 'fr': 'Французский', 'de': 'Немецкий'}
-        if params['language'] in lang_map:
-            filtered_books = [b for b in filtered_books if b.get('language') == lang_map[params['language']]]
-    
-    # Фильтрация по автору
-    if params.get('author'):
-        filtered_books = [b for b in filtered_books if params['author'].lower() in b['author'].lower()]
-    
-    # Фильтрация по году
-    if params.get('year_from'):
-        filtered_books = [b for b in filtered_books if b.get('publication_year', 0) >= params['year_from']]
-    if params.get('year_to'):
-        filtered_books = [b for b in filtered_books if b.get('publication_year', 9999) <= params['year_to']]
-    
-    # Сортировка по рейтингу (по убыванию)
-    filtered_books.sort(key=lambda x: x.get('rating', 0), reverse=True)
-    
-    return filtered_books
+# Книг на одной странице выдачи
+PAGE_SIZE = 3
+
+# Потоковый вывод ответов ИИ: минимальный интервал между редактированиями
+# одного сообщения (Telegram ограничивает частоту правок) и лимит длины
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Inline-режим (@бот запрос): книг в ответе и сколько секунд Telegram может
+# отдавать этот ответ на тот же запрос без обращения к боту
+INLINE_RESULTS = int(os.getenv('INLINE_RESULTS', '20'))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+
+def search_books(params: Dict, catalog: Optional[CatalogSnapshot] = None) -> List[Dict]:
+    """Поиск книг по параметрам (по убыванию рейтинга) в снимке каталога"""
+    with SEARCH_LATENCY.time(search_backend()):
+        return (catalog or current_catalog()).search(params)
 
 @router.message(CommandStart())
 async def cmd_start(message: Message):
@@ -93,42 +82,46 @@ async def cmd_start(message: Message):
 @router.message(F.text == "📚 Найти книги по критериям")
 async def search_by_criteria(message: Message):
     """Поиск книг по критериям"""
-    search_params[message.from_user.id] = {}
+    await search_sessions.reset(message.from_user.id)
     await message.answer(
         "Выберите критерии для поиска книг:",
         reply_markup=get_search_criteria_menu()
     )
 
 @router.message(F.text == "🎭 Жанр")
-async def select_genre(message: Message):
-    """Выбор жанра"""
+async def select_genre(message: Message, catalog: CatalogSnapshot):
+    """Выбор жанра: на кнопках - число книг с учётом уже выбранных критериев"""
+    params = await search_sessions.get_params(message.from_user.id)
     await message.answer(
         "Выберите жанр:",
-        reply_markup=get_genre_keyboard()
+        reply_markup=get_genre_keyboard(catalog.facet_counts('genre', params))
     )
 
 @router.message(F.text == "⭐ Рейтинг")
-async def select_rating(message: Message):
+async def select_rating(message: Message, catalog: CatalogSnapshot):
     """Выбор рейтинга"""
+    params = await search_sessions.get_params(message.from_user.id)
     await message.answer(
         "Выберите минимальный рейтинг:",
-        reply_markup=get_rating_keyboard()
+        reply_markup=get_rating_keyboard(catalog.facet_counts('rating', params))
     )
 
 @router.message(F.text == "💰 Цена")
-async def select_price(message: Message):
+async def select_price(message: Message, catalog: CatalogSnapshot):
     """Выбор ценового диапазона"""
+    params = await search_sessions.get_params(message.from_user.id)
     await message.answer(
         "Выберите ценовой диапазон:",
-        reply_markup=get_price_keyboard()
+        reply_markup=get_price_keyboard(catalog.facet_counts('price', params))
     )
 
 @router.message(F.text == "🗣️ Язык")
-async def select_language(message: Message):
+async def select_language(message: Message, catalog: CatalogSnapshot):
     """Выбор языка"""
+    params = await search_sessions.get_params(message.from_user.id)
     await message.answer(
         "Выберите язык книги:",
-        reply_markup=get_language_keyboard()
+        reply_markup=get_language_keyboard(catalog.facet_counts('language', params))
     )
 
 @router.message(F.text == "👤 Автор")
@@ -140,11 +133,7 @@ async def select_author(message: Message, state: FSMContext):
 @router.message(SearchStates.waiting_for_author)
 async def process_author(message: Message, state: FSMContext):
     """Обработка ввода автора"""
-    user_id = message.from_user.id
-    if user_id not in search_params:
-        search_params[user_id] = {}
-    
-    search_params[user_id]['author'] = message.text
+    await search_sessions.set_param(message.from_user.id, 'author', message.text)
     await message.answer(f"Автор установлен: {message.text}")
     await state.clear()
 
@@ -158,19 +147,15 @@ async def select_year(message: Message, state: FSMContext):
 async def process_year(message: Message, state: FSMContext):
     """Обработка ввода года"""
     user_id = message.from_user.id
-    if user_id not in search_params:
-        search_params[user_id] = {}
     
     try:
         if '-' in message.text:
             year_from, year_to = map(int, message.text.split('-'))
-            search_params[user_id]['year_from'] = year_from
-            search_params[user_id]['year_to'] = year_to
+            await search_sessions.set_params(user_id, {'year_from': year_from, 'year_to': year_to})
             await message.answer(f"Годы установлены: {year_from}-{year_to}")
         else:
             year = int(message.text)
-            search_params[user_id]['year_from'] = year
-            search_params[user_id]['year_to'] = year
+            await search_sessions.set_params(user_id, {'year_from': year, 'year_to': year})
             await message.answer(f"Год установлен: {year}")
     except ValueError:
         await message.answer("Пожалуйста, введите корректный год или диапазон лет")
@@ -178,20 +163,68 @@ async def process_year(message: Message, state: FSMContext):
     
     await state.clear()
 
+@router.message(F.text == "🔔 Подписаться на новинки")
+async def subscribe_search(message: Message, session: AsyncSession):
+    """Сохранение текущих критериев: новые книги по ним придут уведомлением"""
+    params = canonical_search_params(await search_sessions.get_params(message.from_user.id))
+    if not params:
+        await message.answer("Сначала выберите критерии поиска, затем подпишитесь на новинки по ним.")
+        return
+
+    saved = await save_search(session, message.from_user.id, params)
+    if saved is None:
+        await message.answer(
+            f"У вас уже {SAVED_SEARCH_LIMIT} подписок. Удалите ненужные: /subscriptions"
+        )
+        return
+    await message.answer(
+        f"🔔 Подписка сохранена: {html.escape(describe_params(saved.params))}\n"
+        "Я пришлю новые книги по этим критериям, как только они появятся в каталоге.",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("subscriptions"))
+async def show_subscriptions(message: Message, session: AsyncSession):
+    """Список сохранённых поисков с кнопками отписки"""
+    saved_searches = await list_saved_searches(session, message.from_user.id)
+    if not saved_searches:
+        await message.answer("У вас нет подписок. Выберите критерии поиска и нажмите «🔔 Подписаться на новинки».")
+        return
+    lines = ["🔔 <b>Ваши подписки:</b>\n"]
+    for number, saved in enumerate(saved_searches, 1):
+        lines.append(f"{number}. {html.escape(describe_params(saved.params))}")
+    await message.answer("\n".join(lines), parse_mode="HTML",
+                         reply_markup=get_saved_searches_keyboard(saved_searches))
+
+@router.callback_query(F.data.startswith("unsubscribe_"))
+async def unsubscribe(callback: CallbackQuery, session: AsyncSession):
+    """Удаление сохранённого поиска"""
+    deleted = await delete_saved_search(session, callback.from_user.id, int(callback.data.split("_", 1)[1]))
+    await callback.answer("Подписка удалена" if deleted else "Подписка уже удалена")
+
 @router.message(F.text == "🔍 Начать поиск")
-async def start_search(message: Message):
+async def start_search(message: Message, session: AsyncSession, catalog: CatalogSnapshot):
     """Запуск поиска по выбранным критериям"""
     user_id = message.from_user.id
+    params = await search_sessions.get_params(user_id)
     
-    if user_id not in search_params or not search_params[user_id]:
+    if not params:
         await message.answer(
             "Вы не выбрали ни одного критерия. Пожалуйста, выберите хотя бы один параметр.",
             reply_markup=get_search_criteria_menu()
         )
         return
     
-    # Поиск книг
-    books = search_books(search_params[user_id])
+    # Поиск книг: в БД - только первая страница и общее число
+    if search_backend() == 'db':
+        books, next_cursor = await fetch_books_page(session, params, None, PAGE_SIZE)
+        total = await fetch_books_count(session, params) if next_cursor else len(books)
+    else:
+        results = search_books(params, catalog)
+        books, total = results[:PAGE_SIZE], len(results)
+    
+    # История поисков: из неё инкрементально считается сводка предпочтений
+    await record_search(user_id, params, total)
     
     if not books:
         await message.answer(
@@ -200,74 +233,136 @@ async def start_search(message: Message):
         )
         return
     
-    # Сохраняем результаты поиска
-    search_params[user_id]['results'] = books
-    search_params[user_id]['current_page'] = 1
-    
-    # Отправляем первые 3 книги
-    await send_books_page(message, user_id, 1)
-    
-    # Получаем анализ от ИИ
-    analysis = await openai_client.analyze_books_recommendation(
-        books[:3], 
-        search_params[user_id]
+    # Сохраняем результаты поиска: только ID книг или курсор следующей страницы
+    if search_backend() == 'db':
+        result_ids = [b['id'] for b in books]
+        await search_sessions.save_db_results(user_id, total, next_cursor)
+    else:
+        result_ids = book_ids(results)
+        await search_sessions.save_results(user_id, result_ids, catalog.version)
+    
+    # Журнал выдач: из него строятся совместные показы книг (cooccurrence.py)
+    await write_behind.add(SearchSession, {
+        'user_id': user_id,
+        'search_params': params,
+        'results': result_ids[:COOCCURRENCE_BASKET_LIMIT],
+        'created_at': datetime.datetime.now(),
+    })
+    
+    # Первая страница - одним сообщением, пагинация - под ним же
+    total_pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    await send_books_page(
+        message, books, _results_header(total),
+        reply_markup=get_pagination_keyboard(1, total_pages, user_id) if total_pages > 1 else None,
+        version=catalog.version
     )
     
-    await message.answer(f"📊 *Анализ от книжного эксперта:*\n\n{analysis}", parse_mode="Markdown")
-    
-    if len(books) > 3:
-        await message.answer(
-            f"Найдено {len(books)} книг. Показать еще?",
-            reply_markup=get_pagination_keyboard(1, (len(books) + 2) // 3, user_id)
-        )
+    # Получаем анализ от ИИ, показывая ответ по мере генерации
+    await stream_answer(
+        message,
+        "📊 *Анализ от книжного эксперта:*\n\n",
+        openai_client.stream_books_recommendation(books[:3], params)
+    )
 
 @router.callback_query(F.data.startswith("page_"))
-async def process_pagination(callback: CallbackQuery):
+async def process_pagination(callback: CallbackQuery, session: AsyncSession, catalog: CatalogSnapshot):
     """Обработка пагинации"""
     data = callback.data.split('_')
     user_id = int(data[1])
     page = int(data[2])
     
-    if user_id in search_params and 'results' in search_params[user_id]:
-        books = search_params[user_id]['results']
-        total_pages = (len(books) + 2) // 3
-        
-        if 1 <= page <= total_pages:
-            await send_books_page(callback.message, user_id, page)
+    # Ответ на нажатие снимает индикатор загрузки у клиента, даже если страница не сменилась
+    try:
+        meta = await search_sessions.get_meta(user_id)
+        if meta:
+            total_pages = (int(meta['total']) + PAGE_SIZE - 1) // PAGE_SIZE
             
-            # Обновляем клавиатуру пагинации
-            await callback.message.edit_reply_markup(
-                reply_markup=get_pagination_keyboard(page, total_pages, user_id)
-            )
-    
-    await callback.answer()
+            if 1 <= page <= total_pages:
+                books = await load_results_page(session, user_id, page, meta, catalog)
+                keyboard = get_pagination_keyboard(page, total_pages, user_id)
+                await book_cards.prefetch(books, catalog.version)
+                texts = render_books_page(books, _results_header(int(meta['total'])), catalog.version)
+                
+                # Страница заменяет предыдущую в том же сообщении
+                if len(texts) == 1:
+                    try:
+                        await callback.message.edit_text(texts[0], parse_mode="HTML", reply_markup=keyboard)
+                    except TelegramBadRequest as e:
+                        # Повторное нажатие на текущую страницу
+                        if "not modified" not in str(e):
+                            raise
+                else:
+                    await send_books_page(callback.message, books, reply_markup=keyboard, version=catalog.version)
+    finally:
+        await callback.answer()
 
 @router.message(F.text == "⭐ Персональные рекомендации")
-async def personal_recommendations(message: Message):
+async def personal_recommendations(message: Message, session: AsyncSession, catalog: CatalogSnapshot):
     """Персональные рекомендации"""
-    # В реальном приложении здесь бы получались предпочтения из БД
-    mock_preferences = {
-        "любимые жанры": ["Фэнтези", "Научная фантастика"],
-        "любимые авторы": ["Джордж Оруэлл", "J.K. Rowling"],
-        "предпочитаемый язык": "Русский",
-        "бюджет": "до 1500 руб"
-    }
-    
-    mock_history = [
-        "1984 - Джордж Оруэлл",
-        "Harry Potter and the Philosopher's Stone - J.K. Rowling",
-        "Dune - Frank Herbert"
+    user_id = message.from_user.id
+    params = await search_sessions.get_params(user_id)
+    summary = await get_preference_summary(session, user_id)
+    
+    # Без текущих критериев - любимый жанр из истории поисков
+    search_params = params or ({'genre': summary['genres'][0]} if summary.get('genres') else {})
+    
+    # Исходные книги: первые результаты последнего поиска,
+    # иначе лучшие книги по критериям или по всему каталогу
+    meta = await search_sessions.get_meta(user_id)
+    by_id = catalog.by_id
+    seed_ids = await search_sessions.page_ids(user_id, 1, PAGE_SIZE) if meta.get('mode') == 'ids' else []
+    seeds = [by_id[book_id] for book_id in seed_ids if book_id in by_id]
+    if not seeds:
+        seeds = search_books(search_params, catalog)[:PAGE_SIZE] if search_params else []
+    if not seeds:
+        seeds = catalog.books[:PAGE_SIZE]
+    
+    # Сначала книги, которые показывали вместе с исходными, затем похожие по содержанию
+    seed_ids = [b['id'] for b in seeds]
+    recommendations = [
+        (by_id[book_id], score) for book_id, score in await fetch_neighbours(session, seed_ids, k=5)
+        if book_id in by_id
     ]
+    recommender = await asyncio.to_thread(get_recommender, catalog)
+    if recommender is not None:
+        shown = {book['id'] for book, _ in recommendations}
+        recommendations += recommender.recommend(seed_ids, k=5, exclude=shown)
+    recommendations = recommendations[:5]
+    
+    if not recommendations and recommender is None:
+        quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+        await message.answer(quick_lists.bestsellers, parse_mode="HTML")
+        return
     
-    recommendations = await openai_client.generate_personal_recommendation(
-        mock_preferences, mock_history
-    )
-    
-    await message.answer(
-        f"🎯 *Персональные рекомендации для вас:*\n\n{recommendations}",
-        parse_mode="Markdown"
+    await message.answer(format_recommendations(recommendations, seeds), parse_mode="HTML")
+    for book, score in recommendations:
+        await write_behind.add(Recommendation, {
+            'user_id': user_id,
+            'book_id': book['id'],
+            'match_score': score,
+            'created_at': datetime.datetime.now(),
+        })
+    
+    # Пояснение ИИ по реальным данным пользователя
+    preferences = {**summary_preferences(summary), **canonical_search_params(params)}
+    history = [f"{b['title']} - {b['author']}" for b in seeds]
+    await stream_answer(
+        message,
+        "🎯 *Персональные рекомендации для вас:*\n\n",
+        openai_client.stream_personal_recommendation(preferences, history)
     )
 
+def format_recommendations(recommendations: List, seeds: List[Dict]) -> str:
+    """Список рекомендованных книг из каталога"""
+    if not recommendations:
+        return "😕 Не удалось подобрать похожие книги. Попробуйте поиск по критериям."
+    seed_titles = ", ".join(html.escape(b['title'], quote=False) for b in seeds)
+    response = f"⭐ <b>Похоже на: {seed_titles}</b>\n\n"
+    for i, (book, score) in enumerate(recommendations, 1):
+        response += f"{i}. <b>{html.escape(book['title'], quote=False)}</b> - {html.escape(book['author'], quote=False)}\n"
+        response += f"   ⭐ Рейтинг: {book.get('rating', 'нет')}/5 · сходство {score:.0%}\n\n"
+    return response
+
 @router.message(F.text == "🔍 Быстрый поиск")
 async def quick_search(message: Message):
     """Быстрый поиск"""
@@ -277,17 +372,65 @@ async def quick_search(message: Message):
     )
 
 @router.message(F.text == "🔥 Бестселлеры")
-async def show_bestsellers(message: Message):
+async def show_bestsellers(message: Message, catalog: CatalogSnapshot):
     """Показать бестселлеры"""
-    bestsellers = sorted(BOOKS_DATABASE, key=lambda x: x.get('rating', 0), reverse=True)[:5]
-    
-    response = "📈 *Топ-5 бестселлеров:*\n\n"
-    for i, book in enumerate(bestsellers, 1):
-        response += f"{i}. *{book['title']}* - {book['author']}\n"
-        response += f"   ⭐ Рейтинг: {book.get('rating', 'нет')}/5\n"
-        response += f"   💰 Цена: {book['price']} {book['currency']}\n\n"
-    
-    await message.answer(response, parse_mode="Markdown")
+    quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+    await message.answer(quick_lists.bestsellers, parse_mode="HTML")
+
+@router.message(F.text == "🎯 Новинки")
+async def show_new_releases(message: Message, catalog: CatalogSnapshot):
+    """Показать новинки"""
+    quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+    await message.answer(quick_lists.new, parse_mode="HTML")
+
+@router.message(F.text == "🏆 Классика")
+async def show_classics(message: Message, catalog: CatalogSnapshot):
+    """Показать классику"""
+    quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+    await message.answer(quick_lists.classics, parse_mode="HTML")
+
+@router.message(F.text == "📚 По жанрам")
+async def show_genres(message: Message, catalog: CatalogSnapshot):
+    """Выбор жанра для быстрого поиска"""
+    quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+    await message.answer("Выберите жанр:", reply_markup=quick_lists.genre_keyboard)
+
+@router.callback_query(F.data.startswith("quick_genre_"))
+async def show_genre_top(callback: CallbackQuery, catalog: CatalogSnapshot):
+    """Лучшие книги жанра"""
+    quick_lists = await asyncio.to_thread(get_quick_lists, catalog)
+    response = quick_lists.genre(callback.data.replace("quick_genre_", "", 1))
+    if response is None:
+        await callback.answer("Жанр не найден в каталоге", show_alert=True)
+        return
+    await callback.message.answer(response, parse_mode="HTML")
+    await callback.answer()
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery, catalog: CatalogSnapshot):
+    """Поиск по мере набора: лучшие по рейтингу книги по началу слов названия или автора"""
+    prefix = catalog.ready('prefix')
+    cache_time = INLINE_CACHE_TIME
+    if prefix is not None:
+        books = prefix.search(inline_query.query, INLINE_RESULTS)
+    else:
+        # Индекс слов нового снимка ещё строится: подстрока автора, ответ не кэшируется
+        query = inline_query.query.strip()
+        books = (catalog.search({'author': query}) if query else catalog.books)[:INLINE_RESULTS]
+        cache_time = 0
+    results = [
+        InlineQueryResultArticle(
+            id=f"{catalog.version}:{book['id']}",
+            title=book['title'],
+            description=f"{book['author']} · ⭐ {book.get('rating', '-')} · {book['price']} {book['currency']}",
+            input_message_content=InputTextMessageContent(
+                message_text=format_book_info(book, catalog.version), parse_mode="HTML"
+            ),
+        )
+        for book in books
+    ]
+    # Ответ одинаков для всех пользователей - Telegram кэширует его общим
+    await inline_query.answer(results, cache_time=cache_time, is_personal=False)
 
 @router.message(F.text == "❓ Помощь")
 async def show_help(message: Message):
@@ -305,9 +448,14 @@ async def show_help(message: Message):
     
     📖 *Моя библиотека* - сохраняйте понравившиеся книги (в разработке)
     
+    🔎 *Поиск в любом чате* - наберите имя бота через @ и начало названия или автора
+    
+    🔔 *Подписки* - сохраните критерии поиска, и бот пришлёт новые книги по ним
+    
     *Команды:*
     /start - Начало работы
     /help - Эта справка
+    /subscriptions - Мои подписки
     
     *Советы:*
     • Используйте несколько критериев для точного поиска
@@ -322,12 +470,7 @@ async def show_help(message: Message):
 async def process_genre_selection(callback: CallbackQuery):
     """Обработка выбора жанра"""
     genre = callback.data.replace("genre_", "")
-    user_id = callback.from_user.id
-    
-    if user_id not in search_params:
-        search_params[user_id] = {}
-    
-    search_params[user_id]['genre'] = genre
+    await search_sessions.set_param(callback.from_user.id, 'genre', genre)
     await callback.message.answer(f"Выбран жанр: {genre}")
     await callback.answer()
 
@@ -335,12 +478,7 @@ async def process_genre_selection(callback: CallbackQuery):
 async def process_rating_selection(callback: CallbackQuery):
     """Обработка выбора рейтинга"""
     rating = callback.data.replace("rating_", "")
-    user_id = callback.from_user.id
-    
-    if user_id not in search_params:
-        search_params[user_id] = {}
-    
-    search_params[user_id]['rating'] = rating
+    await search_sessions.set_param(callback.from_user.id, 'rating', rating)
     await callback.message.answer(f"Выбран рейтинг: {rating}")
     await callback.answer()
 
@@ -348,12 +486,7 @@ async def process_rating_selection(callback: CallbackQuery):
 async def process_price_selection(callback: CallbackQuery):
     """Обработка выбора цены"""
     price = callback.data.replace("price_", "")
-    user_id = callback.from_user.id
-    
-    if user_id not in search_params:
-        search_params[user_id] = {}
-    
-    search_params[user_id]['price'] = price
+    await search_sessions.set_param(callback.from_user.id, 'price', price)
     await callback.message.answer(f"Выбран ценовой диапазон: {price}")
     await callback.answer()
 
@@ -361,12 +494,7 @@ async def process_price_selection(callback: CallbackQuery):
 async def process_language_selection(callback: CallbackQuery):
     """Обработка выбора языка"""
     language = callback.data.replace("lang_", "")
-    user_id = callback.from_user.id
-    
-    if user_id not in search_params:
-        search_params[user_id] = {}
-    
-    search_params[user_id]['language'] = language
+    await search_sessions.set_param(callback.from_user.id, 'language', language)
     await callback.message.answer(f"Выбран язык: {language}")
     await callback.answer()
 
@@ -387,36 +515,118 @@ async def back_to_main_menu(message: Message):
         reply_markup=get_main_menu()
     )
 
-async def send_books_page(message: Message, user_id: int, page: int):
-    """Отправка страницы с книгами"""
-    books = search_params[user_id]['results']
-    start_idx = (page - 1) * 3
-    end_idx = start_idx + 3
-    page_books = books[start_idx:end_idx]
-    
+async def load_results_page(session: AsyncSession, user_id: int, page: int, meta: Dict[str, str],
+                            catalog: CatalogSnapshot) -> List[Dict]:
+    """Книги одной страницы текущего поиска пользователя"""
+    if meta.get('mode') == 'db':
+        # Поиск в БД: страница запрашивается по курсору конца предыдущей
+        after = await search_sessions.get_cursor(user_id, page) if page > 1 else None
+        if page > 1 and after is None:
+            return []
+        params = await search_sessions.get_params(user_id)
+        books, next_cursor = await fetch_books_page(session, params, after, PAGE_SIZE)
+        if next_cursor:
+            await search_sessions.save_cursor(user_id, page + 1, next_cursor)
+        return books
+    
+    # Книги восстанавливаются из каталога по ID; удалённые из каталога пропускаются
+    by_id = catalog.by_id
+    page_ids = await search_sessions.page_ids(user_id, page, PAGE_SIZE)
+    return [by_id[book_id] for book_id in page_ids if book_id in by_id]
+
+def _results_header(total: int) -> str:
+    return f"🔎 <b>Найдено книг: {total}</b>"
+
+def render_books_page(page_books: List[Dict], header: str = "", version: Optional[str] = None) -> List[str]:
+    """Тексты страницы: карточки книг объединяются в сообщения до лимита Telegram"""
+    texts = []
+    current = header
     for book in page_books:
-        book_text = format_book_info(book)
-        await message.answer(book_text, parse_mode="HTML")
-
-def format_book_info(book: Dict) -> str:
-    """Форматирование информации о книге"""
-    text = f"""
-📚 <b>{book['title']}</b>
-👤 <i>{book['author']}</i>
-
-🎭 <b>Жанр:</b> {book.get('genre', 'Не указан')}
-⭐ <b>Рейтинг:</b> {book.get('rating', 'Нет')}/5
-💰 <b>Цена:</b> {book['price']} {book['currency']}
-🗣️ <b>Язык:</b> {book.get('language', 'Не указан')}
-📅 <b>Год:</b> {book.get('publication_year', 'Не указан')}
-📖 <b>Страниц:</b> {book.get('pages', 'Не указано')}
-
-📝 <b>Описание:</b> {book.get('description', 'Нет описания')}
-
-🏷️ <b>Теги:</b> {', '.join(book.get('tags', []))}
-📚 <b>Форматы:</b> {', '.join(book.get('available_formats', []))}
-
-📖 ISBN: {book.get('isbn', 'Не указан')}
-🏢 Издательство: {book.get('publisher', 'Не указано')}
-"""
-    return text
+        card = format_book_info(book, version).strip()
+        if current and len(current) + 2 + len(card) > TELEGRAM_MESSAGE_LIMIT:
+            texts.append(current)
+            current = ""
+        current = f"{current}\n\n{card}" if current else card
+    if current:
+        texts.append(current)
+    return texts
+
+async def send_books_page(message: Message, page_books: List[Dict], header: str = "", reply_markup=None,
+                          version: Optional[str] = None):
+    """Отправка страницы с книгами: как правило, одним сообщением"""
+    await book_cards.prefetch(page_books, version)
+    texts = render_books_page(page_books, header, version)
+    for i, text in enumerate(texts):
+        await message.answer(
+            text, parse_mode="HTML",
+            reply_markup=reply_markup if i == len(texts) - 1 else None
+        )
+
+async def _edit_stream_message(reply: Message, text: str, parse_mode: Optional[str]) -> Optional[str]:
+    """Редактирование сообщения с ответом ИИ.
+
+    Незавершённая разметка может не разобраться - тогда текст уходит без неё.
+    Возвращает режим разметки, с которым правка прошла.
+    """
+    try:
+        await reply.edit_text(text, parse_mode=parse_mode)
+    except TelegramBadRequest as e:
+        if "not modified" in str(e):
+            return parse_mode
+        if not parse_mode or "parse entities" not in str(e):
+            raise
+        await reply.edit_text(text, parse_mode=None)
+        return None
+    return parse_mode
+
+async def _finish_stream_message(reply: Message, text: str, parse_mode: Optional[str]):
+    """Итоговая правка сообщения: её нельзя пропустить из-за лимита частоты"""
+    try:
+        await _edit_stream_message(reply, text, parse_mode)
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        await _edit_stream_message(reply, text, parse_mode)
+
+async def stream_answer(message: Message, header: str, chunks: AsyncIterator[str], parse_mode: str = "Markdown"):
+    """Потоковая отправка ответа: заглушка, затем правки по мере поступления текста"""
+    loop = asyncio.get_running_loop()
+    reply = await message.answer(f"{header}⏳ Готовлю ответ...", parse_mode=parse_mode)
+
+    text = ""
+    next_edit = 0.0
+    # Если промежуточная разметка не разобралась, до конца ответа правим без неё
+    interim_mode = parse_mode
+
+    async for chunk in chunks:
+        text += chunk
+
+        # Не влезаем в одно сообщение - закрываем его и продолжаем в новом;
+        # целый ответ из кэша приходит одним фрагментом и может занять несколько
+        while len(text) > TELEGRAM_MESSAGE_LIMIT - len(header):
+            limit = TELEGRAM_MESSAGE_LIMIT - len(header)
+            cut = text.rfind("\n", 0, limit)
+            if cut <= 0:
+                cut = limit
+            await _finish_stream_message(reply, header + text[:cut], parse_mode)
+            header, text = "", text[cut:].lstrip("\n")
+            reply = await message.answer("⏳ ...", parse_mode=None)
+
+        if loop.time() < next_edit or not text.strip():
+            continue
+
+        next_edit = loop.time() + STREAM_EDIT_INTERVAL
+        try:
+            interim_mode = await _edit_stream_message(reply, header + text + " ▌", interim_mode)
+        except TelegramRetryAfter as e:
+            next_edit = loop.time() + e.retry_after
+
+    if not text:
+        await reply.delete()
+        return
+
+    await _finish_stream_message(reply, header + text, parse_mode)
+
+def format_book_info(book: Dict, version: Optional[str] = None) -> str:
+    """Форматирование информации о книге (готовая карточка из кэша)"""
+    with CARD_LATENCY.time():
+        return book_cards.card(book, version)
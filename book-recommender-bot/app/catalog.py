@@ -0,0 +1,377 @@
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import os
+import threading
+from typing import List, Dict, Any, Callable, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import select, func
+from dotenv import load_dotenv
+
+from .catalog_index import CatalogIndex
+from .columnar_catalog import ColumnarCatalog
+from .mmap_catalog import BookList, MmapCatalog, write_catalog
+from .data import books_data
+from .data.books_data import BOOKS_DATABASE
+from .database import SessionLocal
+from .db_search import book_to_dict
+from .facets import FACETS, FacetIndex
+from .fuzzy_index import FuzzyIndex, KINDS as FUZZY_KINDS, SECTIONS as FUZZY_SECTIONS
+from .prefix_index import PrefixIndex, SECTIONS as PREFIX_SECTIONS
+from .models import Book
+from .redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Движок поиска: index - инвертированный индекс, columnar - колонки NumPy,
+# mmap - общий для процессов файл каталога (см. mmap_catalog.py),
+# db - SQL-запросы к таблице books (см. db_search.py)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'index')
+CATALOG_MMAP_PATH = os.getenv(
+    'CATALOG_MMAP_PATH', os.path.join(os.path.dirname(__file__), 'data', 'catalog.bin')
+)
+
+# Источник каталога в памяти: static - app/data/books_data.py,
+# db - таблица books, которую заполняет ingest.py
+CATALOG_SOURCE = os.getenv('CATALOG_SOURCE', 'static')
+# Автор и название ищутся по триграммам - с опечатками и в другой раскладке алфавита
+FUZZY_SEARCH = os.getenv('FUZZY_SEARCH', 'true').lower() == 'true'
+CATALOG_RELOAD_INTERVAL = float(os.getenv('CATALOG_RELOAD_INTERVAL', '30'))
+CATALOG_LOAD_BATCH = int(os.getenv('CATALOG_LOAD_BATCH', '10000'))
+# Ключ Redis, в который загрузка каталога пишет его новую версию
+CATALOG_VERSION_KEY = 'catalog:version'
+
+def compute_catalog_version(books: List[Dict]) -> str:
+    """Версия каталога - короткий хэш его содержимого"""
+    payload = json.dumps(books, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога: книги, версия и индексы поиска по ним.
+
+    Снимок строится целиком, обычно в фоновом потоке, и заменяет текущий
+    одним присваиванием. Обработчик берёт снимок один раз на обновление
+    (см. CatalogMiddleware), поэтому замена каталога посреди запроса не
+    смешивает данные двух версий. Производные данные (индексы поиска,
+    готовые списки) хранятся в самом снимке и уходят вместе с ним; они
+    готовятся в фоне уже после замены, поэтому обработчики, которым они
+    нужны без ожидания, берут их через ready(). Для файла каталога (mmap)
+    они не строятся, а открываются из его секций (file_sections()).
+    """
+
+    def __init__(self, index: Union[CatalogIndex, MmapCatalog], version: str, number: int = 1,
+                 columnar: Optional[ColumnarCatalog] = None):
+        self.version = version
+        # Порядковый номер снимка в процессе: растёт при каждой замене
+        self.number = number
+        self.index = index
+        self.books = index.books
+        self.by_id = index.by_id
+        self.columnar = columnar
+        self._derived: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, books: List[Dict], version: str, number: int = 1) -> "CatalogSnapshot":
+        """Снимок по списку книг; для mmap книги сначала записываются в файл"""
+        if SEARCH_BACKEND == 'mmap':
+            write_catalog(books, version, CATALOG_MMAP_PATH, catalog_file_sections())
+            return cls.open(CATALOG_MMAP_PATH, number)
+        columnar = ColumnarCatalog(books) if SEARCH_BACKEND == 'columnar' else None
+        return cls(CatalogIndex(books), version, number, columnar)
+
+    @classmethod
+    def open(cls, path: str, number: int = 1) -> "CatalogSnapshot":
+        """Снимок из файла каталога: открывается за миллисекунды"""
+        index = MmapCatalog(path)
+        return cls(index, index.version, number)
+
+    @property
+    def engine(self) -> Union[CatalogIndex, ColumnarCatalog, MmapCatalog]:
+        """Движок поиска в памяти, выбранный в SEARCH_BACKEND (для db - индекс)"""
+        return self.columnar if self.columnar is not None else self.index
+
+    @property
+    def fuzzy(self) -> FuzzyIndex:
+        """Триграммный индекс авторов и названий снимка (для mmap - из файла каталога)"""
+        def build() -> FuzzyIndex:
+            sections = self.file_sections('fuzzy', FUZZY_SECTIONS)
+            if sections is not None:
+                return FuzzyIndex.from_sections(sections)
+            return FuzzyIndex(self.books)
+        return self.derived('fuzzy', build)
+
+    @property
+    def prefix(self) -> PrefixIndex:
+        """Индекс слов названий и авторов для поиска по мере набора (inline-режим; для mmap - из файла)"""
+        def build() -> PrefixIndex:
+            sections = self.file_sections('prefix', PREFIX_SECTIONS)
+            if sections is not None:
+                return PrefixIndex.from_sections(self.books, sections)
+            return PrefixIndex(self.books)
+        return self.derived('prefix', build)
+
+    @property
+    def facets(self) -> FacetIndex:
+        """Битовые карты вариантов критериев для счётчиков на клавиатурах"""
+        return self.derived('facets', lambda: FacetIndex(self.index))
+
+    def _fuzzy_candidates(self, params: Dict) -> Tuple[Dict, Optional[List[int]]]:
+        """Критерии без автора и названия и ранги книг, найденных по ним.
+
+        Автор сначала ищется точной подстрокой, как без нечёткого поиска:
+        триграммы нужны, только если она ничего не нашла, поэтому выдача
+        никогда не хуже прежней. Название раньше не искалось - только нечётко.
+        """
+        candidates = None
+        # Пока индекс нового снимка строится, автор ищется движком по подстроке
+        fuzzy = self.ready('fuzzy') if FUZZY_SEARCH else None
+        if fuzzy is not None:
+            texts = {kind: params[kind] for kind in FUZZY_KINDS if params.get(kind)}
+            if texts:
+                params = {key: value for key, value in params.items() if key not in texts}
+                for kind, text in texts.items():
+                    ranks = self.index.search_ranks({kind: text}) if kind == 'author' else []
+                    if not ranks:
+                        ranks = fuzzy.match_ranks(text, kind)
+                    candidates = ranks if candidates is None else sorted(set(candidates).intersection(ranks))
+        return params, candidates
+
+    def search(self, params: Dict) -> List[Dict]:
+        """Поиск по снимку: автор и название - с опечатками, остальное - движком поиска"""
+        params, candidates = self._fuzzy_candidates(params)
+        return self.engine.search(params, candidates)
+
+    def search_ranks(self, params: Dict) -> List[int]:
+        """Ранги найденных книг (по индексу снимка)"""
+        params, candidates = self._fuzzy_candidates(params)
+        return self.index.search_ranks(params, candidates)
+
+    def facet_counts(self, facet: str, params: Dict) -> Optional[Dict[str, int]]:
+        """Число книг для каждого варианта критерия facet при остальных выбранных критериях.
+
+        None, пока битовые карты снимка не готовы: клавиатура выводится без чисел.
+        """
+        facets = self.ready('facets')
+        if facets is None:
+            return None
+        # Автор, годы и жанр не с клавиатуры сужают выдачу поиском, варианты считаются по картам
+        rest = {
+            key: value for key, value in params.items()
+            if value and key != facet and (key not in FACETS or not facets.indexed(key, value))
+        }
+        matching = self.search_ranks(rest) if rest else None
+        return facets.counts(facet, params, matching)
+
+    def derived(self, name: str, build: Callable[[], Any]) -> Any:
+        """Данные, вычисляемые по снимку один раз"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build()
+        return value
+
+    def ready(self, name: str) -> Optional[Any]:
+        """Производные данные, если они уже построены; сам вызов ничего не строит"""
+        return self._derived.get(name)
+
+    def file_sections(self, prefix: str, schema: Dict[str, str]) -> Optional[Dict[str, memoryview]]:
+        """Готовые секции производных данных из файла каталога (None - их надо строить)"""
+        if not isinstance(self.index, MmapCatalog):
+            return None
+        return self.index.sections(prefix, schema)
+
+_snapshot: Optional[CatalogSnapshot] = None
+_snapshot_lock = threading.Lock()
+# Подготовка производных данных снимка в фоне, после того как он стал текущим
+_warmers: List[Callable[[CatalogSnapshot], Any]] = []
+# Производные данные, которые write_catalog пишет в файл каталога: префикс секций -> сборка
+_file_sections: Dict[str, Callable[[Sequence[Dict]], Dict[str, Any]]] = {}
+_static_mtime: Optional[float] = None
+
+def current_catalog() -> CatalogSnapshot:
+    """Текущий снимок каталога (первый строится из books_data.py или открывается из файла)"""
+    snapshot = _snapshot
+    if snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _swap(_initial_snapshot())
+            snapshot = _snapshot
+    return snapshot
+
+def _initial_snapshot() -> CatalogSnapshot:
+    global _static_mtime
+    if SEARCH_BACKEND == 'mmap':
+        if os.path.exists(CATALOG_MMAP_PATH):
+            return CatalogSnapshot.open(CATALOG_MMAP_PATH)
+        if CATALOG_SOURCE == 'db':
+            return CatalogSnapshot.build(load_books_from_db(), db_catalog_version())
+    _static_mtime = _static_source_mtime()
+    return CatalogSnapshot.build(BOOKS_DATABASE, compute_catalog_version(BOOKS_DATABASE))
+
+def _swap(snapshot: CatalogSnapshot):
+    global _snapshot
+    _snapshot = snapshot
+    logger.info(f"Catalog {snapshot.version} (snapshot {snapshot.number}) is live: {len(snapshot.books)} books")
+
+def add_catalog_warmer(warm: Callable[[CatalogSnapshot], Any]):
+    """Функция, которая готовит производные данные каждого нового снимка (не задерживает замену)"""
+    _warmers.append(warm)
+
+def add_catalog_file_sections(prefix: str, build: Callable[[Sequence[Dict]], Dict[str, Any]]):
+    """Сборка производных данных по книгам в порядке рангов, которую надо хранить в файле каталога.
+
+    Процессы, открывшие файл, берут эти массивы из него (file_sections())
+    без сборки и копирования.
+    """
+    _file_sections[prefix] = build
+
+def catalog_file_sections() -> Dict[str, Callable[[Sequence[Dict]], Dict[str, Any]]]:
+    """Все сборки для write_catalog"""
+    return dict(_file_sections)
+
+def warm_catalog():
+    """Подготовка производных данных текущего снимка (первого; следующие готовит замена)"""
+    _warm(current_catalog())
+
+if FUZZY_SEARCH:
+    add_catalog_file_sections('fuzzy', FuzzyIndex.build_sections)
+    add_catalog_warmer(lambda snapshot: snapshot.fuzzy)
+add_catalog_file_sections('prefix', PrefixIndex.build_sections)
+add_catalog_warmer(lambda snapshot: snapshot.prefix)
+add_catalog_file_sections('facets', FacetIndex.build_sections)
+add_catalog_warmer(lambda snapshot: snapshot.facets)
+
+def catalog_version() -> str:
+    """Текущая версия каталога (меняется при любом изменении книг)"""
+    return current_catalog().version
+
+def get_books() -> List[Dict]:
+    """Книги текущего каталога"""
+    return current_catalog().books
+
+def get_catalog_index() -> Union[CatalogIndex, MmapCatalog]:
+    """Поисковый индекс текущего каталога"""
+    return current_catalog().index
+
+def search_backend() -> str:
+    """Текущий движок поиска"""
+    return SEARCH_BACKEND
+
+def get_search_engine() -> Union[CatalogIndex, ColumnarCatalog, MmapCatalog]:
+    """Движок поиска в памяти текущего каталога"""
+    return current_catalog().engine
+
+def db_catalog_version() -> str:
+    """Версия каталога в БД: по числу книг и времени последнего изменения"""
+    with SessionLocal() as session:
+        count, updated_at, max_id = session.execute(
+            select(func.count(Book.id), func.max(Book.updated_at), func.max(Book.id))
+        ).one()
+    return hashlib.sha1(f"{count}:{updated_at}:{max_id}".encode('utf-8')).hexdigest()[:12]
+
+def load_books_from_db(batch: int = CATALOG_LOAD_BATCH) -> List[Dict]:
+    """Все книги из таблицы books, читаются порциями по batch строк"""
+    with SessionLocal() as session:
+        result = session.execute(select(Book).order_by(Book.id).execution_options(yield_per=batch))
+        return [book_to_dict(book) for book in result.scalars()]
+
+def book_ids(books: Sequence[Dict]) -> List[int]:
+    """ID книг выдачи; выдача из файла каталога отдаёт их без создания словарей"""
+    if isinstance(books, BookList):
+        return books.ids()
+    return [book['id'] for book in books]
+
+def set_catalog(books: List[Dict], version: str) -> CatalogSnapshot:
+    """Замена каталога: снимок строится до замены, производные данные - в фоне после неё"""
+    return _install(CatalogSnapshot.build(books, version, current_catalog().number + 1))
+
+def _warm(snapshot: CatalogSnapshot):
+    for warm in _warmers:
+        # Снимок, который уже заменили, не стоит достраивать
+        if _snapshot is not None and _snapshot is not snapshot:
+            logger.info(f"Catalog snapshot {snapshot.number} replaced, skipping its remaining derived data")
+            return
+        try:
+            warm(snapshot)
+        except Exception as e:
+            logger.error(f"Error preparing catalog snapshot {snapshot.version}: {e}")
+
+def _install(snapshot: CatalogSnapshot) -> CatalogSnapshot:
+    """Снимок становится текущим сразу; производные данные готовятся в фоновом потоке.
+
+    Ошибка или долгая сборка одного из них не задерживает новый каталог:
+    до готовности обработчики обходятся без него (см. CatalogSnapshot.ready).
+    """
+    with _snapshot_lock:
+        _swap(snapshot)
+    threading.Thread(target=_warm, args=(snapshot,), name=f"catalog-warm-{snapshot.number}", daemon=True).start()
+    return snapshot
+
+def _static_source_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(books_data.__file__)
+    except OSError:
+        return None
+
+def _reload_static() -> str:
+    """Перечитывание books_data.py, если файл изменился"""
+    global _static_mtime
+    mtime = _static_source_mtime()
+    if mtime == _static_mtime:
+        return current_catalog().version
+    books = importlib.reload(books_data).BOOKS_DATABASE
+    _static_mtime = mtime
+    version = compute_catalog_version(books)
+    if version != current_catalog().version:
+        set_catalog(books, version)
+    return version
+
+def _reload_mmap() -> str:
+    """Открытие файла каталога заново, если его заменили"""
+    current = current_catalog()
+    try:
+        stat = os.stat(CATALOG_MMAP_PATH)
+    except OSError:
+        return current.version
+    if getattr(current.index, 'file_id', None) != (stat.st_ino, stat.st_mtime_ns):
+        return _install(CatalogSnapshot.open(CATALOG_MMAP_PATH, current.number + 1)).version
+    return current.version
+
+def reload_catalog() -> str:
+    """Загрузка каталога из источника, если он изменился; возвращает версию"""
+    if SEARCH_BACKEND == 'mmap':
+        return _reload_mmap()
+    if CATALOG_SOURCE != 'db':
+        return _reload_static()
+    version = db_catalog_version()
+    if version != current_catalog().version:
+        set_catalog(load_books_from_db(), version)
+    return version
+
+async def run_catalog_refresher(interval: float = CATALOG_RELOAD_INTERVAL):
+    """Фоновая задача: новый снимок каталога строится в потоке и заменяет текущий.
+
+    Каталог из БД перечитывается после публикации новой версии в Redis,
+    books_data.py и файл каталога для mmap - после изменения файла.
+    """
+    # reload_catalog сам сверяет версию, лишняя проверка ничего не перестраивает
+    published = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if CATALOG_SOURCE != 'db' or SEARCH_BACKEND == 'mmap':
+                await asyncio.to_thread(reload_catalog)
+                continue
+            version = await get_redis().get(CATALOG_VERSION_KEY)
+            if version != published:
+                await asyncio.to_thread(reload_catalog)
+                published = version
+        except Exception as e:
+            logger.error(f"Error reloading catalog: {e}")
@@ -0,0 +1,168 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Any, Optional, Sequence
+
+# Жанры на клавиатуре выбора (ищутся по тегам книг)
+GENRES = [
+    "Фэнтези", "Научная фантастика", "Детектив", "Роман",
+    "Классика", "Исторический", "Биография", "Психология",
+    "Поэзия", "Драма", "Приключения", "Хоррор"
+]
+
+# Коды языков из клавиатуры и их названия в каталоге
+LANGUAGE_NAMES = {'ru': 'Русский', 'en': 'Английский', 'fr': 'Французский', 'de': 'Немецкий'}
+
+# Минимальный рейтинг для кнопок выбора рейтинга
+RATING_THRESHOLDS = {'4.5': 4.5, '4.0': 4.0, '3.5': 3.5}
+
+# Ценовые диапазоны: (нижняя граница не включительно, верхняя включительно)
+PRICE_RANGES = {
+    '0_500': (None, 500),
+    '500_1000': (500, 1000),
+    '1000_2000': (1000, 2000),
+    '2000': (2000, None),
+}
+
+def _contains(posting: Sequence[int], rank: int) -> bool:
+    """Проверка вхождения ранга в отсортированный список"""
+    i = bisect_left(posting, rank)
+    return i < len(posting) and posting[i] == rank
+
+def _build_postings(values_by_rank: List[List[str]]) -> Dict[str, List[int]]:
+    """Инвертированные списки: значение -> отсортированные ранги книг"""
+    postings: Dict[str, List[int]] = {}
+    for rank, values in enumerate(values_by_rank):
+        for value in values:
+            posting = postings.setdefault(value, [])
+            # Одно значение может встретиться у книги дважды
+            if not posting or posting[-1] != rank:
+                posting.append(rank)
+    return postings
+
+class CatalogIndex:
+    """Индекс каталога для поиска по критериям без полного перебора.
+
+    Книги пронумерованы рангами в порядке убывания рейтинга, поэтому любой
+    отсортированный список рангов - это уже отсортированная выдача.
+    Поиск начинается с самого короткого списка кандидатов, остальные
+    критерии проверяются точечно по колонкам и спискам.
+    """
+
+    def __init__(self, books: List[Dict[str, Any]]):
+        # Устойчивая сортировка: при равном рейтинге сохраняется порядок каталога
+        order = sorted(range(len(books)), key=lambda i: books[i].get('rating', 0), reverse=True)
+        self.books = [books[i] for i in order]
+        self.by_id = {book['id']: book for book in self.books}
+
+        # Колонки значений по рангу
+        self.ratings = [b.get('rating', 0) for b in self.books]
+        self.prices = [b.get('price', 0) for b in self.books]
+        self.years = [b.get('publication_year') for b in self.books]
+        self.authors_lower = [b['author'].lower() for b in self.books]
+
+        # Инвертированные списки по тегам, языку и жанру
+        self.tags = _build_postings([b.get('tags', []) for b in self.books])
+        self.languages = _build_postings([[b['language']] if b.get('language') else [] for b in self.books])
+        self.genres = _build_postings([[b['genre']] if b.get('genre') else [] for b in self.books])
+
+        # Рейтинги по рангу не возрастают: книги с рейтингом >= x - это префикс
+        self._neg_ratings = [-r for r in self.ratings]
+
+        # Отсортированные массивы для диапазонов цены и года
+        self._price_order = sorted(range(len(self.books)), key=self.prices.__getitem__)
+        self._price_keys = [self.prices[r] for r in self._price_order]
+        self._year_order = sorted(
+            (r for r in range(len(self.books)) if self.years[r] is not None),
+            key=self.years.__getitem__
+        )
+        self._year_keys = [self.years[r] for r in self._year_order]
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    def _price_slice(self, low: Optional[float], high: Optional[float]) -> Sequence[int]:
+        """Ранги книг с ценой в (low, high]"""
+        start = bisect_right(self._price_keys, low) if low is not None else 0
+        end = bisect_right(self._price_keys, high) if high is not None else len(self._price_keys)
+        return self._price_order[start:end]
+
+    def _year_slice(self, year_from: Optional[int], year_to: Optional[int]) -> Sequence[int]:
+        """Ранги книг с годом издания в [year_from, year_to]"""
+        start = bisect_left(self._year_keys, year_from) if year_from else 0
+        end = bisect_right(self._year_keys, year_to) if year_to else len(self._year_keys)
+        return self._year_order[start:end]
+
+    def search_ranks(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> List[int]:
+        """Ранги найденных книг в порядке убывания рейтинга.
+
+        candidates - отсортированные ранги, которыми ограничен поиск
+        (например, найденные нечётким поиском по автору).
+        """
+        # Каждый критерий: (число кандидатов, кандидаты или None,
+        # упорядочены ли кандидаты по рангу, проверка одного ранга)
+        constraints = []
+
+        if candidates is not None:
+            constraints.append((len(candidates), candidates, True, lambda r, p=candidates: _contains(p, r)))
+
+        if params.get('genre'):
+            posting = self.tags.get(params['genre'], [])
+            constraints.append((len(posting), posting, True, lambda r, p=posting: _contains(p, r)))
+
+        threshold = RATING_THRESHOLDS.get(params.get('rating'))
+        if threshold is not None:
+            end = bisect_right(self._neg_ratings, -threshold)
+            constraints.append((end, range(end), True, lambda r, t=threshold: self.ratings[r] >= t))
+
+        bounds = PRICE_RANGES.get(params.get('price'))
+        if bounds is not None:
+            low, high = bounds
+            ranks = self._price_slice(low, high)
+            constraints.append((len(ranks), ranks, False, lambda r, lo=low, hi=high: (
+                (lo is None or self.prices[r] > lo) and (hi is None or self.prices[r] <= hi)
+            )))
+
+        language = LANGUAGE_NAMES.get(params.get('language'))
+        if language is not None:
+            posting = self.languages.get(language, [])
+            constraints.append((len(posting), posting, True, lambda r, p=posting: _contains(p, r)))
+
+        year_from, year_to = params.get('year_from'), params.get('year_to')
+        if year_from or year_to:
+            ranks = self._year_slice(year_from, year_to)
+            constraints.append((len(ranks), ranks, False, lambda r, yf=year_from, yt=year_to: (
+                self.years[r] is not None
+                and (not yf or self.years[r] >= yf)
+                and (not yt or self.years[r] <= yt)
+            )))
+
+        if params.get('author'):
+            needle = params['author'].lower()
+            # Подстрока автора не индексируется - только проверка кандидатов
+            constraints.append((len(self.books), None, True, lambda r, n=needle: n in self.authors_lower[r]))
+
+        if not constraints:
+            return list(range(len(self.books)))
+
+        # Начинаем с самого короткого списка кандидатов
+        constraints.sort(key=lambda c: c[0])
+        _, candidates, ordered, first_check = constraints[0]
+        checks = [check for _, _, _, check in constraints[1:]]
+        if candidates is None:
+            candidates = range(len(self.books))
+            checks.insert(0, first_check)
+
+        result = [r for r in candidates if all(check(r) for check in checks)]
+
+        # Срезы по цене и году упорядочены по значению, а не по рангу:
+        # сортируется только итоговая выдача, а не весь каталог
+        if not ordered:
+            result.sort()
+        return result
+
+    def search(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        """Поиск книг по параметрам, отсортированных по убыванию рейтинга"""
+        return [self.books[r] for r in self.search_ranks(params, candidates)]
+
+    def count(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> int:
+        """Количество книг, подходящих под параметры"""
+        return len(self.search_ranks(params, candidates))
@@ -0,0 +1,126 @@
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .catalog_index import LANGUAGE_NAMES, RATING_THRESHOLDS, PRICE_RANGES
+
+# Значение для отсутствующего года издания или числа страниц
+MISSING = -1
+
+def _encode(values: List[Any]) -> Tuple[List[Any], np.ndarray]:
+    """Словарное кодирование: список уникальных значений и коды строк"""
+    categories: Dict[Any, int] = {}
+    codes = np.fromiter(
+        (categories.setdefault(v, len(categories)) for v in values),
+        dtype=np.int32, count=len(values)
+    )
+    dtype = np.uint8 if len(categories) <= 0xFF else np.uint16 if len(categories) <= 0xFFFF else np.uint32
+    return list(categories), codes.astype(dtype)
+
+class ColumnarCatalog:
+    """Колоночное представление каталога для векторной фильтрации.
+
+    Числовые поля хранятся в массивах NumPy, категориальные - словарными
+    кодами. Строки упорядочены по убыванию рейтинга (argsort при сборке),
+    поэтому выдача по маске уже отсортирована. Сами книги нужны только
+    для выдачи найденных строк.
+    """
+
+    def __init__(self, books: List[Dict[str, Any]]):
+        ratings = np.array([b.get('rating', 0) for b in books], dtype=np.float32)
+        order = np.argsort(-ratings, kind='stable')
+        self.books = [books[i] for i in order]
+        n = len(self.books)
+
+        # Числовые колонки
+        self.rating = ratings[order]
+        self.price = np.array([b.get('price', 0) for b in self.books], dtype=np.float32)
+        self.publication_year = np.array(
+            [b.get('publication_year', MISSING) for b in self.books], dtype=np.int16
+        )
+        self.pages = np.array([b.get('pages', MISSING) for b in self.books], dtype=np.int16)
+
+        # Категориальные колонки
+        self.languages, self.language = _encode([b.get('language') for b in self.books])
+        self.currencies, self.currency = _encode([b.get('currency') for b in self.books])
+        self.genres, self.genre = _encode([b.get('genre') for b in self.books])
+        self.authors, self.author = _encode([b['author'] for b in self.books])
+        self._authors_lower = np.array([a.lower() for a in self.authors])
+
+        # Теги многозначны: для каждой пары (книга, тег) - строка и код тега
+        tags_per_book = [b.get('tags', []) for b in self.books]
+        self.tags, tag_codes = _encode([t for tags in tags_per_book for t in tags])
+        self._tag_codes = tag_codes
+        self._tag_rows = np.repeat(
+            np.arange(n, dtype=np.uint32),
+            np.fromiter((len(tags) for tags in tags_per_book), dtype=np.int64, count=n)
+        )
+        self._tag_lookup = {tag: code for code, tag in enumerate(self.tags)}
+        self._language_lookup = {lang: code for code, lang in enumerate(self.languages)}
+
+    def __len__(self) -> int:
+        return len(self.books)
+
+    @property
+    def nbytes(self) -> int:
+        """Объём колонок в байтах (без самих книг)"""
+        arrays = (
+            self.rating, self.price, self.publication_year, self.pages,
+            self.language, self.currency, self.genre, self.author,
+            self._authors_lower, self._tag_codes, self._tag_rows
+        )
+        return sum(a.nbytes for a in arrays)
+
+    def mask(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Булева маска строк, подходящих под параметры (candidates - как в CatalogIndex)"""
+        if candidates is not None:
+            mask = np.zeros(len(self.books), dtype=bool)
+            mask[np.asarray(candidates, dtype=np.int64)] = True
+        else:
+            mask = np.ones(len(self.books), dtype=bool)
+
+        if params.get('genre'):
+            code = self._tag_lookup.get(params['genre'])
+            tag_mask = np.zeros(len(self.books), dtype=bool)
+            if code is not None:
+                tag_mask[self._tag_rows[self._tag_codes == code]] = True
+            mask &= tag_mask
+
+        threshold = RATING_THRESHOLDS.get(params.get('rating'))
+        if threshold is not None:
+            mask &= self.rating >= threshold
+
+        bounds = PRICE_RANGES.get(params.get('price'))
+        if bounds is not None:
+            low, high = bounds
+            if low is not None:
+                mask &= self.price > low
+            if high is not None:
+                mask &= self.price <= high
+
+        language = LANGUAGE_NAMES.get(params.get('language'))
+        if language is not None:
+            code = self._language_lookup.get(language)
+            mask &= self.language == code if code is not None else False
+
+        if params.get('author'):
+            # Подстрока ищется среди уникальных авторов, а не по всем книгам
+            matching = np.flatnonzero(np.char.find(self._authors_lower, params['author'].lower()) >= 0)
+            mask &= np.isin(self.author, matching)
+
+        if params.get('year_from') or params.get('year_to'):
+            mask &= self.publication_year != MISSING
+            if params.get('year_from'):
+                mask &= self.publication_year >= params['year_from']
+            if params.get('year_to'):
+                mask &= self.publication_year <= params['year_to']
+
+        return mask
+
+    def search(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        """Поиск книг по параметрам, отсортированных по убыванию рейтинга"""
+        return [self.books[i] for i in np.flatnonzero(self.mask(params, candidates))]
+
+    def count(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> int:
+        """Количество книг, подходящих под параметры"""
+        return int(np.count_nonzero(self.mask(params, candidates)))
@@ -0,0 +1,330 @@
+import logging
+import os
+import time
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from .models import SearchSession, Recommendation, JobWatermark, ItemCooccurrence, ItemInteractions, BookNeighbour
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+COOCCURRENCE_TOP_N = int(os.getenv('COOCCURRENCE_TOP_N', '20'))
+# Из одной выдачи учитываются только первые книги: их пользователь видел
+COOCCURRENCE_BASKET_LIMIT = int(os.getenv('COOCCURRENCE_BASKET_LIMIT', '20'))
+# Пары, встретившиеся реже, считаются шумом
+COOCCURRENCE_MIN_COUNT = int(os.getenv('COOCCURRENCE_MIN_COUNT', '2'))
+COOCCURRENCE_CHUNK_ROWS = int(os.getenv('COOCCURRENCE_CHUNK_ROWS', '1000000'))
+COOCCURRENCE_WRITE_BATCH = int(os.getenv('COOCCURRENCE_WRITE_BATCH', '10000'))
+
+_ID_MASK = (1 << 32) - 1
+
+def basket_pairs(baskets: np.ndarray, items: np.ndarray,
+                 limit: int = COOCCURRENCE_BASKET_LIMIT) -> Tuple[np.ndarray, np.ndarray]:
+    """Пары книг из общих корзин и сами книги корзин (без повторов).
+
+    Корзина - одна выдача поиска или рекомендации одному пользователю.
+    Пара кодируется одним int64: (меньший id << 32) | больший id.
+    Все пары строятся векторно, без цикла по корзинам.
+    """
+    order = np.lexsort((items, baskets))
+    baskets, items = baskets[order], items[order]
+    keep = np.ones(len(items), dtype=bool)
+    keep[1:] = (baskets[1:] != baskets[:-1]) | (items[1:] != items[:-1])
+    baskets, items = baskets[keep], items[keep]
+    if not len(items):
+        return np.empty(0, dtype=np.int64), items
+
+    starts = np.flatnonzero(np.r_[True, baskets[1:] != baskets[:-1]])
+    sizes = np.diff(np.r_[starts, len(items)])
+    rank = np.arange(len(items)) - np.repeat(starts, sizes)
+    if limit:
+        # Ограничение размера корзины: число пар растёт квадратично
+        keep = rank < limit
+        items = items[keep]
+        sizes = np.minimum(sizes, limit)
+        starts = np.r_[0, np.cumsum(sizes)[:-1]]
+
+    # Каждая книга образует пары со всеми следующими книгами своей корзины
+    ends = np.repeat(starts + sizes, sizes)
+    lengths = ends - np.arange(len(items)) - 1
+    total = int(lengths.sum())
+    first = np.repeat(np.arange(len(items)), lengths)
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    left = items[first].astype(np.int64)
+    right = items[first + 1 + offsets].astype(np.int64)
+    return (left << 32) | right, items
+
+def _merge_counts(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Сложение счётчиков с одинаковыми ключами"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts, minlength=len(unique)).astype(np.int64)
+
+class CooccurrenceCounter:
+    """Разреженная матрица совместных появлений книг в корзинах.
+
+    Хранится в виде отсортированных ключей пар и счётчиков; новые пары
+    копятся частями и сливаются, когда их становится много.
+    """
+
+    def __init__(self, compact_every: int = 5_000_000):
+        self.compact_every = compact_every
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        self.pair_counts = np.empty(0, dtype=np.int64)
+        self.item_ids = np.empty(0, dtype=np.int64)
+        self.item_counts = np.empty(0, dtype=np.int64)
+        self._pending: List[np.ndarray] = []
+        self._pending_items: List[np.ndarray] = []
+        self._pending_size = 0
+
+    def add(self, baskets: np.ndarray, items: np.ndarray):
+        """Учёт части взаимодействий; корзины не должны разрываться между частями"""
+        keys, basket_items = basket_pairs(baskets, items)
+        self._pending.append(keys)
+        self._pending_items.append(basket_items.astype(np.int64))
+        self._pending_size += len(keys)
+        if self._pending_size >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self.pair_keys, *self._pending])
+        counts = np.concatenate([self.pair_counts, np.ones(len(keys) - len(self.pair_keys), dtype=np.int64)])
+        self.pair_keys, self.pair_counts = _merge_counts(keys, counts)
+
+        items = np.concatenate([self.item_ids, *self._pending_items])
+        counts = np.concatenate([self.item_counts, np.ones(len(items) - len(self.item_ids), dtype=np.int64)])
+        self.item_ids, self.item_counts = _merge_counts(items, counts)
+
+        self._pending, self._pending_items, self._pending_size = [], [], 0
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Пары (book_a, book_b, count), book_a < book_b"""
+        self._compact()
+        return self.pair_keys >> 32, self.pair_keys & _ID_MASK, self.pair_counts
+
+    def items(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Книги и число корзин с ними"""
+        self._compact()
+        return self.item_ids, self.item_counts
+
+    @property
+    def nbytes(self) -> int:
+        self._compact()
+        return sum(a.nbytes for a in (self.pair_keys, self.pair_counts, self.item_ids, self.item_counts))
+
+def top_neighbours(book_a: np.ndarray, book_b: np.ndarray, counts: np.ndarray,
+                   item_ids: np.ndarray, item_counts: np.ndarray, n: int = COOCCURRENCE_TOP_N,
+                   min_count: int = COOCCURRENCE_MIN_COUNT,
+                   sources: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Первые n соседей каждой книги по косинусу: count / sqrt(n_a * n_b)"""
+    keep = counts >= min_count
+    book_a, book_b, counts = book_a[keep], book_b[keep], counts[keep]
+    # Матрица симметрична: каждая пара даёт соседа обеим книгам
+    src = np.concatenate([book_a, book_b])
+    dst = np.concatenate([book_b, book_a])
+    counts = np.concatenate([counts, counts])
+    if sources is not None:
+        keep = np.isin(src, sources)
+        src, dst, counts = src[keep], dst[keep], counts[keep]
+    if not len(src):
+        return src, dst, np.empty(0, dtype=np.float32)
+
+    order = np.argsort(item_ids)
+    ids_sorted, baskets_sorted = item_ids[order], item_counts[order]
+    n_src = baskets_sorted[np.searchsorted(ids_sorted, src)]
+    n_dst = baskets_sorted[np.searchsorted(ids_sorted, dst)]
+    scores = (counts / np.sqrt(n_src * n_dst)).astype(np.float32)
+
+    order = np.lexsort((dst, -scores, src))
+    src, dst, scores = src[order], dst[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+    rank = np.arange(len(src)) - np.repeat(starts, np.diff(np.r_[starts, len(src)]))
+    keep = rank < n
+    return src[keep], dst[keep], scores[keep]
+
+def _get_watermark(session: Session, name: str) -> int:
+    return session.scalar(select(JobWatermark.last_id).where(JobWatermark.name == name)) or 0
+
+def _set_watermark(session: Session, name: str, last_id: int):
+    statement = insert(JobWatermark).values(name=name, last_id=last_id)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=['name'], set_={'last_id': statement.excluded.last_id, 'updated_at': func.now()}
+    ))
+
+def _chunks(rows: Iterable[Tuple[int, int]], size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Пары (корзина, книга), упорядоченные по корзине, частями без разрыва корзин"""
+    baskets: List[int] = []
+    items: List[int] = []
+    for basket, item in rows:
+        if len(items) >= size and basket != baskets[-1]:
+            yield np.array(baskets, dtype=np.int64), np.array(items, dtype=np.int64)
+            baskets, items = [], []
+        baskets.append(basket)
+        items.append(item)
+    if items:
+        yield np.array(baskets, dtype=np.int64), np.array(items, dtype=np.int64)
+
+def _search_rows(session: Session, after: int, until: int) -> Iterator[Tuple[int, int]]:
+    """Корзины из выдач поиска: одна сессия поиска - одна корзина"""
+    result = session.execute(
+        select(SearchSession.id, SearchSession.results)
+        .where(SearchSession.id > after, SearchSession.id <= until)
+        .order_by(SearchSession.id)
+        .execution_options(yield_per=10_000)
+    )
+    for session_id, results in result:
+        for book_id in (results or [])[:COOCCURRENCE_BASKET_LIMIT]:
+            # Чётные корзины - поиск, нечётные - рекомендации
+            yield session_id * 2, book_id
+
+def _recommendation_rows(session: Session, after: int, until: int) -> Iterator[Tuple[int, int]]:
+    """Корзины из рекомендаций: все новые рекомендации одному пользователю"""
+    result = session.execute(
+        select(Recommendation.user_id, Recommendation.book_id)
+        .where(Recommendation.id > after, Recommendation.id <= until)
+        .order_by(Recommendation.user_id, Recommendation.id)
+        .execution_options(yield_per=10_000)
+    )
+    for user_id, book_id in result:
+        yield user_id * 2 + 1, book_id
+
+def _upsert(session: Session, model, index_elements: List[str], column: str, rows: List[Dict[str, Any]]):
+    """Пакетное прибавление счётчиков"""
+    for start in range(0, len(rows), COOCCURRENCE_WRITE_BATCH):
+        statement = insert(model).values(rows[start:start + COOCCURRENCE_WRITE_BATCH])
+        session.execute(statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: getattr(model, column) + getattr(statement.excluded, column)}
+        ))
+
+def run_cooccurrence_job(session: Session) -> Dict[str, Any]:
+    """Инкрементальное обновление матрицы совместных показов и таблицы соседей.
+
+    Обрабатываются только строки search_sessions и recommendations после
+    сохранённых отметок. Приращения счётчиков прибавляются к таблицам,
+    соседи пересчитываются для затронутых книг и книг, которые с ними
+    встречались: нормировка их оценок зависит от числа корзин затронутых
+    книг. Всё выполняется
+    в одной транзакции вместе со сдвигом отметок.
+    """
+    started = time.perf_counter()
+    counter = CooccurrenceCounter()
+    watermarks = {}
+    rows = 0
+
+    sources = (
+        ('cooccurrence:search_sessions', SearchSession, _search_rows),
+        ('cooccurrence:recommendations', Recommendation, _recommendation_rows),
+    )
+    for name, model, read_rows in sources:
+        after = _get_watermark(session, name)
+        # Строки, добавленные во время работы, войдут в следующий запуск
+        until = session.scalar(select(func.max(model.id))) or 0
+        if until <= after:
+            continue
+        for baskets, items in _chunks(read_rows(session, after, until), COOCCURRENCE_CHUNK_ROWS):
+            counter.add(baskets, items)
+            rows += len(items)
+        watermarks[name] = until
+
+    book_a, book_b, counts = counter.pairs()
+    item_ids, item_counts = counter.items()
+    rescored = item_ids
+    if len(item_ids):
+        _upsert(session, ItemCooccurrence, ['book_a', 'book_b'], 'count', [
+            {'book_a': int(a), 'book_b': int(b), 'count': int(c)} for a, b, c in zip(book_a, book_b, counts)
+        ])
+        _upsert(session, ItemInteractions, ['book_id'], 'baskets', [
+            {'book_id': int(i), 'baskets': int(c)} for i, c in zip(item_ids, item_counts)
+        ])
+        rescored = _with_partners(session, item_ids)
+        _rebuild_neighbours(session, rescored)
+
+    for name, last_id in watermarks.items():
+        _set_watermark(session, name, last_id)
+    session.commit()
+
+    stats = {
+        'rows': rows,
+        'pairs': len(counts),
+        'books': len(item_ids),
+        'rescored': len(rescored),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    logger.info(f"Co-occurrence job finished: {stats}")
+    return stats
+
+def _with_partners(session: Session, affected: np.ndarray) -> np.ndarray:
+    """Затронутые книги и все книги, которые встречались с ними не реже порога"""
+    books = [affected]
+    for start in range(0, len(affected), COOCCURRENCE_WRITE_BATCH):
+        ids = [int(i) for i in affected[start:start + COOCCURRENCE_WRITE_BATCH]]
+        pairs = session.execute(
+            select(ItemCooccurrence.book_a, ItemCooccurrence.book_b)
+            .where(ItemCooccurrence.book_a.in_(ids) | ItemCooccurrence.book_b.in_(ids))
+            .where(ItemCooccurrence.count >= COOCCURRENCE_MIN_COUNT)
+        ).all()
+        books.append(np.array([book for pair in pairs for book in pair], dtype=np.int64))
+    return np.unique(np.concatenate(books))
+
+def _rebuild_neighbours(session: Session, affected: np.ndarray):
+    """Пересчёт соседей затронутых книг по полным счётчикам из БД"""
+    for start in range(0, len(affected), COOCCURRENCE_WRITE_BATCH):
+        ids = [int(i) for i in affected[start:start + COOCCURRENCE_WRITE_BATCH]]
+        pairs = session.execute(
+            select(ItemCooccurrence.book_a, ItemCooccurrence.book_b, ItemCooccurrence.count)
+            .where(ItemCooccurrence.book_a.in_(ids) | ItemCooccurrence.book_b.in_(ids))
+            .where(ItemCooccurrence.count >= COOCCURRENCE_MIN_COUNT)
+        ).all()
+        session.execute(delete(BookNeighbour).where(BookNeighbour.book_id.in_(ids)))
+        if not pairs:
+            continue
+
+        book_a, book_b, counts = (np.array(column, dtype=np.int64) for column in zip(*pairs))
+        involved = [int(i) for i in np.unique(np.concatenate([book_a, book_b]))]
+        interactions = session.execute(
+            select(ItemInteractions.book_id, ItemInteractions.baskets)
+            .where(ItemInteractions.book_id.in_(involved))
+        ).all()
+        item_ids, item_counts = (np.array(column, dtype=np.int64) for column in zip(*interactions))
+
+        src, dst, scores = top_neighbours(
+            book_a, book_b, counts, item_ids, item_counts, sources=np.array(ids, dtype=np.int64)
+        )
+        rows = [
+            {'book_id': int(s), 'neighbour_id': int(d), 'score': float(c)}
+            for s, d, c in zip(src, dst, scores)
+        ]
+        for offset in range(0, len(rows), COOCCURRENCE_WRITE_BATCH):
+            session.execute(insert(BookNeighbour).values(rows[offset:offset + COOCCURRENCE_WRITE_BATCH]))
+
+async def fetch_neighbours(session: AsyncSession, seed_ids: List[int], k: int = 5) -> List[Tuple[int, float]]:
+    """Книги, которые чаще всего показывали вместе с данными: (id, среднее сходство)"""
+    if not seed_ids:
+        return []
+    total = func.sum(BookNeighbour.score)
+    result = await session.execute(
+        select(BookNeighbour.neighbour_id, total)
+        .where(BookNeighbour.book_id.in_(seed_ids), BookNeighbour.neighbour_id.not_in(seed_ids))
+        .group_by(BookNeighbour.neighbour_id)
+        .order_by(total.desc(), BookNeighbour.neighbour_id)
+        .limit(k)
+    )
+    return [(book_id, score / len(seed_ids)) for book_id, score in result]
+
+if __name__ == "__main__":
+    # Запуск по расписанию (cron): python -m app.cooccurrence
+    from .database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as db:
+        run_cooccurrence_job(db)
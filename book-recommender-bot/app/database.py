@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Dict
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +16,66 @@ engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Асинхронный движок для обработчиков бота (asyncpg)
+ASYNC_DATABASE_URL = os.getenv(
+    'ASYNC_DATABASE_URL',
+    DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
+)
+
+class PoolMetrics:
+    """Метрики пула соединений: выдача соединений и время ожидания"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+pool_metrics = PoolMetrics()
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Пул asyncpg, который замеряет время получения соединения"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=MeteredQueuePool,
+    # Соединений не больше, чем одновременно обрабатываемых обновлений с БД
+    pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+    pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+    pool_recycle=3600,
+    pool_pre_ping=True
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+def get_pool_stats() -> Dict[str, float]:
+    """Состояние асинхронного пула: занятые соединения и ожидание"""
+    pool = async_engine.sync_engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+        'checkouts': pool_metrics.checkouts,
+        'timeouts': pool_metrics.timeouts,
+        'wait_avg_ms': pool_metrics.wait_total / pool_metrics.checkouts * 1000 if pool_metrics.checkouts else 0.0,
+        'wait_max_ms': pool_metrics.wait_max * 1000,
+    }
+
 def get_db():
     """Получение сессии базы данных"""
     db = SessionLocal()
@@ -21,6 +85,14 @@ def get_db():
         db.close()
 
 def init_db():
-    """Инициализация базы данных"""
-    from .models import Base
-    Base.metadata.create_all(bind=engine)
+    """Инициализация базы данных: применение миграций Alembic"""
+    from alembic import command
+    from alembic.config import Config
+
+    migrations_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+    config = Config(os.path.join(migrations_dir, 'alembic.ini'))
+    config.set_main_option('script_location', migrations_dir)
+    config.set_main_option('sqlalchemy.url', DATABASE_URL.replace('%', '%%'))
+    # Логирование уже настроено приложением
+    config.attributes['configure_logger'] = False
+    command.upgrade(config, 'head')
@@ -0,0 +1,112 @@
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import select, func, and_, or_, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+from .catalog_index import LANGUAGE_NAMES, RATING_THRESHOLDS, PRICE_RANGES
+from .models import Book
+
+# Курсор keyset-пагинации: (рейтинг, id) последней книги на странице
+Cursor = Tuple[Optional[float], int]
+
+BOOK_FIELDS = (
+    'id', 'title', 'author', 'genre', 'isbn', 'publisher', 'publication_year', 'pages',
+    'language', 'rating', 'price', 'currency', 'description', 'tags', 'available_formats'
+)
+
+def book_to_dict(book: Book) -> Dict[str, Any]:
+    """Книга из БД в том же виде, что и записи BOOKS_DATABASE"""
+    data = {field: getattr(book, field) for field in BOOK_FIELDS}
+    data['tags'] = data['tags'] or []
+    data['available_formats'] = data['available_formats'] or []
+    return {k: v for k, v in data.items() if v is not None}
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_filters(params: Dict[str, Any]) -> List[Any]:
+    """Условия WHERE для тех же критериев, что и в search_books"""
+    filters = []
+
+    if params.get('genre'):
+        # tags @> '["жанр"]' - использует GIN-индекс ix_books_tags
+        filters.append(type_coerce(Book.tags, JSONB).contains([params['genre']]))
+
+    threshold = RATING_THRESHOLDS.get(params.get('rating'))
+    if threshold is not None:
+        filters.append(Book.rating >= threshold)
+
+    bounds = PRICE_RANGES.get(params.get('price'))
+    if bounds is not None:
+        low, high = bounds
+        if low is not None:
+            filters.append(Book.price > low)
+        if high is not None:
+            filters.append(Book.price <= high)
+
+    language = LANGUAGE_NAMES.get(params.get('language'))
+    if language is not None:
+        filters.append(Book.language == language)
+
+    if params.get('author'):
+        # ILIKE по подстроке обслуживается триграммным индексом ix_books_author_trgm
+        filters.append(Book.author.ilike(f"%{_escape_like(params['author'])}%", escape='\\'))
+
+    if params.get('year_from'):
+        filters.append(Book.publication_year >= params['year_from'])
+    if params.get('year_to'):
+        filters.append(Book.publication_year <= params['year_to'])
+
+    return filters
+
+def _after(cursor: Cursor):
+    """Условие «после курсора» для порядка rating DESC NULLS LAST, id"""
+    rating, book_id = cursor
+    if rating is None:
+        return and_(Book.rating.is_(None), Book.id > book_id)
+    return or_(
+        Book.rating < rating,
+        Book.rating.is_(None),
+        and_(Book.rating == rating, Book.id > book_id)
+    )
+
+def build_search_query(params: Dict[str, Any], after: Optional[Cursor] = None, limit: int = 3) -> Select:
+    """Запрос страницы результатов с keyset-пагинацией по индексу ix_books_rating_id"""
+    query = select(Book).where(*search_filters(params))
+    if after is not None:
+        query = query.where(_after(after))
+    return query.order_by(Book.rating.desc().nullslast(), Book.id).limit(limit)
+
+def build_count_query(params: Dict[str, Any]) -> Select:
+    """Запрос количества найденных книг"""
+    return select(func.count()).select_from(Book).where(*search_filters(params))
+
+def page_cursor(books: List[Dict[str, Any]]) -> Optional[Cursor]:
+    """Курсор для следующей страницы по последней книге текущей"""
+    if not books:
+        return None
+    return books[-1].get('rating'), books[-1]['id']
+
+def search_books_page(session: Session, params: Dict[str, Any], after: Optional[Cursor] = None,
+                      limit: int = 3) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+    """Страница найденных книг и курсор следующей страницы"""
+    books = [book_to_dict(b) for b in session.scalars(build_search_query(params, after, limit))]
+    return books, page_cursor(books) if len(books) == limit else None
+
+def count_books(session: Session, params: Dict[str, Any]) -> int:
+    """Количество книг в БД, подходящих под параметры"""
+    return session.scalar(build_count_query(params))
+
+async def fetch_books_page(session: AsyncSession, params: Dict[str, Any], after: Optional[Cursor] = None,
+                           limit: int = 3) -> Tuple[List[Dict[str, Any]], Optional[Cursor]]:
+    """Асинхронный вариант search_books_page для обработчиков бота"""
+    result = await session.scalars(build_search_query(params, after, limit))
+    books = [book_to_dict(b) for b in result]
+    return books, page_cursor(books) if len(books) == limit else None
+
+async def fetch_books_count(session: AsyncSession, params: Dict[str, Any]) -> int:
+    """Асинхронный вариант count_books"""
+    return await session.scalar(build_count_query(params))
@@ -0,0 +1,131 @@
+from typing import Dict, List, Any, Optional, Sequence, Union
+
+import numpy as np
+
+from .catalog_index import CatalogIndex, GENRES, LANGUAGE_NAMES, PRICE_RANGES, RATING_THRESHOLDS
+from .mmap_catalog import MmapCatalog
+
+# Критерии, у вариантов которых есть битовые карты (клавиатуры выбора)
+FACETS = ('genre', 'rating', 'price', 'language')
+
+# Карты строятся только для вариантов, которые есть на кнопках клавиатур
+OPTIONS = {
+    'genre': tuple(GENRES),
+    'rating': tuple(RATING_THRESHOLDS),
+    'price': tuple(PRICE_RANGES),
+    'language': tuple(LANGUAGE_NAMES),
+}
+
+# Число единиц в каждом байте
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _option_names() -> bytes:
+    """Список вариантов для файла каталога: по нему видно, что карты в файле - для этих же кнопок"""
+    return '\n'.join(f"{facet}={value}" for facet, values in OPTIONS.items() for value in values).encode('utf-8')
+
+def _bitmap(ranks: Sequence[int], size: int) -> np.ndarray:
+    """Упакованная битовая карта рангов: бит r установлен для каждого ранга r"""
+    mask = np.zeros(size, dtype=bool)
+    mask[np.asarray(ranks, dtype=np.int64)] = True
+    return np.packbits(mask, bitorder='little')
+
+class FacetIndex:
+    """Карты вариантов критериев поиска для счётчиков на кнопках.
+
+    Для каждого варианта с клавиатуры хранится множество рангов книг,
+    которые под него подходят: частый вариант - упакованной битовой
+    картой (n/8 байт), редкий - отсортированным массивом рангов, если он
+    меньше карты. Множества берутся из движка поиска снимка, поэтому
+    правила совпадают с поиском; в файл каталога (mmap) они записываются
+    готовыми и открываются без сборки и копирования. Число книг для варианта
+    при уже выбранных критериях - число единиц в пересечении его
+    множества с картой остальных критериев, без поиска на каждый вариант.
+    """
+
+    def __init__(self, index: Union[CatalogIndex, MmapCatalog]):
+        self.size = len(index)
+        self.all = np.packbits(np.ones(self.size, dtype=bool), bitorder='little')
+        options = self._file_options(index) if isinstance(index, MmapCatalog) else None
+        self.options = options if options is not None else self._build(index)
+
+    @staticmethod
+    def _build(index: Union[CatalogIndex, MmapCatalog]) -> Dict[str, Dict[str, np.ndarray]]:
+        size = len(index)
+        options: Dict[str, Dict[str, np.ndarray]] = {}
+        for facet, values in OPTIONS.items():
+            options[facet] = {}
+            for value in values:
+                ranks = np.asarray(index.search_ranks({facet: value}), dtype=np.uint32)
+                # 4 байта на ранг против n/8 байт на карту
+                sparse = len(ranks) * 32 < size
+                options[facet][value] = ranks if sparse else _bitmap(ranks, size)
+        return options
+
+    @classmethod
+    def build_sections(cls, books: List[Dict[str, Any]]) -> Dict[str, bytes]:
+        """Карты для файла каталога по книгам в порядке рангов: каждая - секцией по номеру варианта"""
+        options = [option for values in cls._build(CatalogIndex(books)).values() for option in values.values()]
+        sections = {
+            'names': _option_names(),
+            # 0 - массив рангов uint32, 1 - битовая карта
+            'kinds': bytes(int(option.dtype == np.uint8) for option in options),
+        }
+        for i, option in enumerate(options):
+            sections[str(i)] = option.tobytes()
+        return sections
+
+    @staticmethod
+    def _file_options(index: MmapCatalog) -> Optional[Dict[str, Dict[str, np.ndarray]]]:
+        """Карты из файла каталога без копирования; None - их нет или они для других кнопок"""
+        head = index.sections('facets', {'names': 'B', 'kinds': 'B'})
+        if head is None or bytes(head['names']) != _option_names():
+            return None
+        sections = index.sections('facets', {str(i): 'B' for i in range(len(head['kinds']))})
+        if sections is None:
+            return None
+        options: Dict[str, Dict[str, np.ndarray]] = {}
+        i = 0
+        for facet, values in OPTIONS.items():
+            options[facet] = {}
+            for value in values:
+                dtype = np.uint8 if head['kinds'][i] else np.uint32
+                options[facet][value] = np.frombuffer(sections[str(i)], dtype=dtype)
+                i += 1
+        return options
+
+    @property
+    def nbytes(self) -> int:
+        return sum(option.nbytes for values in self.options.values() for option in values.values())
+
+    def indexed(self, facet: str, value: Any) -> bool:
+        """Учитывается ли вариант картами (жанр не с клавиатуры нужно искать поиском)"""
+        # «any» и неизвестные коды рейтинга, цены и языка не ограничивают выдачу
+        return facet != 'genre' or value in self.options['genre']
+
+    def _as_bitmap(self, option: np.ndarray) -> np.ndarray:
+        return option if option.dtype == np.uint8 else _bitmap(option, self.size)
+
+    @staticmethod
+    def _count(base: np.ndarray, option: np.ndarray) -> int:
+        if option.dtype == np.uint8:
+            return int(_POPCOUNT[base & option].sum(dtype=np.int64))
+        # Редкий вариант: проверка бита каждого его ранга
+        return int(((base[option >> 3] >> (option & 7)) & 1).sum(dtype=np.int64))
+
+    def counts(self, facet: str, params: Dict[str, Any],
+               matching: Optional[Sequence[int]] = None) -> Dict[str, int]:
+        """Число книг для каждого варианта facet при остальных критериях params.
+
+        matching - ранги книг, подходящих под критерии без карт (автор,
+        годы, жанр не с клавиатуры); None - таких критериев нет. Ключ 'any'
+        - без выбора facet.
+        """
+        base = self.all if matching is None else _bitmap(matching, self.size)
+        for other in FACETS:
+            option = self.options[other].get(params.get(other)) if other != facet else None
+            if option is not None:
+                base = base & self._as_bitmap(option)
+
+        counts = {value: self._count(base, option) for value, option in self.options[facet].items()}
+        counts['any'] = int(_POPCOUNT[base].sum(dtype=np.int64))
+        return counts
@@ -0,0 +1,226 @@
+import os
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Any, Iterable, Mapping, Sequence, Set, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Минимальное сходство слова запроса и слова индекса: коэффициент Жаккара по триграммам
+FUZZY_THRESHOLD = float(os.getenv('FUZZY_THRESHOLD', '0.3'))
+# Слова намного хуже лучшего не выдаются: опечатка не тянет за собой случайные совпадения
+FUZZY_RELATIVE_CUTOFF = float(os.getenv('FUZZY_RELATIVE_CUTOFF', '0.75'))
+# Сколько слов индекса оценивается на одно слово запроса
+FUZZY_MAX_CANDIDATES = int(os.getenv('FUZZY_MAX_CANDIDATES', '2000'))
+# Списки длиннее этого не перебираются целиком, а только проверяются для кандидатов
+FUZZY_SCAN_LIMIT = int(os.getenv('FUZZY_SCAN_LIMIT', '5000'))
+# Слова запроса короче этого не ищутся нечётко: у одной буквы нет осмысленных опечаток
+FUZZY_MIN_WORD = 2
+
+KINDS = ('author', 'title')
+
+# Массивы индекса и коды их типов (array): так они пишутся в файл каталога
+SECTIONS = {
+    'sizes': 'H', 'grams': 'B', 'gram_starts': 'I', 'gram_words': 'I',
+    **{f"{kind}.{name}": 'I' for kind in KINDS for name in ('starts', 'ranks')},
+}
+
+_CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch',
+    'ъ': '', 'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'iu', 'я': 'ia',
+}
+_TRANSLIT = str.maketrans(_CYRILLIC)
+# Разные латинские записи одного звука сводятся к одной
+_LATIN = [
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'ck'), 'k'),
+    (re.compile(r'c(?!h)'), 'k'),
+    (re.compile(r'[yj]'), 'i'),
+    # W в русских записях имён - это «у»: Orwell - Оруэлл
+    (re.compile(r'w'), 'u'),
+    (re.compile(r'x'), 'ks'),
+    (re.compile(r'q'), 'k'),
+    (re.compile(r'([a-z])\1+'), r'\1'),
+]
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+def search_key(text: str) -> str:
+    """Ключ для нечёткого поиска: нижний регистр, латиница, без диакритики и удвоений.
+
+    «Достоевский» и «Dostoevsky» дают один ключ dostoevski.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = text.translate(_TRANSLIT)
+    text = _NON_WORD.sub(' ', text)
+    for pattern, replacement in _LATIN:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+def trigrams(key: str) -> Set[str]:
+    """Триграммы слов ключа, как в pg_trgm: слово дополняется пробелами"""
+    grams = set()
+    for word in key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def _contains(posting: Sequence[int], value: int) -> bool:
+    i = bisect_left(posting, value)
+    return i < len(posting) and posting[i] == value
+
+class FuzzyIndex:
+    """Триграммный индекс слов имён авторов и названий книг.
+
+    Записи индекса - различные слова ключей (search_key) авторов и
+    названий; у слова - его число триграмм и, для автора и названия
+    отдельно, ранги книг, где оно встречается. Слово запроса сравнивается
+    со словами индекса симметрично - коэффициентом Жаккара по триграммам
+    (общие к различным в обоих словах), поэтому короткое слово запроса не
+    совпадает с длинным именем только потому, что его триграммы там
+    нашлись. Книга подходит, если каждому слову запроса нашлось похожее
+    слово у неё.
+
+    Редкие триграммы перебираются по спискам и дают кандидатов, частые
+    только проверяются у уже найденных кандидатов, а число кандидатов
+    ограничено FUZZY_MAX_CANDIDATES. Поэтому время запроса зависит от
+    длины списков редких триграмм, а не от размера каталога.
+    """
+
+    def __init__(self, books: Iterable[Dict[str, Any]]):
+        self._load(self.build_sections(books))
+
+    @classmethod
+    def from_sections(cls, sections: Mapping[str, Sequence[int]]) -> "FuzzyIndex":
+        """Индекс поверх готовых секций (например, memoryview из файла каталога) без копирования"""
+        index = cls.__new__(cls)
+        index._load(sections)
+        return index
+
+    def _load(self, sections: Mapping[str, Sequence[int]]):
+        self.sizes = sections['sizes']
+        self.grams = sections['grams']
+        self.gram_starts = sections['gram_starts']
+        self.gram_words = sections['gram_words']
+        # Для автора и названия: начала списков по номеру слова и ранги книг
+        self.word_starts = {kind: sections[f"{kind}.starts"] for kind in KINDS}
+        self.word_ranks = {kind: sections[f"{kind}.ranks"] for kind in KINDS}
+
+    @staticmethod
+    def build_sections(books: Iterable[Dict[str, Any]]) -> Dict[str, Union[array, bytes]]:
+        """Массивы индекса по книгам в порядке рангов (типы - в SECTIONS)"""
+        words: Dict[str, int] = {}
+        ranks = {kind: [] for kind in KINDS}
+        for rank, book in enumerate(books):
+            for kind in KINDS:
+                for word in set(search_key(book.get(kind) or '').split()):
+                    ranks[kind].append((words.setdefault(word, len(words)), rank))
+
+        # Номера слов - по алфавиту; ранги добавлены по возрастанию, сортировка устойчива
+        order = sorted(words)
+        renumber = array('I', bytes(4 * len(order)))
+        for word_id, word in enumerate(order):
+            renumber[words[word]] = word_id
+
+        sections: Dict[str, Union[array, bytes]] = {'sizes': array('H')}
+        postings: Dict[str, array] = {}
+        for word_id, word in enumerate(order):
+            grams = trigrams(word)
+            sections['sizes'].append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                postings.setdefault(gram, array('I')).append(word_id)
+        # Триграммы ключа - ровно три символа ASCII: отсортированный блок по 3 байта
+        grams = sorted(postings)
+        sections['grams'] = ''.join(grams).encode('ascii')
+        sections['gram_starts'] = array('I', [0])
+        sections['gram_words'] = array('I')
+        for gram in grams:
+            sections['gram_words'].extend(postings[gram])
+            sections['gram_starts'].append(len(sections['gram_words']))
+
+        for kind in KINDS:
+            pairs = sorted(((renumber[word_id], rank) for word_id, rank in ranks[kind]), key=lambda p: p[0])
+            starts = array('I', bytes(4 * (len(order) + 1)))
+            for word_id, _ in pairs:
+                starts[word_id + 1] += 1
+            for i in range(len(order)):
+                starts[i + 1] += starts[i]
+            sections[f"{kind}.starts"] = starts
+            sections[f"{kind}.ranks"] = array('I', (rank for _, rank in pairs))
+        return sections
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def _gram_posting(self, gram: str) -> Sequence[int]:
+        """Номера слов с триграммой: двоичный поиск по блоку триграмм"""
+        needle = gram.encode('ascii')
+        lo, hi = 0, len(self.grams) // 3
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = bytes(self.grams[3 * mid:3 * mid + 3])
+            if value < needle:
+                lo = mid + 1
+            elif value > needle:
+                hi = mid
+            else:
+                return self.gram_words[self.gram_starts[mid]:self.gram_starts[mid + 1]]
+        return ()
+
+    def lookup(self, word: str, kind: str, threshold: float = FUZZY_THRESHOLD,
+               max_candidates: int = FUZZY_MAX_CANDIDATES) -> List[Tuple[int, float]]:
+        """Слова индекса, похожие на слово запроса: (номер слова, сходство) по убыванию сходства.
+
+        Учитываются только слова, которые встречаются в поле kind. Слова
+        со сходством ниже FUZZY_RELATIVE_CUTOFF от лучшего отбрасываются.
+        """
+        grams = trigrams(word)
+        if not grams:
+            return []
+        starts = self.word_starts[kind]
+        lists = sorted((self._gram_posting(gram) for gram in grams), key=len)
+
+        counts: Dict[int, int] = {}
+        for posting in lists:
+            if len(posting) <= FUZZY_SCAN_LIMIT or not counts:
+                for word_id in posting:
+                    if word_id in counts:
+                        counts[word_id] += 1
+                    elif len(counts) < max_candidates and starts[word_id + 1] > starts[word_id]:
+                        counts[word_id] = 1
+            else:
+                for word_id in counts:
+                    if _contains(posting, word_id):
+                        counts[word_id] += 1
+
+        total = len(grams)
+        scored = [
+            (word_id, shared / (total + self.sizes[word_id] - shared))
+            for word_id, shared in counts.items()
+        ]
+        best = max((score for _, score in scored), default=0.0)
+        threshold = max(threshold, best * FUZZY_RELATIVE_CUTOFF)
+        scored = [item for item in scored if item[1] >= threshold]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored
+
+    def match_ranks(self, text: str, kind: str, threshold: float = FUZZY_THRESHOLD) -> List[int]:
+        """Отсортированные ранги книг, у которых для каждого слова запроса есть похожее слово в поле kind"""
+        words = [word for word in set(search_key(text).split()) if len(word) >= FUZZY_MIN_WORD]
+        if not words:
+            return []
+        starts, ranks = self.word_starts[kind], self.word_ranks[kind]
+        matched = None
+        for word in words:
+            word_ranks = set()
+            for word_id, _ in self.lookup(word, kind, threshold):
+                word_ranks.update(ranks[starts[word_id]:starts[word_id + 1]])
+            matched = word_ranks if matched is None else matched & word_ranks
+            if not matched:
+                return []
+        return sorted(matched)
@@ -0,0 +1,332 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Any, Iterable, Iterator, Optional, TextIO
+
+from dotenv import load_dotenv
+
+from .catalog import (CATALOG_MMAP_PATH, CATALOG_VERSION_KEY, SEARCH_BACKEND, catalog_file_sections,
+                      db_catalog_version, load_books_from_db)
+from .catalog_index import LANGUAGE_NAMES
+from .mmap_catalog import write_catalog
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Строк в одной порции COPY: память процесса ограничена размером порции
+INGEST_COPY_BATCH = int(os.getenv('INGEST_COPY_BATCH', '50000'))
+INGEST_DEFAULT_CURRENCY = os.getenv('INGEST_DEFAULT_CURRENCY', 'RUB')
+INGEST_REPORT_EVERY = int(os.getenv('INGEST_REPORT_EVERY', '500000'))
+
+# Колонки books, которые заполняет загрузка (id и даты ставит БД)
+COLUMNS = (
+    'isbn', 'title', 'author', 'genre', 'publisher', 'publication_year', 'pages',
+    'language', 'rating', 'price', 'currency', 'description', 'tags', 'available_formats'
+)
+JSON_COLUMNS = ('tags', 'available_formats')
+MAX_LENGTHS = {'title': 255, 'author': 255, 'genre': 100, 'publisher': 255, 'language': 50}
+
+_SPACES = re.compile(r'\s+')
+_ISBN_SEPARATORS = re.compile(r'[\s-]')
+
+class InvalidRow(ValueError):
+    """Строка дампа, которую нельзя загрузить: причина и значение"""
+
+    def __init__(self, reason: str, value: Any = None):
+        super().__init__(f"{reason}: {value!r}")
+        self.reason = reason
+
+def normalize_isbn(value: Any) -> str:
+    """ISBN без дефисов и пробелов: 10 или 13 символов"""
+    isbn = _ISBN_SEPARATORS.sub('', str(value or '')).upper()
+    if isbn.startswith('ISBN'):
+        isbn = isbn[4:].lstrip(':')
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn
+    if len(isbn) == 10 and isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X'):
+        return isbn
+    raise InvalidRow('isbn', value)
+
+def _text(row: Dict[str, Any], field: str) -> Optional[str]:
+    value = row.get(field)
+    if value is None:
+        return None
+    value = _SPACES.sub(' ', str(value)).strip()
+    if not value:
+        return None
+    limit = MAX_LENGTHS.get(field)
+    return value[:limit] if limit else value
+
+def _number(row: Dict[str, Any], field: str, kind, low: float, high: float):
+    value = row.get(field)
+    if value is None or value == '':
+        return None
+    try:
+        number = kind(float(str(value).replace(',', '.')))
+    except (ValueError, OverflowError):
+        # OverflowError - int() от inf или 1e400
+        raise InvalidRow(field, value)
+    if not low <= number <= high:
+        raise InvalidRow(field, number)
+    return number
+
+def _list(value: Any) -> List[str]:
+    """Список из JSON-массива, списка или строки через | или ;"""
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('['):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise InvalidRow('list', value)
+        else:
+            value = re.split(r'[|;]', value)
+    if not isinstance(value, list):
+        raise InvalidRow('list', value)
+    items = []
+    for item in value:
+        item = _SPACES.sub(' ', str(item)).strip()
+        if item and item not in items:
+            items.append(item)
+    return items
+
+def normalize_book(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Проверенная и нормализованная книга в виде колонок таблицы books"""
+    book = {
+        'isbn': normalize_isbn(row.get('isbn')),
+        'title': _text(row, 'title'),
+        'author': _text(row, 'author'),
+    }
+    if not book['title'] or not book['author']:
+        raise InvalidRow('title/author')
+
+    for field in ('genre', 'publisher', 'description'):
+        book[field] = _text(row, field)
+    language = _text(row, 'language')
+    book['language'] = LANGUAGE_NAMES.get(language.lower(), language) if language else None
+
+    book['publication_year'] = _number(row, 'publication_year', int, 0, datetime.date.today().year + 1)
+    book['pages'] = _number(row, 'pages', int, 1, 100_000)
+    book['rating'] = _number(row, 'rating', float, 0, 5)
+    book['price'] = _number(row, 'price', float, 0, 10_000_000)
+
+    currency = (_text(row, 'currency') or INGEST_DEFAULT_CURRENCY).upper()
+    if len(currency) != 3 or not currency.isalpha():
+        raise InvalidRow('currency', currency)
+    book['currency'] = currency
+
+    book['tags'] = _list(row.get('tags'))
+    book['available_formats'] = _list(row.get('available_formats'))
+    return book
+
+def _open(path: str) -> TextIO:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение дампа CSV или JSONL (можно .gz) по одной строке"""
+    name = path[:-3] if path.endswith('.gz') else path
+    with _open(path) as f:
+        if name.endswith('.csv'):
+            yield from csv.DictReader(f)
+        elif name.endswith(('.jsonl', '.ndjson')):
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                # Битая строка или не объект JSON считается невалидной книгой
+                yield row if isinstance(row, dict) else {'_error': f"line {line_number}"}
+        else:
+            raise ValueError(f"Unsupported catalog dump format: {path}")
+
+def _copy_line(book: Dict[str, Any]) -> List[Any]:
+    line = []
+    for column in COLUMNS:
+        value = book[column]
+        if column in JSON_COLUMNS:
+            value = json.dumps(value, ensure_ascii=False)
+        line.append(value)
+    return line
+
+class IngestStats:
+    """Счётчики загрузки и скорость в строках в секунду"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.invalid = 0
+        self.staged = 0
+        self.distinct = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors: Dict[str, int] = {}
+
+    def reject(self, error: InvalidRow):
+        # Считаются только причины, без значений: словарь не растёт вместе с дампом
+        self.invalid += 1
+        self.errors[error.reason] = self.errors.get(error.reason, 0) + 1
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.read / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"read {self.read}, invalid {self.invalid}, duplicate isbn {self.staged - self.distinct}, "
+            f"inserted {self.inserted}, updated {self.updated}, "
+            f"unchanged {self.distinct - self.inserted - self.updated} "
+            f"in {self.elapsed:.1f}s ({self.rate:.0f} rows/s)"
+        )
+
+def _create_staging(cursor):
+    # Временная таблица не пишется в WAL и исчезает вместе с транзакцией
+    cursor.execute("""
+        CREATE TEMP TABLE books_staging (
+            line bigint, isbn text, title text, author text, genre text, publisher text,
+            publication_year integer, pages integer, language text, rating double precision,
+            price double precision, currency text, description text, tags text, available_formats text
+        ) ON COMMIT DROP
+    """)
+
+def _copy_batch(cursor, lines: List[List[Any]]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(lines)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY books_staging (line, {', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+    )
+
+def _upsert_from_staging(cursor):
+    """Перенос из staging в books: последняя строка с каждым ISBN, без лишних обновлений"""
+    select_columns = ', '.join(
+        f"{column}::jsonb" if column == 'tags' else f"{column}::json" if column in JSON_COLUMNS else column
+        for column in COLUMNS
+    )
+    updates = [column for column in COLUMNS if column != 'isbn']
+    set_clause = ', '.join(f"{column} = excluded.{column}" for column in updates)
+    # json не сравнивается напрямую, поэтому сравнение идёт через jsonb
+    current = ', '.join(f"books.{c}::jsonb" if c in JSON_COLUMNS else f"books.{c}" for c in updates)
+    incoming = ', '.join(f"excluded.{c}::jsonb" if c in JSON_COLUMNS else f"excluded.{c}" for c in updates)
+    cursor.execute(f"""
+        WITH upserted AS (
+            INSERT INTO books ({', '.join(COLUMNS)}, created_at, updated_at)
+            SELECT DISTINCT ON (isbn) {select_columns}, now(), now()
+            FROM books_staging
+            ORDER BY isbn, line DESC
+            ON CONFLICT (isbn) DO UPDATE SET {set_clause}, updated_at = now()
+            WHERE ({current}) IS DISTINCT FROM ({incoming})
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+    """)
+    return cursor.fetchone()
+
+def ingest_rows(rows: Iterable[Dict[str, Any]], batch: int = INGEST_COPY_BATCH) -> IngestStats:
+    """Загрузка книг в таблицу books одной транзакцией через COPY и upsert"""
+    from .database import engine
+
+    stats = IngestStats()
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        _create_staging(cursor)
+        lines = []
+        for row in rows:
+            stats.read += 1
+            try:
+                if '_error' in row:
+                    raise InvalidRow('json', row['_error'])
+                lines.append([stats.read] + _copy_line(normalize_book(row)))
+            except InvalidRow as e:
+                stats.reject(e)
+            if len(lines) >= batch:
+                _copy_batch(cursor, lines)
+                stats.staged += len(lines)
+                lines = []
+            if stats.read % INGEST_REPORT_EVERY == 0:
+                logger.info(f"Ingest progress: {stats.read} rows read ({stats.rate:.0f} rows/s)")
+        if lines:
+            _copy_batch(cursor, lines)
+            stats.staged += len(lines)
+
+        stats.inserted, stats.updated = _upsert_from_staging(cursor)
+        cursor.execute("SELECT count(DISTINCT isbn) FROM books_staging")
+        stats.distinct = cursor.fetchone()[0]
+        connection.commit()
+        # Статистика планировщика после массовой загрузки
+        cursor.execute("ANALYZE books")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return stats
+
+def builtin_rows() -> Iterator[Dict[str, Any]]:
+    """Книги из app/data/books_data.py - начальное заполнение таблицы"""
+    from .data.books_data import BOOKS_DATABASE
+    return iter(BOOKS_DATABASE)
+
+async def publish_catalog_version(version: str):
+    """Сигнал процессам бота перечитать каталог (см. catalog.run_catalog_refresher)"""
+    from .redis_client import get_redis, close_redis
+    try:
+        await get_redis().set(CATALOG_VERSION_KEY, version)
+    finally:
+        await close_redis()
+
+def main(paths: List[str]):
+    import asyncio
+    from itertools import chain
+
+    rows = chain.from_iterable(read_rows(path) for path in paths) if paths else builtin_rows()
+    stats = ingest_rows(rows)
+    logger.info(f"Ingest finished: {stats}")
+    if stats.errors:
+        logger.info(f"Rejected rows by reason: {stats.errors}")
+
+    version = db_catalog_version()
+    books = load_books_from_db()
+    # Индексы в памяти этого процесса боту не нужны: процессы бота перестроят
+    # их сами по опубликованной версии. Для mmap здесь пишется общий файл
+    # каталога - вместе с готовыми быстрыми списками
+    if SEARCH_BACKEND == 'mmap':
+        from . import quick_lists  # noqa: F401
+        started = time.perf_counter()
+        write_catalog(books, version, CATALOG_MMAP_PATH, catalog_file_sections())
+        logger.info(
+            f"Catalog file {CATALOG_MMAP_PATH} written for {len(books)} books in {time.perf_counter() - started:.1f}s"
+        )
+    asyncio.run(publish_catalog_version(version))
+    logger.info(f"Catalog version {version} published")
+
+    # Таблица соседей строится здесь, а не в процессах бота: они переключаются
+    # на новый каталог сразу и подхватывают таблицу, когда файл появится
+    from .recommender import build_neighbour_table
+    build_neighbour_table(books, version)
+
+if __name__ == "__main__":
+    # python -m app.ingest books.csv books2.jsonl.gz; без файлов - книги из books_data.py
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -1,5 +1,14 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from typing import Dict, Optional
+
+from .catalog_index import GENRES
+
+def _with_count(text: str, counts: Optional[Dict[str, int]], value: str) -> str:
+    """Текст кнопки с числом книг, которые останутся после выбора варианта"""
+    if counts is None:
+        return text
+    return f"{text} ({counts.get(value, 0)})"
 
 def get_main_menu():
     """Главное меню"""
@@ -22,27 +31,22 @@ def get_search_criteria_menu():
     builder.add(KeyboardButton(text="🗣️ Язык"))
     builder.add(KeyboardButton(text="📅 Год издания"))
     builder.add(KeyboardButton(text="🔍 Начать поиск"))
+    builder.add(KeyboardButton(text="🔔 Подписаться на новинки"))
     builder.add(KeyboardButton(text="↩️ Назад в меню"))
-    builder.adjust(2, 2, 2, 2)
+    builder.adjust(2, 2, 2, 2, 1)
     return builder.as_markup(resize_keyboard=True)
 
-def get_genre_keyboard():
-    """Клавиатура выбора жанра"""
-    genres = [
-        "Фэнтези", "Научная фантастика", "Детектив", "Роман",
-        "Классика", "Исторический", "Биография", "Психология",
-        "Поэзия", "Драма", "Приключения", "Хоррор"
-    ]
-    
+def get_genre_keyboard(counts: Optional[Dict[str, int]] = None):
+    """Клавиатура выбора жанра (counts - число книг по вариантам)"""
     builder = InlineKeyboardBuilder()
-    for genre in genres:
-        builder.add(InlineKeyboardButton(text=genre, callback_data=f"genre_{genre}"))
+    for genre in GENRES:
+        builder.add(InlineKeyboardButton(text=_with_count(genre, counts, genre), callback_data=f"genre_{genre}"))
     builder.add(InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_criteria"))
     builder.adjust(3)
     return builder.as_markup()
 
-def get_rating_keyboard():
-    """Клавиатура выбора рейтинга"""
+def get_rating_keyboard(counts: Optional[Dict[str, int]] = None):
+    """Клавиатура выбора рейтинга (counts - число книг по вариантам)"""
     builder = InlineKeyboardBuilder()
     ratings = [
         ("⭐ 4.5+", "rating_4.5"),
@@ -52,13 +56,13 @@ def get_rating_keyboard():
     ]
     
     for text, data in ratings:
-        builder.add(InlineKeyboardButton(text=text, callback_data=data))
+        builder.add(InlineKeyboardButton(text=_with_count(text, counts, data[len("rating_"):]), callback_data=data))
     builder.add(InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_criteria"))
     builder.adjust(2)
     return builder.as_markup()
 
-def get_price_keyboard():
-    """Клавиатура выбора ценового диапазона"""
+def get_price_keyboard(counts: Optional[Dict[str, int]] = None):
+    """Клавиатура выбора ценового диапазона (counts - число книг по вариантам)"""
     builder = InlineKeyboardBuilder()
     prices = [
         ("💰 До 500 руб", "price_0_500"),
@@ -69,13 +73,13 @@ def get_price_keyboard():
     ]
     
     for text, data in prices:
-        builder.add(InlineKeyboardButton(text=text, callback_data=data))
+        builder.add(InlineKeyboardButton(text=_with_count(text, counts, data[len("price_"):]), callback_data=data))
     builder.add(InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_criteria"))
     builder.adjust(2)
     return builder.as_markup()
 
-def get_language_keyboard():
-    """Клавиатура выбора языка"""
+def get_language_keyboard(counts: Optional[Dict[str, int]] = None):
+    """Клавиатура выбора языка (counts - число книг по вариантам)"""
     builder = InlineKeyboardBuilder()
     languages = [
         ("🇷🇺 Русский", "lang_ru"),
@@ -86,7 +90,7 @@ def get_language_keyboard():
     ]
     
     for text, data in languages:
-        builder.add(InlineKeyboardButton(text=text, callback_data=data))
+        builder.add(InlineKeyboardButton(text=_with_count(text, counts, data[len("lang_"):]), callback_data=data))
     builder.add(InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_criteria"))
     builder.adjust(2)
     return builder.as_markup()
@@ -116,3 +120,22 @@ def get_pagination_keyboard(current_page: int, total_pages: int, search_id: int)
     
     builder.adjust(3)
     return builder.as_markup()
+
+def get_saved_searches_keyboard(saved_searches):
+    """Кнопки отписки от сохранённых поисков"""
+    builder = InlineKeyboardBuilder()
+    for number, saved in enumerate(saved_searches, 1):
+        builder.add(InlineKeyboardButton(text=f"❌ {number}", callback_data=f"unsubscribe_{saved.id}"))
+    builder.adjust(5)
+    return builder.as_markup()
+
+def get_quick_genres_keyboard(genres):
+    """Клавиатура жанров быстрого поиска"""
+    builder = InlineKeyboardBuilder()
+    for genre in genres:
+        callback_data = f"quick_genre_{genre}"
+        # Telegram ограничивает callback_data 64 байтами
+        if len(callback_data.encode('utf-8')) <= 64:
+            builder.add(InlineKeyboardButton(text=genre, callback_data=callback_data))
+    builder.adjust(2)
+    return builder.as_markup()
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, Optional
+
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+from .catalog import catalog_version
+from .redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Параметры поиска, которые влияют на ответ ИИ
+SEARCH_PARAM_KEYS = ('genre', 'rating', 'price', 'language', 'author', 'year_from', 'year_to')
+
+# Запись: сохранить значение, учесть его размер и вытеснить давно
+# не использованные записи, пока кэш не уложится в лимит байт
+_SET_SCRIPT = """
+local key, index, sizes, total_key = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local value, ttl, now, max_bytes = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local old = redis.call('HGET', sizes, key)
+if old then redis.call('DECRBY', total_key, old) end
+
+redis.call('SET', key, value, 'EX', ttl)
+redis.call('HSET', sizes, key, string.len(value))
+redis.call('ZADD', index, now, key)
+local total = redis.call('INCRBY', total_key, string.len(value))
+
+local evicted = 0
+local function drop(member)
+    local size = redis.call('HGET', sizes, member)
+    redis.call('HDEL', sizes, member)
+    redis.call('ZREM', index, member)
+    redis.call('DEL', member)
+    if size then total = redis.call('DECRBY', total_key, size) end
+    evicted = evicted + 1
+end
+
+-- Записи, к которым не обращались дольше TTL, уже истекли
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', index, '-inf', now - ttl, 'LIMIT', 0, 100)) do
+    drop(member)
+end
+
+while total > max_bytes do
+    local oldest = redis.call('ZRANGE', index, 0, 0)
+    if #oldest == 0 or oldest[1] == key then break end
+    drop(oldest[1])
+end
+
+return evicted
+"""
+
+# Чтение: при попадании продлить TTL ключа вместе со временем обращения,
+# иначе ключ истечёт, а его размер останется в учёте и вытеснит живые записи
+_GET_SCRIPT = """
+local key, index, stats = KEYS[1], KEYS[2], KEYS[3]
+local ttl, now = tonumber(ARGV[1]), tonumber(ARGV[2])
+
+local value = redis.call('GET', key)
+if value then
+    redis.call('EXPIRE', key, ttl)
+    redis.call('ZADD', index, 'XX', now, key)
+    redis.call('HINCRBY', stats, 'hits', 1)
+else
+    redis.call('HINCRBY', stats, 'misses', 1)
+end
+return value
+"""
+
+def canonical_search_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Нормализованные параметры поиска: только критерии, без пустых значений"""
+    canonical = {}
+    for key in SEARCH_PARAM_KEYS:
+        value = params.get(key)
+        if value in (None, '', 'any'):
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+            if key == 'author':
+                value = value.lower()
+        canonical[key] = value
+    return canonical
+
+class LLMCache:
+    """Кэш ответов ИИ в Redis с TTL, лимитом размера и счётчиками попаданий"""
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = 'llm'):
+        self._redis = redis
+        self.prefix = prefix
+        self.enabled = os.getenv('LLM_CACHE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+        self.ttl = int(os.getenv('LLM_CACHE_TTL', '86400'))
+        self.max_bytes = int(os.getenv('LLM_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+        # Локальные счётчики процесса; общие хранятся в Redis
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def make_key(self, kind: str, payload: Dict[str, Any]) -> str:
+        """Ключ кэша: версия каталога, тип запроса и хэш канонического JSON"""
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        return f"{self.prefix}:{catalog_version()}:{kind}:{digest}"
+
+    async def get(self, key: str, record_stats: bool = True) -> Optional[str]:
+        """Получение ответа из кэша; None при промахе или недоступности Redis"""
+        if not self.enabled:
+            return None
+
+        try:
+            if not record_stats:
+                value = await self.redis.get(key)
+                return value.decode('utf-8') if value is not None else None
+
+            value = await self.redis.eval(
+                _GET_SCRIPT, 3,
+                key, f"{self.prefix}:index", f"{self.prefix}:stats",
+                self.ttl, time.time()
+            )
+        except Exception as e:
+            logger.warning(f"LLM cache get failed: {e}")
+            return None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return value.decode('utf-8')
+
+    async def set(self, key: str, value: str):
+        """Сохранение ответа в кэш с вытеснением старых записей при переполнении"""
+        if not self.enabled:
+            return
+
+        try:
+            evicted = await self.redis.eval(
+                _SET_SCRIPT, 4,
+                key, f"{self.prefix}:index", f"{self.prefix}:sizes", f"{self.prefix}:bytes",
+                value, self.ttl, time.time(), self.max_bytes
+            )
+            if evicted:
+                await self.redis.hincrby(f"{self.prefix}:stats", 'evictions', evicted)
+        except Exception as e:
+            logger.warning(f"LLM cache set failed: {e}")
+
+    async def stats(self) -> Dict[str, int]:
+        """Общие счётчики кэша: попадания, промахи, вытеснения и объём"""
+        stats = await self.redis.hgetall(f"{self.prefix}:stats")
+        total_bytes = await self.redis.get(f"{self.prefix}:bytes")
+        result = {k.decode('utf-8'): int(v) for k, v in stats.items()}
+        result['bytes'] = int(total_bytes or 0)
+        return result
@@ -1,13 +1,28 @@
 import asyncio
 import logging
+import multiprocessing
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.client.default import DefaultBotProperties
 from dotenv import load_dotenv
 import os
 
-from .bot_handlers import router
-from .database import init_db
+from .bot_handlers import router, openai_client
+from .database import init_db, engine, async_engine
+from .middlewares import CatalogMiddleware, DbSessionMiddleware, UserActivityMiddleware
+from .redis_client import get_redis, close_redis
+from .sender import SendScheduler
+from .metrics import (
+    METRICS_PORT, MetricsMiddleware, UpdateCounterMiddleware, register_process_gauges, start_metrics_server
+)
+from .saved_searches import run_saved_search_notifier
+from .catalog import CATALOG_SOURCE, reload_catalog, run_catalog_refresher, warm_catalog
+# Модули регистрируют подготовку своих данных для каждого снимка каталога
+from . import quick_lists  # noqa: F401
+from .write_behind import write_behind
+from .search_events import ensure_partitions
+from .update_queue import ChatSequencer, UpdateQueue, run_worker
+from .webhook import create_app, direct_ingress, queue_ingress, serve, set_webhook
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -23,32 +38,100 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
-    """Основная функция запуска бота"""
-    
-    # Инициализация базы данных
-    init_db()
-    logger.info("Database initialized")
-    
-    # Инициализация бота
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not bot_token:
-        logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
-        return
-    
+# polling - один процесс; webhook - приём обновлений по HTTP;
+# worker - обработка обновлений из очереди Redis
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Вебхук пишет обновления в очередь вместо обработки на месте
+WEBHOOK_QUEUE = os.getenv('WEBHOOK_QUEUE', 'False').lower() == 'true'
+WEBHOOK_PROCESSES = int(os.getenv('WEBHOOK_PROCESSES', '1'))
+# Воркеры: всего по всем хостам, номер первого воркера и число процессов на этом хосте
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '1'))
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+
+def create_bot() -> Bot:
+    """Инициализация бота"""
     bot = Bot(
-        token=bot_token,
+        token=os.getenv('TELEGRAM_BOT_TOKEN'),
         default=DefaultBotProperties(parse_mode='HTML')
     )
+    # Все исходящие сообщения проходят через планировщик с лимитами Telegram
+    bot.session.middleware(SendScheduler())
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    """Инициализация диспетчера с обработчиками и middleware"""
+    # Инициализация хранилища (Redis); подключение общее с кэшами
+    storage = RedisStorage(redis=get_redis())
     
-    # Инициализация хранилища (Redis)
-    redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-    storage = RedisStorage.from_url(redis_url)
-    
-    # Инициализация диспетчера
     dp = Dispatcher(storage=storage)
     dp.include_router(router)
     
+    # Число обновлений, задержка и ошибки обработчиков для /metrics
+    dp.update.outer_middleware(UpdateCounterMiddleware())
+    handler_metrics = MetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    dp.inline_query.middleware(handler_metrics)
+    
+    # Снимок каталога фиксируется в начале обработки обновления
+    catalog = CatalogMiddleware()
+    dp.message.outer_middleware(catalog)
+    dp.callback_query.outer_middleware(catalog)
+    dp.inline_query.outer_middleware(catalog)
+    
+    # Сессия БД для обработчиков, которые её запрашивают
+    dp.message.middleware(DbSessionMiddleware())
+    dp.callback_query.middleware(DbSessionMiddleware())
+    
+    # Пользователи и их активность пишутся в БД пакетами
+    activity = UserActivityMiddleware()
+    dp.message.outer_middleware(activity)
+    dp.callback_query.outer_middleware(activity)
+    dp.inline_query.outer_middleware(activity)
+    return dp
+
+# Фоновые задачи процесса, обрабатывающего обновления
+_background_tasks = []
+_metrics_runner = None
+
+async def start_metrics(process_index: int = 0):
+    """Эндпоинт /metrics процесса: у каждого процесса на хосте свой порт"""
+    global _metrics_runner
+    register_process_gauges()
+    _metrics_runner = await start_metrics_server(METRICS_PORT + process_index)
+
+def start_background_tasks(bot: Bot):
+    """Запуск фоновых задач: обновление каталога, производные данные снимка и уведомления по подпискам"""
+    if CATALOG_SOURCE == 'db':
+        # Первая загрузка - до приёма обновлений, дальше - по публикации новой версии
+        reload_catalog()
+    _background_tasks.append(asyncio.create_task(run_catalog_refresher()))
+    # Производные данные первого снимка; для следующих их готовит сама замена каталога
+    _background_tasks.append(asyncio.create_task(asyncio.to_thread(warm_catalog)))
+    _background_tasks.append(asyncio.create_task(run_saved_search_notifier(bot)))
+
+async def shutdown(bot: Bot):
+    """Освобождение ресурсов процесса"""
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    await openai_client.close()
+    await bot.session.close()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+    # Накопленные события записываются до закрытия пула соединений
+    await write_behind.close()
+    await close_redis()
+    await async_engine.dispose()
+
+async def run_polling():
+    """Получение обновлений через long polling"""
+    bot = create_bot()
+    dp = create_dispatcher()
+    start_background_tasks(bot)
+    await start_metrics()
+    
     logger.info("Bot starting...")
     
     try:
@@ -57,8 +140,104 @@ async def main():
     except Exception as e:
         logger.error(f"Bot stopped with error: {e}")
     finally:
-        await bot.session.close()
+        await shutdown(bot)
         logger.info("Bot stopped")
 
+async def run_webhook(reuse_port: bool = False, process_index: int = 0):
+    """Приём обновлений через вебхук в одном процессе"""
+    bot = create_bot()
+    await start_metrics(process_index)
+    sequencer = None
+    if WEBHOOK_QUEUE:
+        ingress = queue_ingress(UpdateQueue())
+    else:
+        sequencer = ChatSequencer()
+        ingress = direct_ingress(bot, create_dispatcher(), sequencer)
+        start_background_tasks(bot)
+    
+    runner = await serve(create_app(ingress), reuse_port=reuse_port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if sequencer is not None:
+            await sequencer.drain()
+        await shutdown(bot)
+        logger.info("Webhook stopped")
+
+async def run_worker_process(worker_index: int):
+    """Обработка обновлений из очереди одним воркером"""
+    bot = create_bot()
+    dp = create_dispatcher()
+    start_background_tasks(bot)
+    await start_metrics(worker_index - WORKER_INDEX)
+    try:
+        await run_worker(bot, dp, worker_index, WORKER_COUNT)
+    finally:
+        await shutdown(bot)
+        logger.info(f"Worker {worker_index} stopped")
+
+async def register_webhook():
+    """Регистрация вебхука до запуска процессов приёма"""
+    bot = create_bot()
+    try:
+        await set_webhook(bot, create_dispatcher().resolve_used_update_types())
+    finally:
+        await bot.session.close()
+        await close_redis()
+
+def _run_process(mode: str, index: int):
+    """Точка входа дочернего процесса"""
+    try:
+        if mode == 'webhook':
+            asyncio.run(run_webhook(reuse_port=True, process_index=index))
+        else:
+            asyncio.run(run_worker_process(index))
+    except KeyboardInterrupt:
+        pass
+
+def _run_processes(mode: str, indexes: list):
+    """Запуск нескольких процессов и ожидание их завершения"""
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_run_process, args=(mode, i), daemon=True) for i in indexes]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+def main():
+    """Основная функция запуска бота"""
+    
+    # Инициализация бота
+    if not os.getenv('TELEGRAM_BOT_TOKEN'):
+        logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
+        return
+    
+    if BOT_MODE == 'webhook' and WEBHOOK_PROCESSES > 1 and not WEBHOOK_QUEUE:
+        # Соединения распределяются между процессами ядром: без очереди
+        # обновления одного чата обрабатываются в разных процессах вразнобой
+        logger.error("WEBHOOK_PROCESSES > 1 requires WEBHOOK_QUEUE=True to keep per-chat ordering")
+        return
+    
+    # Инициализация базы данных (один раз, до запуска дочерних процессов)
+    init_db()
+    ensure_partitions(engine)
+    logger.info("Database initialized")
+    
+    if BOT_MODE == 'webhook':
+        asyncio.run(register_webhook())
+        if WEBHOOK_PROCESSES > 1:
+            _run_processes('webhook', range(WEBHOOK_PROCESSES))
+        else:
+            asyncio.run(run_webhook())
+    elif BOT_MODE == 'worker':
+        indexes = range(WORKER_INDEX, WORKER_INDEX + WORKER_PROCESSES)
+        if WORKER_PROCESSES > 1:
+            _run_processes('worker', indexes)
+        else:
+            asyncio.run(run_worker_process(WORKER_INDEX))
+    else:
+        asyncio.run(run_polling())
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,251 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Any, Awaitable, Callable, Iterator, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+# Эндпоинт /metrics слушает только локальный адрес; процесс с номером i - порт METRICS_PORT + i
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+# Границы корзин гистограмм задержки, секунд
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+class Metric:
+    """Метрика процесса в текстовом формате Prometheus.
+
+    Значения хранятся в словаре по кортежу меток и меняются только из
+    цикла событий (или под GIL одним присваиванием), поэтому запись - это
+    поиск в словаре и сложение, без блокировок.
+    """
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value:g}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(Metric):
+    """Счётчик, который только растёт"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, value in list(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram(Metric):
+    """Гистограмма: счётчики по корзинам, сумма и число наблюдений"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Для каждого набора меток: [счётчики корзин..., +Inf], сумма
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = state
+        # Корзина le - первая граница, не меньшая значения
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Замер длительности блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        names = self.labelnames + ('le',)
+        for labels, (counts, total) in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                yield f"{self.name}_bucket", _format_labels(names, labels + (le,)), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total[0]
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative
+
+class Gauge(Metric):
+    """Значение, которое читается функцией в момент запроса /metrics.
+
+    Так в метрики попадают счётчики, которые уже ведут сами компоненты
+    (пул соединений, кэши, буфер записи), без изменения их кода.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 read: Callable[[], Union[float, Dict[Labels, float]]], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.read = read
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.warning(f"Error reading metric {self.name}: {e}")
+            return
+        if isinstance(value, dict):
+            for labels, item in value.items():
+                yield self.name, _format_labels(self.labelnames, labels), item
+        else:
+            yield self.name, '', value
+
+registry: List[Metric] = []
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# Обработка обновлений
+UPDATES = Counter('bot_updates_total', 'Telegram updates received', ['type'])
+HANDLER_LATENCY = Histogram('bot_handler_seconds', 'Handler processing time', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Handler exceptions', ['handler', 'error'])
+
+# Поиск по каталогу и карточки книг
+SEARCH_LATENCY = Histogram('bot_search_seconds', 'search_books time', ['backend'], FAST_BUCKETS)
+CARD_LATENCY = Histogram('bot_book_card_seconds', 'format_book_info time', buckets=FAST_BUCKETS)
+
+# Запросы к LLM
+LLM_LATENCY = Histogram('bot_llm_request_seconds', 'LLM request time, one attempt', ['mode'])
+LLM_TOKENS = Counter('bot_llm_tokens_total', 'LLM tokens used', ['kind'])
+LLM_ERRORS = Counter('bot_llm_errors_total', 'LLM request errors', ['error'])
+
+# Исходящие сообщения Telegram
+SEND_LATENCY = Histogram('bot_send_seconds', 'Telegram API request time', ['method'])
+SEND_WAIT = Histogram('bot_send_wait_seconds', 'Time an outbound message waited for rate limits', ['priority'])
+SEND_RETRY_AFTER = Counter('bot_send_retry_after_total', 'Telegram 429 responses', ['method'])
+
+_process_gauges_registered = False
+
+def register_process_gauges():
+    """Показатели, которые уже считают компоненты бота: пул БД, кэши, буфер записи, каталог"""
+    global _process_gauges_registered
+    if _process_gauges_registered:
+        return
+    _process_gauges_registered = True
+
+    from .book_cards import book_cards
+    from .bot_handlers import openai_client
+    from .catalog import current_catalog
+    from .database import get_pool_stats
+    from .write_behind import write_behind
+
+    Gauge('bot_db_pool', 'Async DB pool state', lambda: {(k,): v for k, v in get_pool_stats().items()}, ['stat'])
+    Gauge('bot_write_behind_rows', 'Write-behind buffer rows', lambda: {
+        ('written',): write_behind.written, ('dropped',): write_behind.dropped, ('pending',): write_behind.pending,
+    }, ['state'])
+    Gauge('bot_book_card_cache', 'Book card cache lookups',
+          lambda: {('hit',): book_cards.hits, ('miss',): book_cards.misses}, ['result'])
+    Gauge('bot_llm_cache', 'LLM answer cache lookups',
+          lambda: {('hit',): openai_client.cache.hits, ('miss',): openai_client.cache.misses}, ['result'])
+    Gauge('bot_catalog_books', 'Books in the live catalog snapshot', lambda: len(current_catalog().books))
+    Gauge('bot_catalog_snapshot', 'Number of the live catalog snapshot', lambda: current_catalog().number)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Задержка и ошибки обработчиков по имени функции-обработчика.
+
+    Подключается как inner middleware: к этому моменту фильтры уже
+    выбрали обработчик, и он есть в data['handler'].
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+class UpdateCounterMiddleware(BaseMiddleware):
+    """Число обновлений по типу, включая те, для которых нет обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        UPDATES.inc(getattr(event, 'event_type', 'unknown'))
+        return await handler(event, data)
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """HTTP-сервер с /metrics на локальном адресе"""
+    if not METRICS_ENABLED:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logger.error(f"Metrics endpoint unavailable on {METRICS_HOST}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrics on http://{METRICS_HOST}:{port}/metrics")
+    return runner
@@ -0,0 +1,94 @@
+import datetime
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .catalog import current_catalog
+from .database import AsyncSessionLocal
+from .models import User
+from .write_behind import WriteBehindBuffer, write_behind
+
+# Как часто обновлять last_active одного пользователя, секунд
+USER_ACTIVITY_INTERVAL = float(os.getenv('USER_ACTIVITY_INTERVAL', '300'))
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Сессия БД на время обработки одного обновления.
+
+    Сессия создаётся только для обработчиков с параметром session,
+    а соединение из пула берётся при первом запросе внутри обработчика.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker = AsyncSessionLocal):
+        self.session_factory = session_factory
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        if handler_object is None or 'session' not in handler_object.params:
+            return await handler(event, data)
+
+        async with self.session_factory() as session:
+            data['session'] = session
+            result = await handler(event, data)
+            # Фиксируем изменения, если обработчик открыл транзакцию
+            if session.in_transaction():
+                await session.commit()
+            return result
+
+class UserActivityMiddleware(BaseMiddleware):
+    """Запись пользователей и их активности через буфер отложенной записи.
+
+    Пользователь записывается не чаще раза в USER_ACTIVITY_INTERVAL,
+    поэтому поток обновлений не превращается в поток UPSERT.
+    """
+
+    def __init__(self, buffer: WriteBehindBuffer = write_behind, interval: float = USER_ACTIVITY_INTERVAL):
+        self.buffer = buffer
+        self.interval = interval
+        self._last_seen: Dict[int, float] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        now = time.monotonic()
+        if user is not None and now - self._last_seen.get(user.id, float('-inf')) >= self.interval:
+            if len(self._last_seen) > 100_000:
+                self._last_seen = {k: v for k, v in self._last_seen.items() if now - v < self.interval}
+            self._last_seen[user.id] = now
+            await self.buffer.add(User, {
+                'telegram_id': str(user.id),
+                'username': user.username,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'language_code': user.language_code,
+                'last_active': datetime.datetime.now(),
+            })
+        return await handler(event, data)
+
+class CatalogMiddleware(BaseMiddleware):
+    """Один снимок каталога на всё время обработки обновления.
+
+    Обработчик получает его в параметре catalog; замена каталога в фоне
+    не затрагивает уже начатые запросы.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        data['catalog'] = current_catalog()
+        return await handler(event, data)
@@ -0,0 +1,463 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Any, Callable, Iterator, Optional, Sequence, Tuple, Union
+
+from .catalog_index import LANGUAGE_NAMES, RATING_THRESHOLDS, PRICE_RANGES
+
+# Формат файла: заголовок, таблица секций, секции с выравниванием по 8 байт.
+# Числа пишутся в порядке байтов машины; файл с другим порядком не открывается.
+# Производные данные (индексы по словам, карты клавиатур, быстрые списки) лежат
+# в секциях «префикс.имя»: процессы не строят их заново, а открывают готовыми.
+MAGIC = b'BOOKCAT\x01'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIIQ16sI4x')
+_SECTION = struct.Struct('<32sQQ')
+_LITTLE = 1 if sys.byteorder == 'little' else 0
+
+# Отсутствующие значения в колонках фиксированной ширины
+MISSING = -1
+NO_STRING = 0xFFFFFFFF
+
+# Строковые поля книги: в колонке хранится номер строки в общем пуле
+STRING_FIELDS = ('title', 'author', 'genre', 'isbn', 'publisher', 'language', 'currency', 'description')
+LIST_FIELDS = ('tags', 'available_formats')
+
+class _Writer:
+    """Сборка файла: секции копятся в памяти и пишутся одним проходом"""
+
+    def __init__(self):
+        self.sections: List[Tuple[str, bytes]] = []
+
+    def add(self, name: str, data: Union[array, bytes]):
+        self.sections.append((name, data.tobytes() if isinstance(data, array) else bytes(data)))
+
+    def write(self, path: str, count: int, version: str):
+        table_size = _HEADER.size + _SECTION.size * len(self.sections)
+        offset = _align(table_size)
+        entries = []
+        for name, data in self.sections:
+            entries.append(_SECTION.pack(name.encode('ascii'), offset, len(data)))
+            offset = _align(offset + len(data))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, _LITTLE, count,
+                                 version.encode('ascii')[:16], len(self.sections)))
+            for entry in entries:
+                f.write(entry)
+            for name, data in self.sections:
+                f.write(b'\0' * (_align(f.tell()) - f.tell()))
+                f.write(data)
+        # Замена файла атомарна: открытые отображения старого файла остаются целыми
+        os.replace(tmp_path, path)
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+class _StringPool:
+    """Пул строк без повторов: номер строки -> смещение в общем блоке байтов"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.offsets = array('Q', [0])
+        self.blob = bytearray()
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.ids)
+            self.blob += value.encode('utf-8')
+            self.offsets.append(len(self.blob))
+        return string_id
+
+def _postings(values_by_rank: List[List[int]], pool: _StringPool, writer: _Writer, name: str):
+    """Инвертированные списки: ключи по возрастанию байтов строки, начала списков и ранги"""
+    postings: Dict[int, array] = {}
+    for rank, values in enumerate(values_by_rank):
+        for value in values:
+            posting = postings.setdefault(value, array('I'))
+            if not posting or posting[-1] != rank:
+                posting.append(rank)
+    strings = {string_id: value.encode('utf-8') for value, string_id in pool.ids.items() if string_id in postings}
+    keys = sorted(postings, key=strings.__getitem__)
+    starts = array('I', [0])
+    ranks = array('I')
+    for key in keys:
+        ranks.extend(postings[key])
+        starts.append(len(ranks))
+    writer.add(f"{name}.keys", array('I', keys))
+    writer.add(f"{name}.starts", starts)
+    writer.add(f"{name}.ranks", ranks)
+
+def write_catalog(books: List[Dict[str, Any]], version: str, path: str,
+                  derived: Optional[Dict[str, Callable[[List[Dict[str, Any]]], Dict[str, Any]]]] = None):
+    """Запись каталога в файл для MmapCatalog.
+
+    derived - сборки производных данных (префикс -> функция от книг в
+    порядке рангов): их массивы пишутся секциями «префикс.имя», и
+    процессы берут их через MmapCatalog.sections() вместо сборки.
+    """
+    # Ранги - по убыванию рейтинга, как в CatalogIndex
+    order = sorted(range(len(books)), key=lambda i: books[i].get('rating', 0), reverse=True)
+    books = [books[i] for i in order]
+    n = len(books)
+    writer = _Writer()
+    pool = _StringPool()
+
+    ids = array('q', (b['id'] for b in books))
+    writer.add('id', ids)
+    writer.add('rating', array('d', (b.get('rating', float('nan')) for b in books)))
+    writer.add('price', array('d', (b.get('price', float('nan')) for b in books)))
+    writer.add('year', array('i', (b.get('publication_year', MISSING) for b in books)))
+    writer.add('pages', array('i', (b.get('pages', MISSING) for b in books)))
+    for field in STRING_FIELDS:
+        writer.add(field, array('I', (pool.add(b.get(field)) for b in books)))
+
+    for field in LIST_FIELDS:
+        starts = array('I', [0])
+        values = array('I')
+        for book in books:
+            values.extend(pool.add(value) for value in book.get(field, []))
+            starts.append(len(values))
+        writer.add(f"{field}.starts", starts)
+        writer.add(f"{field}.values", values)
+
+    # Поиск книги по id: отсортированные id и их ранги
+    by_id = sorted(range(n), key=ids.__getitem__)
+    writer.add('by_id.ids', array('q', (ids[r] for r in by_id)))
+    writer.add('by_id.ranks', array('I', by_id))
+
+    # Диапазоны цены и года: ранги, упорядоченные по значению
+    prices = [b.get('price', 0) for b in books]
+    price_order = sorted(range(n), key=prices.__getitem__)
+    writer.add('price.order', array('I', price_order))
+    writer.add('price.keys', array('d', (prices[r] for r in price_order)))
+    years = [b.get('publication_year') for b in books]
+    year_order = sorted((r for r in range(n) if years[r] is not None), key=years.__getitem__)
+    writer.add('year.order', array('I', year_order))
+    writer.add('year.keys', array('i', (years[r] for r in year_order)))
+
+    _postings([[pool.ids[t] for t in b.get('tags', [])] for b in books], pool, writer, 'tag')
+    _postings([[pool.ids[b['language']]] if b.get('language') else [] for b in books], pool, writer, 'lang')
+
+    # Авторы в нижнем регистре одним блоком: подстрока ищется mmap.find по всему блоку
+    authors: Dict[str, array] = {}
+    for rank, book in enumerate(books):
+        authors.setdefault(book['author'].lower(), array('I')).append(rank)
+    author_blob = bytearray()
+    author_offsets = array('Q', [0])
+    author_starts = array('I', [0])
+    author_ranks = array('I')
+    for author, ranks in authors.items():
+        author_blob += author.encode('utf-8') + b'\0'
+        author_offsets.append(len(author_blob))
+        author_ranks.extend(ranks)
+        author_starts.append(len(author_ranks))
+    writer.add('authors.blob', author_blob)
+    writer.add('authors.offsets', author_offsets)
+    writer.add('authors.starts', author_starts)
+    writer.add('authors.ranks', author_ranks)
+
+    writer.add('strings.offsets', pool.offsets)
+    writer.add('strings.blob', pool.blob)
+
+    for prefix, build in (derived or {}).items():
+        for name, data in build(books).items():
+            writer.add(f"{prefix}.{name}", data)
+    writer.write(path, n, version)
+
+class BookList(Sequence):
+    """Книги по списку рангов; словари создаются только при обращении"""
+
+    def __init__(self, catalog: "MmapCatalog", ranks: Sequence[int]):
+        self.catalog = catalog
+        self.ranks = ranks
+
+    def __len__(self) -> int:
+        return len(self.ranks)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.catalog.book(rank) for rank in self.ranks[item]]
+        return self.catalog.book(self.ranks[item])
+
+    def ids(self) -> List[int]:
+        """ID книг без создания словарей"""
+        ids = self.catalog._id
+        return [ids[rank] for rank in self.ranks]
+
+class _ById:
+    """Книга по id: двоичный поиск по отсортированной колонке id"""
+
+    def __init__(self, catalog: "MmapCatalog"):
+        self.catalog = catalog
+
+    def _rank(self, book_id: int) -> Optional[int]:
+        ids = self.catalog._by_id_ids
+        i = bisect_left(ids, book_id)
+        if i < len(ids) and ids[i] == book_id:
+            return self.catalog._by_id_ranks[i]
+        return None
+
+    def __contains__(self, book_id) -> bool:
+        return isinstance(book_id, int) and self._rank(book_id) is not None
+
+    def __getitem__(self, book_id: int) -> Dict[str, Any]:
+        rank = self._rank(book_id) if isinstance(book_id, int) else None
+        if rank is None:
+            raise KeyError(book_id)
+        return self.catalog.book(rank)
+
+    def get(self, book_id: int, default=None):
+        return self[book_id] if book_id in self else default
+
+    def __len__(self) -> int:
+        return len(self.catalog)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.catalog._by_id_ids)
+
+class MmapCatalog:
+    """Каталог, открытый из файла write_catalog через mmap.
+
+    Колонки - это memoryview прямо над отображением файла: при открытии
+    ничего не разбирается и не копируется, а все процессы на машине
+    делят одни и те же страницы кэша. Поиск повторяет CatalogIndex:
+    самый короткий список кандидатов и точечные проверки остальных
+    критериев; словари книг создаются только для выдачи.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        # По нему видно, что файл заменили новой версией
+        self.file_id = (stat.st_ino, stat.st_mtime_ns)
+        self._view = memoryview(self._mmap)
+        magic, format_version, little, count, version, sections = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a catalog file of version {FORMAT_VERSION}")
+        if little != _LITTLE:
+            raise ValueError(f"{path} was written with a different byte order")
+        self._count = count
+        self.version = version.rstrip(b'\0').decode('ascii')
+
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        for i in range(sections):
+            name, offset, length = _SECTION.unpack_from(self._mmap, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, length)
+
+        self._id = self._column('id', 'q')
+        self._rating = self._column('rating', 'd')
+        self._price = self._column('price', 'd')
+        self._year = self._column('year', 'i')
+        self._pages = self._column('pages', 'i')
+        self._strings = {field: self._column(field, 'I') for field in STRING_FIELDS}
+        self._lists = {
+            field: (self._column(f"{field}.starts", 'I'), self._column(f"{field}.values", 'I'))
+            for field in LIST_FIELDS
+        }
+        self._by_id_ids = self._column('by_id.ids', 'q')
+        self._by_id_ranks = self._column('by_id.ranks', 'I')
+        self._price_order = self._column('price.order', 'I')
+        self._price_keys = self._column('price.keys', 'd')
+        self._year_order = self._column('year.order', 'I')
+        self._year_keys = self._column('year.keys', 'i')
+        self._string_offsets = self._column('strings.offsets', 'Q')
+        self._string_blob_start = self._sections['strings.blob'][0]
+        self._authors_range = self._sections['authors.blob']
+        self._author_offsets = self._column('authors.offsets', 'Q')
+        self._author_starts = self._column('authors.starts', 'I')
+        self._author_ranks = self._column('authors.ranks', 'I')
+
+        self.books = BookList(self, range(count))
+        self.by_id = _ById(self)
+
+    def _column(self, name: str, typecode: str) -> memoryview:
+        offset, length = self._sections[name]
+        return self._view[offset:offset + length].cast(typecode)
+
+    def sections(self, prefix: str, schema: Dict[str, str]) -> Optional[Dict[str, memoryview]]:
+        """Секции производных данных по схеме имя -> код типа; None, если в файле их нет"""
+        names = {name: f"{prefix}.{name}" for name in schema}
+        if not all(section in self._sections for section in names.values()):
+            return None
+        return {name: self._column(names[name], typecode) for name, typecode in schema.items()}
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        """Размер файла: его страницы общие для всех процессов"""
+        return len(self._mmap)
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id == NO_STRING:
+            return None
+        start = self._string_blob_start + self._string_offsets[string_id]
+        end = self._string_blob_start + self._string_offsets[string_id + 1]
+        return str(self._view[start:end], 'utf-8')
+
+    def book(self, rank: int) -> Dict[str, Any]:
+        """Книга в том же виде, что и записи BOOKS_DATABASE"""
+        book: Dict[str, Any] = {'id': self._id[rank]}
+        for field in STRING_FIELDS:
+            value = self.string(self._strings[field][rank])
+            if value is not None:
+                book[field] = value
+        for field, column in (('rating', self._rating), ('price', self._price)):
+            value = column[rank]
+            if value == value:  # NaN - значения нет
+                book[field] = int(value) if field == 'price' and value.is_integer() else value
+        for field, column in (('publication_year', self._year), ('pages', self._pages)):
+            if column[rank] != MISSING:
+                book[field] = column[rank]
+        for field, (starts, values) in self._lists.items():
+            book[field] = [self.string(values[i]) for i in range(starts[rank], starts[rank + 1])]
+        return book
+
+    def _posting(self, name: str, key: str) -> Sequence[int]:
+        """Список рангов по значению: двоичный поиск среди ключей"""
+        keys = self._column(f"{name}.keys", 'I')
+        needle = key.encode('utf-8')
+        lo, hi = 0, len(keys)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            string_id = keys[mid]
+            start = self._string_blob_start + self._string_offsets[string_id]
+            value = self._mmap[start:self._string_blob_start + self._string_offsets[string_id + 1]]
+            if value < needle:
+                lo = mid + 1
+            elif value > needle:
+                hi = mid
+            else:
+                starts = self._column(f"{name}.starts", 'I')
+                return self._column(f"{name}.ranks", 'I')[starts[mid]:starts[mid + 1]]
+        return ()
+
+    def _author_matches(self, needle: str) -> List[int]:
+        """Ранги книг авторов, в имени которых есть подстрока (по возрастанию)"""
+        pattern = needle.lower().encode('utf-8')
+        if b'\0' in pattern:
+            return []
+        start, length = self._authors_range
+        end = start + length
+        ranks = []
+        last_author = -1
+        position = self._mmap.find(pattern, start, end)
+        while position != -1:
+            author = bisect_right(self._author_offsets, position - start) - 1
+            if author != last_author:
+                ranks.extend(self._author_ranks[self._author_starts[author]:self._author_starts[author + 1]])
+                last_author = author
+            # Следующее совпадение ищется со следующего автора
+            position = self._mmap.find(pattern, start + self._author_offsets[author + 1], end)
+        ranks.sort()
+        return ranks
+
+    def search_ranks(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> List[int]:
+        """Ранги найденных книг в порядке убывания рейтинга (candidates - как в CatalogIndex)"""
+        constraints = []
+
+        if candidates is not None:
+            constraints.append((len(candidates), candidates, True, lambda r, p=candidates: _contains(p, r)))
+
+        if params.get('genre'):
+            posting = self._posting('tag', params['genre'])
+            constraints.append((len(posting), posting, True, lambda r, p=posting: _contains(p, r)))
+
+        threshold = RATING_THRESHOLDS.get(params.get('rating'))
+        if threshold is not None:
+            end = bisect_right(self._rating, -threshold, key=_negate)
+            constraints.append((end, range(end), True, lambda r, t=threshold: self._rating[r] >= t))
+
+        bounds = PRICE_RANGES.get(params.get('price'))
+        if bounds is not None:
+            low, high = bounds
+            start = bisect_right(self._price_keys, low) if low is not None else 0
+            end = bisect_right(self._price_keys, high) if high is not None else len(self._price_keys)
+            ranks = self._price_order[start:end]
+            prices = self._price
+            constraints.append((len(ranks), ranks, False, lambda r, lo=low, hi=high: (
+                (lo is None or _zero(prices[r]) > lo) and (hi is None or _zero(prices[r]) <= hi)
+            )))
+
+        language = LANGUAGE_NAMES.get(params.get('language'))
+        if language is not None:
+            posting = self._posting('lang', language)
+            constraints.append((len(posting), posting, True, lambda r, p=posting: _contains(p, r)))
+
+        year_from, year_to = params.get('year_from'), params.get('year_to')
+        if year_from or year_to:
+            start = bisect_left(self._year_keys, year_from) if year_from else 0
+            end = bisect_right(self._year_keys, year_to) if year_to else len(self._year_keys)
+            ranks = self._year_order[start:end]
+            years = self._year
+            constraints.append((len(ranks), ranks, False, lambda r, yf=year_from, yt=year_to: (
+                years[r] != MISSING and (not yf or years[r] >= yf) and (not yt or years[r] <= yt)
+            )))
+
+        if params.get('author'):
+            matches = self._author_matches(params['author'])
+            constraints.append((len(matches), matches, True, lambda r, p=matches: _contains(p, r)))
+
+        if not constraints:
+            return list(range(self._count))
+
+        constraints.sort(key=lambda c: c[0])
+        _, candidates, ordered, _ = constraints[0]
+        checks = [check for _, _, _, check in constraints[1:]]
+        result = [r for r in candidates if all(check(r) for check in checks)]
+        if not ordered:
+            result.sort()
+        return result
+
+    def search(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> BookList:
+        """Поиск книг по параметрам, отсортированных по убыванию рейтинга"""
+        return BookList(self, self.search_ranks(params, candidates))
+
+    def count(self, params: Dict[str, Any], candidates: Optional[Sequence[int]] = None) -> int:
+        """Количество книг, подходящих под параметры"""
+        return len(self.search_ranks(params, candidates))
+
+def _negate(value: float) -> float:
+    return -value if value == value else 0.0
+
+def _zero(value: float) -> float:
+    return value if value == value else 0
+
+def _contains(posting: Sequence[int], rank: int) -> bool:
+    i = bisect_left(posting, rank)
+    return i < len(posting) and posting[i] == rank
+
+if __name__ == "__main__":
+    # Сборка файла каталога из CATALOG_SOURCE: python -m app.mmap_catalog
+    import logging
+    import time
+    from .catalog import (CATALOG_MMAP_PATH, CATALOG_SOURCE, catalog_file_sections,
+                          compute_catalog_version, db_catalog_version, load_books_from_db)
+    from .data.books_data import BOOKS_DATABASE
+    # Готовые быстрые списки тоже пишутся в файл
+    from . import quick_lists  # noqa: F401
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    if CATALOG_SOURCE == 'db':
+        books, version = load_books_from_db(), db_catalog_version()
+    else:
+        books, version = BOOKS_DATABASE, compute_catalog_version(BOOKS_DATABASE)
+    write_catalog(books, version, CATALOG_MMAP_PATH, catalog_file_sections())
+    logging.getLogger(__name__).info(
+        f"Catalog {version} written to {CATALOG_MMAP_PATH}: {len(books)} books in {time.perf_counter() - started:.1f}s"
+    )
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, Text, Boolean, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Text, Boolean, DateTime, JSON, Index, Identity
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import datetime
@@ -21,11 +22,21 @@ class Book(Base):
     price = Column(Float)
     currency = Column(String(3), default='USD')
     description = Column(Text)
-    tags = Column(JSON)  # Список тегов/ключевых слов
+    tags = Column(JSON().with_variant(JSONB(), 'postgresql'))  # Список тегов/ключевых слов
     available_formats = Column(JSON)  # ['paperback', 'ebook', 'audiobook']
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    # Индексы для поиска по критериям (см. migrations/versions/0002_book_search_indexes.py)
+    __table_args__ = (
+        Index('ix_books_tags', 'tags', postgresql_using='gin'),
+        Index('ix_books_rating_id', rating.desc().nullslast(), id),
+        Index('ix_books_price', 'price'),
+        Index('ix_books_publication_year', 'publication_year'),
+        Index('ix_books_language', 'language'),
+        Index('ix_books_author_trgm', 'author', postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'}),
+    )
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -36,7 +47,6 @@ class User(Base):
     last_name = Column(String(100))
     language_code = Column(String(10))
     preferences = Column(JSON)  # Предпочтения пользователя
-    search_history = Column(JSON)  # История поиска
     created_at = Column(DateTime, default=func.now())
     last_active = Column(DateTime, default=func.now())
 
@@ -44,7 +54,7 @@ class SearchSession(Base):
     __tablename__ = 'search_sessions'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
     search_params = Column(JSON)  # Параметры поиска
     results = Column(JSON)  # ID найденных книг
     created_at = Column(DateTime, default=func.now())
@@ -53,8 +63,82 @@ class Recommendation(Base):
     __tablename__ = 'recommendations'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
     book_id = Column(Integer, nullable=False)
     ai_analysis = Column(Text)  # Анализ от ИИ
     match_score = Column(Float)  # Оценка соответствия
     created_at = Column(DateTime, default=func.now())
+
+class JobWatermark(Base):
+    """Последняя обработанная строка источника для инкрементальных задач"""
+    __tablename__ = 'job_watermarks'
+    
+    name = Column(String(100), primary_key=True)  # Задача и таблица-источник
+    last_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class ItemCooccurrence(Base):
+    """Сколько раз две книги встретились в одной выдаче (book_a < book_b)"""
+    __tablename__ = 'item_cooccurrence'
+    
+    book_a = Column(Integer, primary_key=True)
+    book_b = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_item_cooccurrence_book_b', 'book_b'),
+    )
+
+class ItemInteractions(Base):
+    """В скольких выдачах встретилась книга"""
+    __tablename__ = 'item_interactions'
+    
+    book_id = Column(Integer, primary_key=True)
+    baskets = Column(Integer, nullable=False)
+
+class BookNeighbour(Base):
+    """Предрасчитанные похожие книги по совместным показам"""
+    __tablename__ = 'book_neighbours'
+    
+    book_id = Column(Integer, primary_key=True)
+    neighbour_id = Column(Integer, primary_key=True)
+    score = Column(Float, nullable=False)
+
+class SearchEvent(Base):
+    """История поиска: только добавление, таблица секционирована по месяцам"""
+    __tablename__ = 'search_events'
+    
+    id = Column(BigInteger, Identity(), primary_key=True)
+    created_at = Column(DateTime, primary_key=True, default=func.now())  # Ключ секционирования
+    user_id = Column(BigInteger, nullable=False)
+    params = Column(JSON().with_variant(JSONB(), 'postgresql'))  # Критерии поиска
+    result_count = Column(Integer)
+
+    __table_args__ = (
+        Index('ix_search_events_user_created', 'user_id', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class UserPreferenceSummary(Base):
+    """Сводка предпочтений пользователя, обновляется вместе с записью search_events"""
+    __tablename__ = 'user_preference_summary'
+    
+    user_id = Column(BigInteger, primary_key=True)
+    searches = Column(Integer, nullable=False, default=0)
+    counts = Column(JSON().with_variant(JSONB(), 'postgresql'))  # {"genre:Фэнтези": 3, "author:толстой": 1}
+    last_search_at = Column(DateTime)
+
+class SavedSearch(Base):
+    """Сохранённый поиск: новые книги по нему приходят пользователю уведомлением"""
+    __tablename__ = 'saved_searches'
+    
+    id = Column(BigInteger, Identity(), primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    params = Column(JSON().with_variant(JSONB(), 'postgresql'), nullable=False)  # Канонические критерии поиска
+    anchor = Column(String(150), nullable=False)  # Самый избирательный критерий (см. saved_searches.anchor_term)
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('uq_saved_searches_user_params', 'user_id', 'params', unique=True),
+        Index('ix_saved_searches_anchor', 'anchor', 'id'),
+    )
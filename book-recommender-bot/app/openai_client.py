@@ -1,18 +1,221 @@
-import openai
+import asyncio
+import logging
 import os
-from typing import List, Dict, Any
+import random
+import time
+from typing import List, Dict, Any, AsyncIterator
+
+import httpx
+import openai
 from dotenv import load_dotenv
 
+from .llm_cache import LLMCache, canonical_search_params
+from .metrics import LLM_ERRORS, LLM_LATENCY, LLM_TOKENS
+from .singleflight import SingleFlight
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых запрос имеет смысл повторить
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+def _record_usage(usage: Any):
+    if usage is not None:
+        LLM_TOKENS.inc('prompt', amount=usage.prompt_tokens)
+        LLM_TOKENS.inc('completion', amount=usage.completion_tokens)
+
 class OpenAIClient:
     def __init__(self):
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
-        self.client = openai.OpenAI(api_key=self.api_key)
-    
-    async def analyze_books_recommendation(self, books: List[Dict], user_params: Dict) -> str:
-        """Анализ книг и предоставление рекомендаций"""
+
+        # Таймаут одной попытки и общий дедлайн вызова (с ожиданием и повторами)
+        self.timeout = float(os.getenv('OPENAI_TIMEOUT', '30'))
+        self.deadline = float(os.getenv('OPENAI_DEADLINE', '60'))
+        self.max_retries = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+        self.retry_backoff = float(os.getenv('OPENAI_RETRY_BACKOFF', '0.5'))
+
+        # Глобальное ограничение числа одновременных запросов к API
+        max_concurrency = int(os.getenv('OPENAI_MAX_CONCURRENCY', '8'))
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Общий пул соединений на весь процесс
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=5.0)
+        )
+        self.client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            timeout=self.timeout,
+            max_retries=0,  # Повторы выполняем сами, с джиттером
+            http_client=http_client
+        )
+
+        # Кэш готовых ответов в Redis и объединение одинаковых запросов в полёте
+        self.cache = LLMCache()
+        self.singleflight = SingleFlight()
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        await self.client.close()
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Задержка перед повтором: экспоненциальная с полным джиттером"""
+        delay = random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+        # При 429 уважаем Retry-After, если сервер его прислал
+        response = getattr(error, 'response', None)
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get('retry-after', 0)))
+            except ValueError:
+                pass
+
+        return delay
+
+    async def _complete(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+        """Запрос к модели с ограничением параллелизма, таймаутами и повторами"""
+        try:
+            async with asyncio.timeout(self.deadline):
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        async with self.semaphore:
+                            started = time.perf_counter()
+                            # Длительность пишется и для неудачных и прерванных дедлайном попыток
+                            try:
+                                response = await self.client.chat.completions.create(
+                                    model=self.model,
+                                    messages=messages,
+                                    temperature=temperature,
+                                    max_tokens=max_tokens
+                                )
+                            finally:
+                                LLM_LATENCY.observe(time.perf_counter() - started, 'complete')
+                        _record_usage(response.usage)
+                        return response.choices[0].message.content
+
+                    except RETRYABLE_ERRORS as e:
+                        LLM_ERRORS.inc(type(e).__name__)
+                        if attempt == self.max_retries:
+                            raise
+
+                        delay = self._retry_delay(attempt, e)
+                        logger.warning(
+                            f"OpenAI request failed ({type(e).__name__}), "
+                            f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+                        )
+                        await asyncio.sleep(delay)
+
+                    except openai.APIError as e:
+                        # Ошибки без повтора (ключ, лимит контекста и т.п.)
+                        LLM_ERRORS.inc(type(e).__name__)
+                        raise
+        except TimeoutError:
+            # Дедлайн всего запроса с повторами, как в _stream
+            LLM_ERRORS.inc('TimeoutError')
+            raise
+
+    async def _stream(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        """Потоковый запрос к модели: отдаёт фрагменты текста по мере генерации.
+
+        Повторы возможны только до получения первого фрагмента,
+        дедлайн проверяется между фрагментами.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    started = time.perf_counter()
+                    stream = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        # Последний фрагмент потока несёт расход токенов
+                        stream_options={'include_usage': True}
+                    )
+                    break
+
+                except RETRYABLE_ERRORS as e:
+                    LLM_ERRORS.inc(type(e).__name__)
+                    if attempt == self.max_retries:
+                        raise
+
+                    delay = self._retry_delay(attempt, e)
+                    logger.warning(
+                        f"OpenAI stream failed ({type(e).__name__}), "
+                        f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+                    )
+                    await asyncio.sleep(delay)
+
+                except openai.APIError as e:
+                    LLM_ERRORS.inc(type(e).__name__)
+                    raise
+
+            # Длительность пишется и для оборванных потоков: по дедлайну, ошибке или уходу читателя
+            try:
+                async with stream:
+                    async for chunk in stream:
+                        if loop.time() > deadline:
+                            LLM_ERRORS.inc('TimeoutError')
+                            raise TimeoutError("OpenAI stream deadline exceeded")
+                        if chunk.usage is not None:
+                            _record_usage(chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+            finally:
+                LLM_LATENCY.observe(time.perf_counter() - started, 'stream')
+
+    async def _cached_complete(self, kind: str, payload: Dict[str, Any], request: Dict[str, Any]) -> str:
+        """Запрос к модели через кэш ответов"""
+        key = self.cache.make_key(kind, payload)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        async def call() -> str:
+            result = await self._complete(**request)
+            await self.cache.set(key, result)
+            return result
+
+        return await self.singleflight.do(key, call, lookup=lambda: self.cache.get(key, record_stats=False))
+
+    async def _cached_stream(self, kind: str, payload: Dict[str, Any], request: Dict[str, Any]) -> AsyncIterator[str]:
+        """Потоковый запрос через кэш: при попадании ответ отдаётся целиком"""
+        key = self.cache.make_key(kind, payload)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        async def call() -> AsyncIterator[str]:
+            parts = []
+            async for chunk in self._stream(**request):
+                parts.append(chunk)
+                yield chunk
+
+            # В кэш попадает только полностью полученный ответ
+            await self.cache.set(key, "".join(parts))
+
+        async for chunk in self.singleflight.do_stream(
+            key, call, lookup=lambda: self.cache.get(key, record_stats=False)
+        ):
+            yield chunk
+
+    def _books_analysis_request(self, books: List[Dict], user_params: Dict) -> Dict[str, Any]:
+        """Параметры запроса для анализа найденных книг"""
         
         books_info = "\n".join([
             f"- '{b['title']}' by {b['author']}: "
@@ -27,7 +230,7 @@ class OpenAIClient:
         Ты эксперт по литературе и книжный консультант с 15-летним опытом работы.
         Проанализируй следующие книги и дай персональные рекомендации пользователю.
         
-        Критерии пользователя: {user_params}
+        Критерии пользователя: {canonical_search_params(user_params)}
         
         Найденные книги:
         {books_info}
@@ -43,24 +246,17 @@ class OpenAIClient:
         Будь дружелюбным и мотивирующим.
         """
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "Ты дружелюбный книжный эксперт, который помогает людям находить идеальные книги для чтения."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1500
-            )
-            
-            return response.choices[0].message.content
-            
-        except Exception as e:
-            return f"⚠️ Не удалось получить анализ от ИИ. Ошибка: {str(e)}"
+        return dict(
+            messages=[
+                {"role": "system", "content": "Ты дружелюбный книжный эксперт, который помогает людям находить идеальные книги для чтения."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=1500
+        )
     
-    async def generate_personal_recommendation(self, user_preferences: Dict, reading_history: List) -> str:
-        """Генерация персонализированных рекомендаций на основе истории"""
+    def _personal_recommendation_request(self, user_preferences: Dict, reading_history: List) -> Dict[str, Any]:
+        """Параметры запроса для персональных рекомендаций"""
         
         prompt = f"""
         На основе предпочтений пользователя и истории чтения, предложи 3-5 книг,
@@ -77,18 +273,86 @@ class OpenAIClient:
         Будь креативным и учитывай разнообразие жанров!
         """
         
+        return dict(
+            messages=[
+                {"role": "system", "content": "Ты персональный книжный консультант, который знает вкусы пользователя."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.8,
+            max_tokens=1000
+        )
+
+    def _books_analysis_payload(self, books: List[Dict], user_params: Dict) -> Dict[str, Any]:
+        """Всё, от чего зависит анализ: критерии поиска и ID книг"""
+        return {
+            'params': canonical_search_params(user_params),
+            'books': [b.get('id') for b in books]
+        }
+
+    def _personal_recommendation_payload(self, user_preferences: Dict, reading_history: List) -> Dict[str, Any]:
+        """Всё, от чего зависят персональные рекомендации"""
+        return {
+            'preferences': user_preferences,
+            'history': list(reading_history[-5:]) if reading_history else []
+        }
+
+    async def analyze_books_recommendation(self, books: List[Dict], user_params: Dict) -> str:
+        """Анализ книг и предоставление рекомендаций"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "Ты персональный книжный консультант, который знает вкусы пользователя."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.8,
-                max_tokens=1000
+            return await self._cached_complete(
+                'analysis',
+                self._books_analysis_payload(books, user_params),
+                self._books_analysis_request(books, user_params)
             )
-            
-            return response.choices[0].message.content
-            
+
+        except Exception as e:
+            return f"⚠️ Не удалось получить анализ от ИИ. Ошибка: {str(e)}"
+
+    async def stream_books_recommendation(self, books: List[Dict], user_params: Dict) -> AsyncIterator[str]:
+        """Потоковый анализ книг: фрагменты ответа по мере генерации"""
+        received = False
+        try:
+            async for chunk in self._cached_stream(
+                'analysis',
+                self._books_analysis_payload(books, user_params),
+                self._books_analysis_request(books, user_params)
+            ):
+                received = True
+                yield chunk
+
+        except Exception as e:
+            if received:
+                yield "\n\n⚠️ Ответ ИИ прерван."
+            else:
+                yield f"⚠️ Не удалось получить анализ от ИИ. Ошибка: {str(e)}"
+
+    async def generate_personal_recommendation(self, user_preferences: Dict, reading_history: List) -> str:
+        """Генерация персонализированных рекомендаций на основе истории"""
+        try:
+            return await self._cached_complete(
+                'personal',
+                self._personal_recommendation_payload(user_preferences, reading_history),
+                self._personal_recommendation_request(user_preferences, reading_history)
+            )
+
         except Exception as e:
             return f"Не удалось сгенерировать рекомендации. Попробуйте позже."
+
+    async def stream_personal_recommendation(self, user_preferences: Dict, reading_history: List) -> AsyncIterator[str]:
+        """Потоковая генерация персонализированных рекомендаций"""
+        received = False
+        try:
+            async for chunk in self._cached_stream(
+                'personal',
+                self._personal_recommendation_payload(user_preferences, reading_history),
+                self._personal_recommendation_request(user_preferences, reading_history)
+            ):
+                received = True
+                yield chunk
+
+        except Exception:
+            if received:
+                yield "\n\n⚠️ Ответ ИИ прерван."
+            else:
+                yield "Не удалось сгенерировать рекомендации. Попробуйте позже."
+
@@ -0,0 +1,206 @@
+import heapq
+import os
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Any, Mapping, Optional, Sequence, Tuple, Union
+
+from dotenv import load_dotenv
+
+from .fuzzy_index import search_key
+
+load_dotenv()
+
+# Сколько последних запросов помнит индекс одного снимка
+PREFIX_CACHE_SIZE = int(os.getenv('PREFIX_CACHE_SIZE', '10000'))
+# Для префиксов до этой длины лучшие книги выбираются заранее: их диапазоны
+# слов слишком длинные для слияния на каждом запросе
+PREFIX_PRECOMPUTED_LENGTH = int(os.getenv('PREFIX_PRECOMPUTED_LENGTH', '2'))
+PREFIX_PRECOMPUTED_SIZE = 50
+
+# Массивы индекса и коды их типов (array): так они пишутся в файл каталога
+SECTIONS = {
+    'words.blob': 'B', 'words.offsets': 'Q', 'starts': 'I', 'ranks': 'I',
+    'short.blob': 'B', 'short.offsets': 'Q', 'short.starts': 'I', 'short.ranks': 'I',
+}
+
+def _contains(posting: Sequence[int], value: int) -> bool:
+    i = bisect_left(posting, value)
+    return i < len(posting) and posting[i] == value
+
+class _Strings(Sequence):
+    """Отсортированные строки одним блоком байтов: годятся для bisect без списка str"""
+
+    def __init__(self, blob: Sequence[int], offsets: Sequence[int]):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'ascii')
+
+    def find(self, value: str) -> Optional[int]:
+        i = bisect_left(self, value)
+        return i if i < len(self) and self[i] == value else None
+
+def _pack(strings: List[str]) -> Tuple[bytes, array]:
+    # Слова search_key - только ASCII
+    offsets = array('Q', [0])
+    for value in strings:
+        offsets.append(offsets[-1] + len(value))
+    return ''.join(strings).encode('ascii'), offsets
+
+class PrefixIndex:
+    """Отсортированный массив слов названий и авторов для поиска по мере набора.
+
+    У каждого слова (в виде search_key) - отсортированный список рангов
+    книг, где оно встречается; ранг - место книги по убыванию рейтинга.
+    Последнее слово запроса ищется как префикс: диапазон слов находится
+    двоичным поиском, а их списки сливаются в порядке рангов до нужного
+    числа книг (для самых коротких префиксов - заранее). Предыдущие слова
+    запроса должны встретиться целиком. Ответы на повторяющиеся запросы
+    берутся из LRU-кэша. Все данные - плоские массивы (SECTIONS), поэтому
+    индекс из файла каталога открывается без сборки и копирования.
+    """
+
+    def __init__(self, books: Sequence[Dict[str, Any]], cache_size: int = PREFIX_CACHE_SIZE):
+        self._load(books, self.build_sections(books), cache_size)
+
+    @classmethod
+    def from_sections(cls, books: Sequence[Dict[str, Any]], sections: Mapping[str, Sequence[int]],
+                      cache_size: int = PREFIX_CACHE_SIZE) -> "PrefixIndex":
+        """Индекс поверх готовых секций (например, memoryview из файла каталога) без копирования"""
+        index = cls.__new__(cls)
+        index._load(books, sections, cache_size)
+        return index
+
+    def _load(self, books: Sequence[Dict[str, Any]], sections: Mapping[str, Sequence[int]], cache_size: int):
+        self.books = books
+        self.words = _Strings(sections['words.blob'], sections['words.offsets'])
+        self.starts = sections['starts']
+        self.ranks = sections['ranks']
+        self._short = _Strings(sections['short.blob'], sections['short.offsets'])
+        self._short_starts = sections['short.starts']
+        self._short_ranks = sections['short.ranks']
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[Tuple[str, ...], int], List[int]]" = OrderedDict()
+
+    @classmethod
+    def build_sections(cls, books: Sequence[Dict[str, Any]]) -> Dict[str, Union[array, bytes]]:
+        """Массивы индекса по книгам в порядке рангов (типы - в SECTIONS)"""
+        postings: Dict[str, array] = {}
+        for rank, book in enumerate(books):
+            for word in cls._book_words(book):
+                posting = postings.setdefault(word, array('I'))
+                # Ранги добавляются по возрастанию, повтор слова в книге не нужен
+                if not posting or posting[-1] != rank:
+                    posting.append(rank)
+        words = sorted(postings)
+        sections: Dict[str, Union[array, bytes]] = {}
+        sections['words.blob'], sections['words.offsets'] = _pack(words)
+        sections['starts'] = array('I', [0])
+        sections['ranks'] = array('I')
+        for word in words:
+            sections['ranks'].extend(postings[word])
+            sections['starts'].append(len(sections['ranks']))
+
+        # Лучшие книги коротких префиксов сливаются по уже собранным массивам
+        index = cls.__new__(cls)
+        index.words = _Strings(sections['words.blob'], sections['words.offsets'])
+        index.starts, index.ranks = sections['starts'], sections['ranks']
+        prefixes = sorted({word[:length] for word in words
+                           for length in range(1, min(len(word), PREFIX_PRECOMPUTED_LENGTH) + 1)})
+        sections['short.blob'], sections['short.offsets'] = _pack(prefixes)
+        sections['short.starts'] = array('I', [0])
+        sections['short.ranks'] = array('I')
+        for prefix in prefixes:
+            sections['short.ranks'].extend(index._merge(prefix, PREFIX_PRECOMPUTED_SIZE))
+            sections['short.starts'].append(len(sections['short.ranks']))
+        return sections
+
+    @staticmethod
+    def _book_words(book: Dict[str, Any]) -> List[str]:
+        return f"{search_key(book.get('title') or '')} {search_key(book.get('author') or '')}".split()
+
+    def _posting(self, position: int) -> Sequence[int]:
+        return self.ranks[self.starts[position]:self.starts[position + 1]]
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect_left(self.words, prefix)
+        # Все слова с префиксом меньше префикса, дополненного максимальным символом
+        end = bisect_left(self.words, prefix + '\uffff', start)
+        return start, end
+
+    def _merge(self, prefix: str, limit: int) -> List[int]:
+        """Первые limit рангов из списков всех слов с префиксом.
+
+        В куче - по одному текущему рангу каждого списка: её построение
+        линейно по числу слов, а каждый следующий ранг стоит log от него.
+        """
+        start, end = self._prefix_range(prefix)
+        starts, ranks = self.starts, self.ranks
+        # Позиция в общем массиве рангов и конец списка слова
+        heap = [(ranks[starts[i]], starts[i], starts[i + 1]) for i in range(start, end)]
+        heapq.heapify(heap)
+        result = []
+        while heap and len(result) < limit:
+            rank, position, stop = heap[0]
+            if not result or result[-1] != rank:
+                result.append(rank)
+            if position + 1 < stop:
+                heapq.heapreplace(heap, (ranks[position + 1], position + 1, stop))
+            else:
+                heapq.heappop(heap)
+        return result
+
+    def search_ranks(self, query: str, limit: int) -> List[int]:
+        """Ранги лучших по рейтингу книг, в названии или авторе которых есть слова запроса"""
+        words = tuple(search_key(query).split())
+        key = (words, limit)
+        ranks = self._cache.get(key)
+        if ranks is not None:
+            self._cache.move_to_end(key)
+            return ranks
+
+        ranks = self._search(words, limit)
+        self._cache[key] = ranks
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return ranks
+
+    def _search(self, words: Tuple[str, ...], limit: int) -> List[int]:
+        if not words:
+            return list(range(min(limit, len(self.books))))
+        *complete, last = words
+
+        if not complete:
+            if len(last) <= PREFIX_PRECOMPUTED_LENGTH and limit <= PREFIX_PRECOMPUTED_SIZE:
+                position = self._short.find(last)
+                if position is None:
+                    return []
+                start = self._short_starts[position]
+                return list(self._short_ranks[start:min(start + limit, self._short_starts[position + 1])])
+            return self._merge(last, limit)
+
+        exact = []
+        for word in complete:
+            position = self.words.find(word)
+            if position is None:
+                return []
+            exact.append(self._posting(position))
+        # Перебирается самый короткий список, остальные слова проверяются по рангу
+        exact.sort(key=len)
+        ranks = []
+        for rank in exact[0]:
+            if all(_contains(posting, rank) for posting in exact[1:]) and \
+                    any(word.startswith(last) for word in self._book_words(self.books[rank])):
+                ranks.append(rank)
+                if len(ranks) == limit:
+                    break
+        return ranks
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Лучшие по рейтингу книги по началу слов названия или автора"""
+        return [self.books[rank] for rank in self.search_ranks(query, limit)]
@@ -0,0 +1,147 @@
+import heapq
+import html
+import logging
+import os
+from array import array
+from typing import Dict, List, Any, Callable, Mapping, Optional, Sequence, Tuple, Union
+
+from dotenv import load_dotenv
+
+from .catalog import CatalogSnapshot, add_catalog_file_sections, add_catalog_warmer, current_catalog
+from .keyboards import get_quick_genres_keyboard
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+QUICK_LIST_SIZE = int(os.getenv('QUICK_LIST_SIZE', '5'))
+# Книги, изданные до этого года, считаются классикой
+CLASSIC_BEFORE_YEAR = int(os.getenv('CLASSIC_BEFORE_YEAR', '1950'))
+
+# Ранги книг списков и коды их типов (array): так они пишутся в файл каталога
+SECTIONS = {
+    'bestsellers': 'I', 'new': 'I', 'classics': 'I',
+    'genres.blob': 'B', 'genres.offsets': 'Q', 'genres.starts': 'I', 'genres.ranks': 'I',
+}
+
+def _by_rating(book: Dict[str, Any]) -> Tuple:
+    return (book.get('rating', 0),)
+
+def _by_year(book: Dict[str, Any]) -> Tuple:
+    return (book.get('publication_year') or 0, book.get('rating', 0))
+
+def _is_classic(book: Dict[str, Any]) -> bool:
+    tags = [t.lower() for t in book.get('tags', [])]
+    return (
+        'классика' in tags
+        or (book.get('genre') or '').lower() == 'классика'
+        or (book.get('publication_year') or CLASSIC_BEFORE_YEAR) < CLASSIC_BEFORE_YEAR
+    )
+
+class TopK:
+    """Первые k книг по ключу: куча из k элементов, минимальный - в корне"""
+
+    def __init__(self, k: int, key: Callable[[Dict[str, Any]], Tuple]):
+        self.k = k
+        self.key = key
+        self._heap: List[Tuple[Tuple, int, int]] = []
+
+    def add(self, book: Dict[str, Any], rank: int):
+        # При равном ключе выше книга с меньшим id
+        item = (self.key(book), -book['id'], rank)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+        elif item[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, item)
+
+    def ranks(self) -> array:
+        """Ранги книг по убыванию ключа"""
+        return array('I', (rank for _, _, rank in sorted(self._heap, key=lambda i: i[:2], reverse=True)))
+
+def _render(title: str, books: List[Dict[str, Any]], show_year: bool = False) -> str:
+    """Готовый текст ответа (HTML)"""
+    if not books:
+        return f"{title}\n\nПока нет книг в этой категории."
+    response = f"{title}\n\n"
+    for i, book in enumerate(books, 1):
+        response += f"{i}. <b>{html.escape(book['title'])}</b> - {html.escape(book['author'])}\n"
+        if show_year:
+            response += f"   📅 Год: {book.get('publication_year', 'не указан')}\n"
+        response += f"   ⭐ Рейтинг: {book.get('rating', 'нет')}/5\n"
+        response += f"   💰 Цена: {book['price']} {book['currency']}\n\n"
+    return response
+
+def select_quick_lists(books: Sequence[Dict[str, Any]], k: int = QUICK_LIST_SIZE) -> Dict[str, Union[array, bytes]]:
+    """Ранги книг всех списков за один проход по каталогу (типы - в SECTIONS).
+
+    Для каждой категории и каждого жанра поддерживается куча из k лучших книг.
+    """
+    bestsellers = TopK(k, _by_rating)
+    new = TopK(k, _by_year)
+    classics = TopK(k, _by_rating)
+    genres: Dict[str, TopK] = {}
+    counts: Dict[str, int] = {}
+
+    for rank, book in enumerate(books):
+        bestsellers.add(book, rank)
+        new.add(book, rank)
+        if _is_classic(book):
+            classics.add(book, rank)
+        if book.get('genre'):
+            genres.setdefault(book['genre'], TopK(k, _by_rating)).add(book, rank)
+            counts[book['genre']] = counts.get(book['genre'], 0) + 1
+
+    sections: Dict[str, Union[array, bytes]] = {
+        'bestsellers': bestsellers.ranks(), 'new': new.ranks(), 'classics': classics.ranks(),
+        'genres.blob': bytearray(), 'genres.offsets': array('Q', [0]),
+        'genres.starts': array('I', [0]), 'genres.ranks': array('I'),
+    }
+    # Жанры по числу книг, затем по алфавиту
+    for genre in sorted(genres, key=lambda g: (-counts[g], g)):
+        sections['genres.blob'] += genre.encode('utf-8')
+        sections['genres.offsets'].append(len(sections['genres.blob']))
+        sections['genres.ranks'].extend(genres[genre].ranks())
+        sections['genres.starts'].append(len(sections['genres.ranks']))
+    return sections
+
+class QuickLists:
+    """Готовые ответы быстрого поиска для одной версии каталога.
+
+    Книги списков выбирает select_quick_lists (или они уже лежат в файле
+    каталога); здесь по их рангам один раз рендерятся тексты, и
+    обработчики только берут готовый текст из словаря.
+    """
+
+    def __init__(self, books: Sequence[Dict[str, Any]], version: str, k: int = QUICK_LIST_SIZE,
+                 sections: Optional[Mapping[str, Sequence[int]]] = None):
+        self.version = version
+        sections = sections if sections is not None else select_quick_lists(books, k)
+
+        def pick(ranks: Sequence[int]) -> List[Dict[str, Any]]:
+            return [books[rank] for rank in ranks]
+
+        self.bestsellers = _render(f"📈 <b>Топ-{k} бестселлеров:</b>", pick(sections['bestsellers']))
+        self.new = _render("🎯 <b>Новинки:</b>", pick(sections['new']), show_year=True)
+        self.classics = _render("🏆 <b>Классика:</b>", pick(sections['classics']), show_year=True)
+        offsets, starts, ranks = sections['genres.offsets'], sections['genres.starts'], sections['genres.ranks']
+        self.genre_names = [
+            str(sections['genres.blob'][offsets[i]:offsets[i + 1]], 'utf-8') for i in range(len(offsets) - 1)
+        ]
+        self.genres = {
+            genre: _render(f"📚 <b>{html.escape(genre)}:</b>", pick(ranks[starts[i]:starts[i + 1]]))
+            for i, genre in enumerate(self.genre_names)
+        }
+        self.genre_keyboard = get_quick_genres_keyboard(self.genre_names)
+
+    def genre(self, name: str) -> Optional[str]:
+        return self.genres.get(name)
+
+def get_quick_lists(catalog: Optional[CatalogSnapshot] = None) -> QuickLists:
+    """Готовые списки снимка каталога; для файла каталога ранги книг уже лежат в нём"""
+    catalog = catalog or current_catalog()
+    return catalog.derived('quick_lists', lambda: QuickLists(
+        catalog.books, catalog.version, sections=catalog.file_sections('quick_lists', SECTIONS)
+    ))
+
+add_catalog_file_sections('quick_lists', select_quick_lists)
+add_catalog_warmer(get_quick_lists)
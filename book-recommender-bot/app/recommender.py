@@ -0,0 +1,213 @@
+import logging
+import math
+import os
+import re
+import zlib
+import time
+from typing import Dict, List, Any, Iterable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .catalog import CatalogSnapshot, current_catalog
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Размерность хэшированных признаков: матрица занимает n * dim * 4 байт
+RECOMMENDER_DIM = int(os.getenv('RECOMMENDER_DIM', '512'))
+RECOMMENDER_NEIGHBOURS = int(os.getenv('RECOMMENDER_NEIGHBOURS', '20'))
+# Память на блок сходств: число строк блока подбирается под размер каталога
+RECOMMENDER_BATCH_MB = int(os.getenv('RECOMMENDER_BATCH_MB', '256'))
+RECOMMENDER_DIR = os.getenv(
+    'RECOMMENDER_DIR', os.path.join(os.path.dirname(__file__), 'data', 'recommender')
+)
+
+# Веса полей: теги и жанр описывают книгу точнее, чем слова описания
+FIELD_WEIGHTS = {'title': 1.0, 'description': 1.0, 'tag': 2.0, 'genre': 2.0, 'author': 1.5}
+
+_WORD = re.compile(r'\w{3,}')
+
+def book_features(book: Dict[str, Any]) -> Dict[str, float]:
+    """Признаки книги с весами: слова названия и описания, теги, жанр, автор"""
+    features: Dict[str, float] = {}
+
+    def add(feature: str, weight: float):
+        features[feature] = features.get(feature, 0.0) + weight
+
+    for field in ('title', 'description'):
+        for word in _WORD.findall((book.get(field) or '').lower()):
+            add(f"w:{word}", FIELD_WEIGHTS[field])
+    for tag in book.get('tags', []):
+        add(f"t:{tag.lower()}", FIELD_WEIGHTS['tag'])
+    if book.get('genre'):
+        add(f"g:{book['genre'].lower()}", FIELD_WEIGHTS['genre'])
+    add(f"a:{book['author'].lower()}", FIELD_WEIGHTS['author'])
+    return features
+
+def _bucket(feature: str, dim: int) -> int:
+    return zlib.crc32(feature.encode('utf-8')) % dim
+
+def build_matrix(books: Sequence[Dict[str, Any]], dim: int = RECOMMENDER_DIM) -> np.ndarray:
+    """TF-IDF по хэшированным признакам, строки нормированы (косинус = скалярное произведение)"""
+    rows, cols, values = [], [], []
+    df: Dict[int, int] = {}
+    for row, book in enumerate(books):
+        buckets: Dict[int, float] = {}
+        for feature, weight in book_features(book).items():
+            bucket = _bucket(feature, dim)
+            buckets[bucket] = buckets.get(bucket, 0.0) + weight
+        for bucket, weight in buckets.items():
+            rows.append(row)
+            cols.append(bucket)
+            # Сублинейная частота: повторы слова в описании не доминируют
+            values.append(1.0 + math.log(weight) if weight > 1 else weight)
+            df[bucket] = df.get(bucket, 0) + 1
+
+    idf = np.zeros(dim, dtype=np.float32)
+    for bucket, count in df.items():
+        idf[bucket] = math.log((1 + len(books)) / (1 + count)) + 1
+
+    matrix = np.zeros((len(books), dim), dtype=np.float32)
+    cols_array = np.array(cols, dtype=np.int64)
+    np.add.at(matrix, (np.array(rows, dtype=np.int64), cols_array),
+              np.array(values, dtype=np.float32) * idf[cols_array])
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def top_neighbours(matrix: np.ndarray, k: int = RECOMMENDER_NEIGHBOURS,
+                   budget_mb: int = RECOMMENDER_BATCH_MB) -> Tuple[np.ndarray, np.ndarray]:
+    """Ближайшие k соседей каждой строки по косинусу.
+
+    Сходства считаются блоками строк (batch x n), поэтому полная матрица
+    n x n никогда не хранится в памяти; строк в блоке столько, чтобы он
+    уложился в budget_mb при любом размере каталога.
+    """
+    n = len(matrix)
+    k = min(k, n - 1) if n > 1 else 0
+    neighbours = np.zeros((n, k), dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbours, scores
+
+    # На строку блока: сходства float32 и индексы argpartition int64 - 12 байт на книгу
+    batch = max(1, budget_mb * 1024 * 1024 // (n * 12))
+    for start in range(0, n, batch):
+        end = min(start + batch, n)
+        sims = matrix[start:end] @ matrix.T
+        # Знак меняется на месте: argpartition ищет наименьшие, копия -sims не нужна
+        np.negative(sims, out=sims)
+        # Книга не рекомендуется сама себе
+        sims[np.arange(end - start), np.arange(start, end)] = np.inf
+        if k < n - 1:
+            idx = np.argpartition(sims, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(n), (end - start, 1))
+        part = -np.take_along_axis(sims, idx, axis=1)
+        order = np.argsort(-part, axis=1, kind='stable')[:, :k]
+        neighbours[start:end] = np.take_along_axis(idx, order, axis=1)
+        scores[start:end] = np.take_along_axis(part, order, axis=1)
+    return neighbours, scores
+
+class Recommender:
+    """Рекомендации «похожие книги» по предрасчитанной таблице соседей.
+
+    Таблица (id книг, индексы соседей, сходства) строится по векторному
+    представлению каталога вне процессов бота - python -m app.recommender
+    или загрузкой каталога (ingest.py) - и сохраняется на диск для каждой
+    версии каталога. Бот только читает её: запросы берут k соседей без перебора.
+    """
+
+    def __init__(self, by_id: Mapping[int, Dict[str, Any]], ids: np.ndarray,
+                 neighbours: np.ndarray, scores: np.ndarray, version: str = ''):
+        self.version = version
+        # Книги снимка каталога по id (для mmap - без создания словарей заранее)
+        self.by_id = by_id
+        self.ids = ids
+        self.neighbours = neighbours
+        self.scores = scores
+        self._row = {int(book_id): row for row, book_id in enumerate(ids)}
+
+    @classmethod
+    def build(cls, books: Sequence[Dict[str, Any]], version: str = '', dim: int = RECOMMENDER_DIM,
+              k: int = RECOMMENDER_NEIGHBOURS) -> "Recommender":
+        """Построение таблицы соседей по каталогу: O(n²), только вне процессов бота"""
+        ids = np.array([book['id'] for book in books], dtype=np.int64)
+        neighbours, scores = top_neighbours(build_matrix(books, dim), k)
+        return cls({book['id']: book for book in books}, ids, neighbours, scores, version)
+
+    @classmethod
+    def load(cls, by_id: Mapping[int, Dict[str, Any]], version: str,
+             directory: str = RECOMMENDER_DIR) -> Optional["Recommender"]:
+        """Таблица соседей версии каталога с диска; None, если её ещё не построили"""
+        path = table_path(version, directory)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(by_id, data['ids'], data['neighbours'], data['scores'], version)
+
+    def save(self, path: str):
+        """Атомарная запись таблицы соседей"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, ids=self.ids, neighbours=self.neighbours, scores=self.scores)
+        os.replace(tmp_path, path)
+
+    def similar(self, book_id: int, k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """Книги, похожие на данную"""
+        return self.recommend([book_id], k)
+
+    def recommend(self, seed_ids: Iterable[int], k: int = 5,
+                  exclude: Iterable[int] = ()) -> List[Tuple[Dict[str, Any], float]]:
+        """Рекомендации по нескольким книгам: среднее сходство со всеми ними"""
+        seeds = [self._row[book_id] for book_id in seed_ids if book_id in self._row]
+        skip = set(exclude) | {int(self.ids[row]) for row in seeds}
+        totals: Dict[int, float] = {}
+        for row in seeds:
+            for neighbour, score in zip(self.neighbours[row], self.scores[row]):
+                book_id = int(self.ids[neighbour])
+                if book_id not in skip and score > 0:
+                    totals[book_id] = totals.get(book_id, 0.0) + float(score)
+        best = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(self.by_id[book_id], score / len(seeds)) for book_id, score in best if book_id in self.by_id]
+
+def table_path(version: str, directory: str = RECOMMENDER_DIR) -> str:
+    return os.path.join(directory, f"neighbours_{version}.npz")
+
+def build_neighbour_table(books: Sequence[Dict[str, Any]], version: str,
+                          directory: str = RECOMMENDER_DIR) -> str:
+    """Построение и запись таблицы соседей версии каталога, если её ещё нет"""
+    path = table_path(version, directory)
+    if os.path.exists(path):
+        logger.info(f"Neighbour table for catalog {version} already exists: {path}")
+        return path
+    started = time.perf_counter()
+    Recommender.build(books, version).save(path)
+    logger.info(f"Neighbour table for catalog {version} built in {time.perf_counter() - started:.1f}s: "
+                f"{len(books)} books")
+    return path
+
+def get_recommender(catalog: Optional[CatalogSnapshot] = None) -> Optional[Recommender]:
+    """Рекомендатель для снимка каталога; None, пока таблица его версии не построена"""
+    catalog = catalog or current_catalog()
+    # None не запоминается: таблица подхватится, как только задание её запишет
+    return catalog.derived('recommender', lambda: Recommender.load(catalog.by_id, catalog.version))
+
+if __name__ == "__main__":
+    # Таблица соседей для каталога, который обслуживают процессы бота:
+    # python -m app.recommender (при деплое или по cron после смены каталога)
+    from .catalog import CATALOG_MMAP_PATH, CATALOG_SOURCE, SEARCH_BACKEND, db_catalog_version, load_books_from_db
+
+    logging.basicConfig(level=logging.INFO)
+    if SEARCH_BACKEND == 'mmap' and os.path.exists(CATALOG_MMAP_PATH):
+        snapshot = CatalogSnapshot.open(CATALOG_MMAP_PATH)
+        build_neighbour_table(snapshot.books, snapshot.version)
+    elif CATALOG_SOURCE == 'db':
+        build_neighbour_table(load_books_from_db(), db_catalog_version())
+    else:
+        snapshot = current_catalog()
+        build_neighbour_table(snapshot.books, snapshot.version)
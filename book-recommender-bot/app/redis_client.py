@@ -0,0 +1,25 @@
+import os
+from typing import Optional
+
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+_redis: Optional[Redis] = None
+
+def get_redis() -> Redis:
+    """Общее подключение к Redis (FSM, кэши) с единым пулом соединений"""
+    global _redis
+    if _redis is None:
+        _redis = Redis.from_url(REDIS_URL)
+    return _redis
+
+async def close_redis():
+    """Закрытие подключения к Redis"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,283 @@
+import asyncio
+import html
+import logging
+import os
+from typing import Dict, List, Any, Iterator, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from sqlalchemy import select, delete, update, func, literal, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from dotenv import load_dotenv
+
+from .catalog_index import LANGUAGE_NAMES, PRICE_RANGES, RATING_THRESHOLDS
+from .database import AsyncSessionLocal
+from .db_search import book_to_dict
+from .fuzzy_index import search_key
+from .llm_cache import canonical_search_params
+from .models import Book, JobWatermark, SavedSearch
+from .search_events import PRICE_NAMES
+from .sender import bulk_sends
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SAVED_SEARCH_LIMIT = int(os.getenv('SAVED_SEARCH_LIMIT', '10'))
+# Как часто искать новые книги в каталоге, секунд
+SAVED_SEARCH_INTERVAL = float(os.getenv('SAVED_SEARCH_INTERVAL', '60'))
+# Новых книг за один проход и подписок, читаемых из БД за раз
+SAVED_SEARCH_BOOK_BATCH = int(os.getenv('SAVED_SEARCH_BOOK_BATCH', '1000'))
+SAVED_SEARCH_SCAN_BATCH = int(os.getenv('SAVED_SEARCH_SCAN_BATCH', '10000'))
+SAVED_SEARCH_NOTIFY_BOOKS = int(os.getenv('SAVED_SEARCH_NOTIFY_BOOKS', '5'))
+# Уведомлений в работе одновременно; темп отправки задаёт SendScheduler
+SAVED_SEARCH_SEND_CONCURRENCY = int(os.getenv('SAVED_SEARCH_SEND_CONCURRENCY', '100'))
+
+WATERMARK = 'saved_searches:books'
+# Якорь подписок, у которых нет индексируемых критериев (только годы):
+# они проверяются для каждой новой книги
+ANY_ANCHOR = '*'
+# Длина префикса слова имени автора в якоре
+AUTHOR_PREFIX = 4
+
+def _author_words(text: str) -> List[str]:
+    return search_key(text or '').split()
+
+def anchor_term(params: Dict[str, Any]) -> str:
+    """Якорь подписки - признак, который обязан быть у подходящей книги.
+
+    Выбирается самый избирательный критерий: автор, жанр, язык, цена,
+    рейтинг. Подписка хранится только под своим якорем.
+    """
+    words = _author_words(params.get('author'))
+    if words:
+        return f"author:{max(words, key=len)[:AUTHOR_PREFIX]}"
+    if params.get('genre'):
+        return f"genre:{params['genre']}"
+    if params.get('language') in LANGUAGE_NAMES:
+        return f"language:{params['language']}"
+    if params.get('price') in PRICE_RANGES:
+        return f"price:{params['price']}"
+    if params.get('rating') in RATING_THRESHOLDS:
+        return f"rating:{params['rating']}"
+    return ANY_ANCHOR
+
+def book_terms(book: Dict[str, Any]) -> Iterator[str]:
+    """Все якоря, под которыми могут лежать подписки, подходящие книге"""
+    yield ANY_ANCHOR
+    for word in _author_words(book.get('author')):
+        for length in range(1, min(len(word), AUTHOR_PREFIX) + 1):
+            yield f"author:{word[:length]}"
+    for tag in book.get('tags', []):
+        yield f"genre:{tag}"
+    for code, name in LANGUAGE_NAMES.items():
+        if book.get('language') == name:
+            yield f"language:{code}"
+    price = book.get('price', 0)
+    for code, (low, high) in PRICE_RANGES.items():
+        if (low is None or price > low) and (high is None or price <= high):
+            yield f"price:{code}"
+    rating = book.get('rating', 0)
+    for code, threshold in RATING_THRESHOLDS.items():
+        if rating >= threshold:
+            yield f"rating:{code}"
+
+def book_matches(book: Dict[str, Any], params: Dict[str, Any]) -> bool:
+    """Подходит ли одна книга под критерии (те же правила, что в поиске).
+
+    Автор сравнивается по началам слов в виде search_key: якорь
+    подписки строится по префиксу слова, и проверка с ним согласована.
+    """
+    if params.get('genre') and params['genre'] not in book.get('tags', []):
+        return False
+    threshold = RATING_THRESHOLDS.get(params.get('rating'))
+    if threshold is not None and book.get('rating', 0) < threshold:
+        return False
+    bounds = PRICE_RANGES.get(params.get('price'))
+    if bounds is not None:
+        low, high = bounds
+        price = book.get('price', 0)
+        if (low is not None and price <= low) or (high is not None and price > high):
+            return False
+    language = LANGUAGE_NAMES.get(params.get('language'))
+    if language is not None and book.get('language') != language:
+        return False
+    year = book.get('publication_year')
+    if params.get('year_from') and (year is None or year < params['year_from']):
+        return False
+    if params.get('year_to') and (year is None or year > params['year_to']):
+        return False
+    words = _author_words(params.get('author'))
+    if words:
+        author_words = _author_words(book.get('author'))
+        if not all(any(w.startswith(word) for w in author_words) for word in words):
+            return False
+    return True
+
+def describe_params(params: Dict[str, Any]) -> str:
+    """Критерии подписки для пользователя"""
+    parts = []
+    if params.get('genre'):
+        parts.append(f"жанр {params['genre']}")
+    if params.get('author'):
+        parts.append(f"автор {params['author']}")
+    if params.get('language') in LANGUAGE_NAMES:
+        parts.append(LANGUAGE_NAMES[params['language']].lower())
+    if params.get('price') in PRICE_NAMES:
+        parts.append(PRICE_NAMES[params['price']])
+    if params.get('rating') in RATING_THRESHOLDS:
+        parts.append(f"рейтинг от {params['rating']}")
+    if params.get('year_from') or params.get('year_to'):
+        parts.append(f"годы {params.get('year_from') or '…'}-{params.get('year_to') or '…'}")
+    return ', '.join(parts)
+
+async def save_search(session: AsyncSession, user_id: int, params: Dict[str, Any]) -> Optional[SavedSearch]:
+    """Сохранение подписки; None, если лимит подписок исчерпан.
+
+    Повторное сохранение тех же критериев возвращает существующую подписку.
+    """
+    params = canonical_search_params(params)
+    query = select(SavedSearch).where(
+        SavedSearch.user_id == user_id,
+        type_coerce(SavedSearch.params, JSONB) == type_coerce(params, JSONB)
+    )
+    existing = await session.scalar(query)
+    if existing is not None:
+        return existing
+    count = await session.scalar(select(func.count(SavedSearch.id)).where(SavedSearch.user_id == user_id))
+    if count >= SAVED_SEARCH_LIMIT:
+        return None
+    statement = insert(SavedSearch).values(user_id=user_id, params=params, anchor=anchor_term(params))
+    await session.execute(statement.on_conflict_do_nothing())
+    return await session.scalar(query)
+
+async def list_saved_searches(session: AsyncSession, user_id: int) -> List[SavedSearch]:
+    result = await session.scalars(
+        select(SavedSearch).where(SavedSearch.user_id == user_id).order_by(SavedSearch.id)
+    )
+    return list(result)
+
+async def delete_saved_search(session: AsyncSession, user_id: int, saved_id: int) -> bool:
+    result = await session.execute(
+        delete(SavedSearch).where(SavedSearch.id == saved_id, SavedSearch.user_id == user_id)
+    )
+    return result.rowcount > 0
+
+async def match_new_books(session: AsyncSession, books: List[Dict[str, Any]]) -> Dict[int, Dict[int, Dict[str, Any]]]:
+    """Подписки, которым подходят новые книги: {user_id: {book_id: книга}}.
+
+    Подписки не перебираются: по признакам новых книг (book_terms) из
+    индекса ix_saved_searches_anchor читаются только подписки с этими
+    якорями, и для них проверяются остальные критерии.
+    """
+    books_by_term: Dict[str, List[Dict[str, Any]]] = {}
+    for book in books:
+        for term in book_terms(book):
+            books_by_term.setdefault(term, []).append(book)
+
+    matches: Dict[int, Dict[int, Dict[str, Any]]] = {}
+    result = await session.stream(
+        select(SavedSearch.user_id, SavedSearch.params, SavedSearch.anchor)
+        .where(SavedSearch.anchor.in_(list(books_by_term)))
+        .execution_options(yield_per=SAVED_SEARCH_SCAN_BATCH)
+    )
+    async for user_id, params, anchor in result:
+        for book in books_by_term[anchor]:
+            if book_matches(book, params):
+                matches.setdefault(user_id, {})[book['id']] = book
+    return matches
+
+async def _lock_watermark(session: AsyncSession) -> Optional[int]:
+    """Последняя обработанная книга; None - её обрабатывает другой процесс"""
+    await session.execute(
+        insert(JobWatermark)
+        .from_select(['name', 'last_id'], select(literal(WATERMARK), func.coalesce(func.max(Book.id), 0)))
+        .on_conflict_do_nothing(index_elements=['name'])
+    )
+    return await session.scalar(
+        select(JobWatermark.last_id).where(JobWatermark.name == WATERMARK).with_for_update(skip_locked=True)
+    )
+
+def render_notification(books: List[Dict[str, Any]]) -> str:
+    lines = ["🔔 <b>Новые книги по вашим подпискам:</b>\n"]
+    for book in books[:SAVED_SEARCH_NOTIFY_BOOKS]:
+        lines.append(
+            f"• <b>{html.escape(book['title'])}</b> - {html.escape(book['author'])} (⭐ {book.get('rating', '-')})"
+        )
+    if len(books) > SAVED_SEARCH_NOTIFY_BOOKS:
+        lines.append(f"\n…и ещё {len(books) - SAVED_SEARCH_NOTIFY_BOOKS}")
+    lines.append("\nПодписки: /subscriptions")
+    return "\n".join(lines)
+
+async def _notify(bot: Bot, user_id: int, books: List[Dict[str, Any]],
+                  session_factory: async_sessionmaker) -> bool:
+    try:
+        await bot.send_message(user_id, render_notification(books), parse_mode="HTML")
+        return True
+    except TelegramForbiddenError:
+        # Пользователь заблокировал бота - подписки ему больше не нужны
+        async with session_factory() as session, session.begin():
+            await session.execute(delete(SavedSearch).where(SavedSearch.user_id == user_id))
+    except TelegramBadRequest as e:
+        logger.warning(f"Saved search notification to {user_id} failed: {e}")
+    return False
+
+async def send_notifications(bot: Bot, matches: Dict[int, Dict[int, Dict[str, Any]]],
+                             session_factory: async_sessionmaker = AsyncSessionLocal) -> int:
+    """Одно уведомление на пользователя, массовым приоритетом и пачками"""
+    sent = 0
+    users = list(matches.items())
+    with bulk_sends():
+        for start in range(0, len(users), SAVED_SEARCH_SEND_CONCURRENCY):
+            chunk = users[start:start + SAVED_SEARCH_SEND_CONCURRENCY]
+            results = await asyncio.gather(*(
+                # Лучшие по рейтингу книги - первыми
+                _notify(bot, user_id, sorted(books.values(), key=lambda b: -b.get('rating', 0)), session_factory)
+                for user_id, books in chunk
+            ), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error sending saved search notification: {result}")
+            sent += sum(result is True for result in results)
+    return sent
+
+async def process_new_books(bot: Bot, session_factory: async_sessionmaker = AsyncSessionLocal,
+                            batch: int = SAVED_SEARCH_BOOK_BATCH) -> int:
+    """Один проход: новые книги после отметки, совпадения, уведомления.
+
+    Отметка сдвигается в той же транзакции, что и чтение книг, а
+    уведомления отправляются после фиксации: при сбое отправки книга не
+    будет обработана повторно. Процессы бота делят работу блокировкой строки
+    отметки (SKIP LOCKED).
+    """
+    async with session_factory() as session:
+        async with session.begin():
+            last_id = await _lock_watermark(session)
+            if last_id is None:
+                return 0
+            result = await session.scalars(select(Book).where(Book.id > last_id).order_by(Book.id).limit(batch))
+            books = [book_to_dict(book) for book in result]
+            if not books:
+                return 0
+            matches = await match_new_books(session, books)
+            await session.execute(
+                update(JobWatermark)
+                .where(JobWatermark.name == WATERMARK)
+                .values(last_id=books[-1]['id'], updated_at=func.now())
+            )
+
+    sent = await send_notifications(bot, matches, session_factory)
+    logger.info(f"Saved searches: {len(books)} new books, {len(matches)} users matched, {sent} notified")
+    return len(books)
+
+async def run_saved_search_notifier(bot: Bot, interval: float = SAVED_SEARCH_INTERVAL):
+    """Фоновая проверка новых книг по сохранённым поискам"""
+    while True:
+        try:
+            # Большая загрузка каталога разбирается пачками без паузы
+            while await process_new_books(bot) == SAVED_SEARCH_BOOK_BATCH:
+                pass
+        except Exception as e:
+            logger.error(f"Error matching saved searches: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,138 @@
+import datetime
+import logging
+import os
+from typing import Dict, List, Any, Optional
+
+from sqlalchemy import text, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from .catalog_index import LANGUAGE_NAMES
+from .llm_cache import canonical_search_params
+from .models import SearchEvent, UserPreferenceSummary
+from .write_behind import WriteBehindBuffer, write_behind
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Сколько месячных секций search_events создавать наперёд
+SEARCH_EVENTS_PARTITIONS_AHEAD = int(os.getenv('SEARCH_EVENTS_PARTITIONS_AHEAD', '3'))
+
+PRICE_NAMES = {'0_500': 'до 500 руб', '500_1000': '500-1000 руб', '1000_2000': '1000-2000 руб', '2000': 'от 2000 руб'}
+
+def _add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def ensure_partitions(engine: Engine, months_ahead: int = SEARCH_EVENTS_PARTITIONS_AHEAD,
+                      today: Optional[datetime.date] = None):
+    """Создание секций search_events на текущий и следующие месяцы"""
+    month = (today or datetime.date.today()).replace(day=1)
+    for offset in range(months_ahead + 1):
+        start = _add_months(month, offset)
+        end = _add_months(start, 1)
+        name = f"search_events_{start:%Y_%m}"
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF search_events "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+        except Exception as e:
+            # Например, строки за этот месяц уже лежат в секции по умолчанию
+            logger.warning(f"Could not create partition {name}: {e}")
+
+def preference_counts(params: Dict[str, Any]) -> Dict[str, int]:
+    """Счётчики предпочтений одного поиска: {"genre:Фэнтези": 1, ...}"""
+    params = canonical_search_params(params)
+    counts = {}
+    for key in ('genre', 'author', 'language', 'rating', 'price'):
+        if key in params:
+            counts[f"{key}:{params[key]}"] = 1
+    year = params.get('year_from') or params.get('year_to')
+    if year:
+        counts[f"decade:{int(year) // 10 * 10}"] = 1
+    return counts
+
+def summary_statements(rows: List[Dict[str, Any]]) -> List[Any]:
+    """Приращение сводок по пакету событий: одна строка UPSERT на пользователя"""
+    by_user: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        summary = by_user.setdefault(row['user_id'], {
+            'user_id': row['user_id'], 'searches': 0, 'counts': {}, 'last_search_at': row['created_at']
+        })
+        summary['searches'] += 1
+        summary['last_search_at'] = max(summary['last_search_at'], row['created_at'])
+        for key, value in preference_counts(row['params'] or {}).items():
+            summary['counts'][key] = summary['counts'].get(key, 0) + value
+
+    table = UserPreferenceSummary.__table__
+    statement = insert(table).values(list(by_user.values()))
+    return [statement.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={
+            'searches': table.c.searches + statement.excluded.searches,
+            'counts': func.jsonb_add_counts(table.c.counts, statement.excluded.counts),
+            'last_search_at': func.greatest(table.c.last_search_at, statement.excluded.last_search_at),
+        }
+    )]
+
+# Сводка обновляется в той же транзакции, что и запись событий
+write_behind.register_aggregate(SearchEvent, summary_statements)
+
+async def record_search(user_id: int, params: Dict[str, Any], result_count: int,
+                        buffer: WriteBehindBuffer = write_behind):
+    """Событие поиска в очередь пакетной записи"""
+    await buffer.add(SearchEvent, {
+        'user_id': user_id,
+        'params': params,
+        'result_count': result_count,
+        'created_at': datetime.datetime.now(),
+    })
+
+def _top(counts: Dict[str, int], kind: str, limit: int = 3) -> List[str]:
+    values = [(key.split(':', 1)[1], count) for key, count in counts.items() if key.startswith(f"{kind}:")]
+    values.sort(key=lambda item: (-item[1], item[0]))
+    return [value for value, _ in values[:limit]]
+
+async def get_preference_summary(session: AsyncSession, user_id: int) -> Dict[str, Any]:
+    """Сводка предпочтений пользователя - одно чтение по первичному ключу"""
+    summary = await session.get(UserPreferenceSummary, user_id)
+    if summary is None:
+        return {}
+    counts = summary.counts or {}
+    return {
+        'searches': summary.searches,
+        'last_search_at': summary.last_search_at,
+        'genres': _top(counts, 'genre'),
+        'authors': _top(counts, 'author'),
+        'languages': _top(counts, 'language', 1),
+        'prices': _top(counts, 'price', 1),
+        'ratings': _top(counts, 'rating', 1),
+    }
+
+def summary_preferences(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """Предпочтения из сводки в виде для запроса к ИИ"""
+    preferences = {}
+    if summary.get('genres'):
+        preferences['любимые жанры'] = summary['genres']
+    if summary.get('authors'):
+        preferences['любимые авторы'] = summary['authors']
+    if summary.get('languages'):
+        code = summary['languages'][0]
+        preferences['предпочитаемый язык'] = LANGUAGE_NAMES.get(code, code)
+    if summary.get('prices'):
+        code = summary['prices'][0]
+        preferences['бюджет'] = PRICE_NAMES.get(code, code)
+    if summary.get('ratings'):
+        preferences['минимальный рейтинг'] = summary['ratings'][0]
+    return preferences
+
+if __name__ == "__main__":
+    # Создание секций наперёд по расписанию: python -m app.search_events
+    from .database import engine
+    logging.basicConfig(level=logging.INFO)
+    ensure_partitions(engine)
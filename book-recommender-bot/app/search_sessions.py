@@ -0,0 +1,119 @@
+import json
+import os
+from array import array
+from typing import Dict, List, Any, Optional
+
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+from .redis_client import get_redis
+
+load_dotenv()
+
+# ID книг хранятся упакованными uint32: страница читается через GETRANGE
+_ID_TYPECODE = 'I'
+_ID_SIZE = array(_ID_TYPECODE).itemsize
+
+class SearchSessionStore:
+    """Состояние поиска пользователя в Redis.
+
+    Для каждого пользователя хранятся только критерии поиска, служебные
+    данные выдачи и ID найденных книг (или курсоры страниц для поиска в БД).
+    Все ключи истекают через SEARCH_SESSION_TTL после последнего изменения.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = 'search'):
+        self._redis = redis
+        self.prefix = prefix
+        self.ttl = int(os.getenv('SEARCH_SESSION_TTL', '86400'))
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def _keys(self, user_id: int) -> Dict[str, str]:
+        base = f"{self.prefix}:{user_id}"
+        return {
+            'params': f"{base}:params",
+            'meta': f"{base}:meta",
+            'results': f"{base}:results",
+            'cursors': f"{base}:cursors",
+        }
+
+    async def reset(self, user_id: int):
+        """Начало нового поиска: удаление критериев и результатов"""
+        await self.redis.delete(*self._keys(user_id).values())
+
+    async def set_params(self, user_id: int, values: Dict[str, Any]):
+        """Установка критериев поиска"""
+        keys = self._keys(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(keys['params'], mapping={k: json.dumps(v, ensure_ascii=False) for k, v in values.items()})
+            pipe.expire(keys['params'], self.ttl)
+            await pipe.execute()
+
+    async def set_param(self, user_id: int, key: str, value: Any):
+        """Установка одного критерия поиска"""
+        await self.set_params(user_id, {key: value})
+
+    async def get_params(self, user_id: int) -> Dict[str, Any]:
+        """Текущие критерии поиска пользователя"""
+        raw = await self.redis.hgetall(self._keys(user_id)['params'])
+        return {k.decode('utf-8'): json.loads(v) for k, v in raw.items()}
+
+    async def save_results(self, user_id: int, book_ids: List[int], catalog_version: str):
+        """Сохранение выдачи поиска в памяти: упакованные ID книг"""
+        keys = self._keys(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(keys['results'], keys['cursors'])
+            pipe.set(keys['results'], array(_ID_TYPECODE, book_ids).tobytes(), ex=self.ttl)
+            pipe.hset(keys['meta'], mapping={
+                'mode': 'ids',
+                'total': len(book_ids),
+                'version': catalog_version,
+            })
+            pipe.expire(keys['meta'], self.ttl)
+            pipe.expire(keys['params'], self.ttl)
+            await pipe.execute()
+
+    async def save_db_results(self, user_id: int, total: int, next_cursor: Optional[list]):
+        """Сохранение выдачи поиска в БД: общее число и курсор второй страницы"""
+        keys = self._keys(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(keys['results'], keys['cursors'])
+            pipe.hset(keys['meta'], mapping={'mode': 'db', 'total': total})
+            if next_cursor:
+                pipe.hset(keys['cursors'], 2, json.dumps(next_cursor))
+                pipe.expire(keys['cursors'], self.ttl)
+            pipe.expire(keys['meta'], self.ttl)
+            pipe.expire(keys['params'], self.ttl)
+            await pipe.execute()
+
+    async def get_meta(self, user_id: int) -> Dict[str, str]:
+        """Служебные данные выдачи: режим, общее число книг, версия каталога"""
+        raw = await self.redis.hgetall(self._keys(user_id)['meta'])
+        return {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+
+    async def page_ids(self, user_id: int, page: int, page_size: int) -> List[int]:
+        """ID книг одной страницы выдачи"""
+        start = (page - 1) * page_size * _ID_SIZE
+        end = start + page_size * _ID_SIZE - 1
+        data = await self.redis.getrange(self._keys(user_id)['results'], start, end)
+        ids = array(_ID_TYPECODE)
+        ids.frombytes(data[:len(data) - len(data) % _ID_SIZE])
+        return ids.tolist()
+
+    async def get_cursor(self, user_id: int, page: int) -> Optional[list]:
+        """Курсор начала страницы для поиска в БД"""
+        raw = await self.redis.hget(self._keys(user_id)['cursors'], page)
+        return json.loads(raw) if raw is not None else None
+
+    async def save_cursor(self, user_id: int, page: int, cursor: list):
+        """Запоминание курсора начала страницы"""
+        key = self._keys(user_id)['cursors']
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, page, json.dumps(cursor))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
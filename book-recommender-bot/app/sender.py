@@ -0,0 +1,184 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple, Optional
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from dotenv import load_dotenv
+
+from .metrics import SEND_LATENCY, SEND_RETRY_AFTER, SEND_WAIT
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду всего, ~1 в секунду в личный чат,
+# ~20 в минуту в группу
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+# Дольше этого ждать не имеет смысла - ошибка уходит вызывающему коду
+SEND_MAX_RETRY_AFTER = float(os.getenv('SEND_MAX_RETRY_AFTER', '60'))
+SEND_MAX_CHAT_BUCKETS = int(os.getenv('SEND_MAX_CHAT_BUCKETS', '100000'))
+
+# Приоритеты отправки: ответы пользователю раньше массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+
+send_priority: ContextVar[int] = ContextVar('send_priority', default=INTERACTIVE)
+
+@contextmanager
+def bulk_sends():
+    """Отправки внутри блока (и созданных в нём задач) идут с низким приоритетом"""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+def _is_outbound(method: TelegramMethod) -> bool:
+    """Методы, которые Telegram считает сообщениями в чат"""
+    name = type(method).__name__
+    return getattr(method, 'chat_id', None) is not None and name.startswith(
+        ('Send', 'Copy', 'Forward', 'Edit')
+    )
+
+class TokenBucket:
+    """Ведро токенов с резервированием: каждый вызов получает время своей очереди"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забирает токен (возможно, в долг) и возвращает время ожидания"""
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def delay(self) -> float:
+        """Время до появления токена без его изъятия"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Пауза после 429: новые токены появятся только через seconds"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих сообщений бота.
+
+    Подключается к сессии бота как request-middleware, поэтому через него
+    проходят все отправки, в том числе message.answer в обработчиках.
+    Каждое сообщение ждёт токен ведра своего чата, затем токен общего ведра;
+    общие токены выдаются сначала интерактивным отправкам, потом массовым.
+    На 429 чат ставится на паузу retry_after, и запрос повторяется.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= SEND_MAX_CHAT_BUCKETS:
+                # Полные вёдра ничего не помнят - их можно удалить
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle}
+            # Отрицательный chat_id - группа или канал
+            if chat_id < 0:
+                bucket = TokenBucket(SEND_GROUP_RATE, 1)
+            else:
+                bucket = TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire_global(self, priority: int):
+        """Токен общего ведра в порядке приоритета"""
+        if not self._waiters and self._global.delay() == 0:
+            self._global.take()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await future
+
+    async def _run_pump(self):
+        """Выдача общих токенов ожидающим по мере пополнения ведра"""
+        while self._waiters:
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._global.take()
+            future.set_result(None)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not _is_outbound(method):
+            return await make_request(bot, method)
+
+        chat_id = method.chat_id
+        bucket = self._chat_bucket(chat_id) if isinstance(chat_id, int) else None
+        priority = send_priority.get()
+        name = type(method).__name__
+
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            if bucket is not None:
+                await asyncio.sleep(bucket.reserve())
+            await self._acquire_global(priority)
+            sent = time.perf_counter()
+            SEND_WAIT.observe(sent - started, 'bulk' if priority == BULK else 'interactive')
+            try:
+                response = await make_request(bot, method)
+                SEND_LATENCY.observe(time.perf_counter() - sent, name)
+                return response
+            except TelegramRetryAfter as e:
+                SEND_RETRY_AFTER.inc(name)
+                if attempt == SEND_MAX_RETRIES or e.retry_after > SEND_MAX_RETRY_AFTER:
+                    raise
+                logger.warning(f"Flood control for chat {chat_id}: retry after {e.retry_after}s")
+                if bucket is not None:
+                    bucket.pause(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
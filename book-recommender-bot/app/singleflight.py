@@ -0,0 +1,196 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Dict, Optional, Callable, Awaitable, AsyncIterator
+
+from redis.asyncio import Redis
+from dotenv import load_dotenv
+
+from .redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Снятие лока только его владельцем
+_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+Lookup = Callable[[], Awaitable[Optional[str]]]
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов в один вызов.
+
+    Внутри процесса ожидающие подписываются на future ведущего вызова.
+    Между репликами ведущий определяется локом в Redis, а остальные
+    получают его результат через pub/sub.
+    """
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = 'sf'):
+        self._redis = redis
+        self.prefix = prefix
+        self.distributed = os.getenv('SINGLEFLIGHT_DISTRIBUTED', 'True').lower() in ('1', 'true', 'yes')
+        # Лок живёт дольше дедлайна запроса к ИИ, ожидание - чуть дольше лока
+        self.lock_ttl = int(os.getenv('SINGLEFLIGHT_LOCK_TTL', '90'))
+        self.wait_timeout = float(os.getenv('SINGLEFLIGHT_WAIT_TIMEOUT', '95'))
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]], lookup: Optional[Lookup] = None) -> str:
+        """Выполнить fn один раз на все одновременные вызовы с тем же ключом"""
+        while key in self._calls:
+            result = await self._wait_local(key)
+            if result is not None:
+                return result
+
+        future = self._begin(key)
+        try:
+            token = await self._lock(key)
+            if token is None:
+                # Запрос уже выполняет другая реплика
+                result = await self._wait_remote(key, lookup)
+                if result is None:
+                    result = await fn()
+            else:
+                try:
+                    result = await fn()
+                except BaseException:
+                    await self._publish(key, None)
+                    raise
+                finally:
+                    await self._unlock(key, token)
+                await self._publish(key, result)
+        except BaseException as e:
+            self._end(key, future, error=e)
+            raise
+
+        self._end(key, future, result=result)
+        return result
+
+    async def do_stream(self, key: str, stream_fn: Callable[[], AsyncIterator[str]],
+                        lookup: Optional[Lookup] = None) -> AsyncIterator[str]:
+        """Потоковый вариант do: ведущий получает фрагменты, остальные - готовый ответ"""
+        while key in self._calls:
+            result = await self._wait_local(key)
+            if result is not None:
+                yield result
+                return
+
+        future = self._begin(key)
+        try:
+            token = await self._lock(key)
+            if token is None:
+                result = await self._wait_remote(key, lookup)
+                if result is not None:
+                    yield result
+                    self._end(key, future, result=result)
+                    return
+                token = ''
+
+            parts = []
+            try:
+                async for chunk in stream_fn():
+                    parts.append(chunk)
+                    yield chunk
+            except BaseException:
+                await self._publish(key, None)
+                raise
+            finally:
+                await self._unlock(key, token)
+            result = "".join(parts)
+            await self._publish(key, result)
+        except BaseException as e:
+            self._end(key, future, error=e)
+            raise
+
+        self._end(key, future, result=result)
+
+    def _begin(self, key: str) -> asyncio.Future:
+        """Регистрация ведущего вызова в процессе"""
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        return future
+
+    def _end(self, key: str, future: asyncio.Future, result: Optional[str] = None,
+             error: Optional[BaseException] = None):
+        """Передача результата ожидающим в процессе"""
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            # Ожидающие не наследуют ошибку ведущего - они повторят запрос сами
+            future.set_result(None)
+
+    async def _wait_local(self, key: str) -> Optional[str]:
+        """Ожидание ведущего вызова в этом процессе; None - он завершился ошибкой"""
+        return await asyncio.shield(self._calls[key])
+
+    async def _lock(self, key: str) -> Optional[str]:
+        """Лок ведущего в Redis: токен владельца, '' без Redis, None - лок занят"""
+        if not self.distributed:
+            return ''
+
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(f"{self.prefix}:lock:{key}", token, nx=True, ex=self.lock_ttl)
+        except Exception as e:
+            logger.warning(f"Single-flight lock failed: {e}")
+            return ''
+        return token if acquired else None
+
+    async def _unlock(self, key: str, token: str):
+        if not token:
+            return
+        try:
+            await self.redis.eval(_UNLOCK_SCRIPT, 1, f"{self.prefix}:lock:{key}", token)
+        except Exception as e:
+            logger.warning(f"Single-flight unlock failed: {e}")
+
+    async def _publish(self, key: str, result: Optional[str]):
+        """Рассылка результата ожидающим репликам (None - ведущий не справился)"""
+        if not self.distributed:
+            return
+        try:
+            await self.redis.publish(f"{self.prefix}:done:{key}", json.dumps({'result': result}))
+        except Exception as e:
+            logger.warning(f"Single-flight publish failed: {e}")
+
+    async def _wait_remote(self, key: str, lookup: Optional[Lookup]) -> Optional[str]:
+        """Ожидание результата другой реплики; None - выполнять запрос самим"""
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(f"{self.prefix}:done:{key}")
+
+            # Ведущий мог закончить до подписки - тогда ответ уже в кэше
+            if lookup is not None:
+                result = await lookup()
+                if result is not None:
+                    return result
+            if not await self.redis.exists(f"{self.prefix}:lock:{key}"):
+                return None
+
+            async with asyncio.timeout(self.wait_timeout):
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        return json.loads(message['data'])['result']
+        except TimeoutError:
+            logger.warning(f"Single-flight wait timed out for {key}")
+        except Exception as e:
+            logger.warning(f"Single-flight wait failed: {e}")
+        finally:
+            await pubsub.aclose()
+        return None
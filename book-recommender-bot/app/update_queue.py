@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import os
+import zlib
+from typing import Dict, List, Any, Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from dotenv import load_dotenv
+
+from .redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_SHARDS = int(os.getenv('UPDATE_QUEUE_SHARDS', '16'))
+UPDATE_QUEUE_MAXLEN = int(os.getenv('UPDATE_QUEUE_MAXLEN', '100000'))
+UPDATE_QUEUE_BATCH = int(os.getenv('UPDATE_QUEUE_BATCH', '100'))
+UPDATE_QUEUE_BLOCK_MS = int(os.getenv('UPDATE_QUEUE_BLOCK_MS', '5000'))
+# Максимум обновлений, обрабатываемых одним процессом одновременно
+UPDATE_MAX_INFLIGHT = int(os.getenv('UPDATE_MAX_INFLIGHT', '256'))
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """Чат (или пользователь), к которому относится сырое обновление Telegram"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return 0
+
+def shard_for(chat_id: int, shards: int = UPDATE_QUEUE_SHARDS) -> int:
+    """Номер шарда очереди для чата: один чат всегда попадает в один шард"""
+    return zlib.crc32(str(chat_id).encode('ascii')) % shards
+
+class ChatSequencer:
+    """Последовательная обработка обновлений одного чата.
+
+    Обновления разных чатов выполняются параллельно, обновления одного
+    чата - строго в порядке поступления: каждая задача ждёт предыдущую
+    задачу того же чата. Число одновременных задач ограничено.
+    """
+
+    def __init__(self, max_inflight: int = UPDATE_MAX_INFLIGHT):
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max_inflight)
+
+    @property
+    def pending(self) -> int:
+        return len(self._tails)
+
+    async def submit(self, chat_id: int, fn: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Постановка обработки в очередь чата; ждёт, пока освободится слот"""
+        await self._slots.acquire()
+        previous = self._tails.get(chat_id)
+
+        async def run():
+            try:
+                if previous is not None:
+                    # Ошибка предыдущего обновления не должна блокировать чат
+                    await asyncio.wait([previous])
+                return await fn()
+            finally:
+                self._slots.release()
+
+        task = asyncio.create_task(run())
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._release(chat_id, t))
+        return task
+
+    def _release(self, chat_id: int, task: asyncio.Task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Update processing failed for chat {chat_id}: {task.exception()!r}")
+
+    async def drain(self):
+        """Ожидание завершения всех поставленных задач"""
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+class UpdateQueue:
+    """Очередь обновлений Telegram в Redis Streams, разбитая на шарды по чатам.
+
+    Приём вебхуков только записывает обновление в поток updates:{shard}.
+    Каждый шард читает ровно один воркер (шард s принадлежит воркеру
+    s % WORKER_COUNT), поэтому порядок обновлений одного чата сохраняется,
+    а воркеры масштабируются по ядрам и хостам. Обновление подтверждается
+    (XACK) после обработки; неподтверждённые после падения воркера
+    обрабатываются заново при его перезапуске.
+    """
+
+    group = 'bot'
+
+    def __init__(self, redis: Optional[Redis] = None, prefix: str = 'updates',
+                 shards: int = UPDATE_QUEUE_SHARDS):
+        self._redis = redis
+        self.prefix = prefix
+        self.shards = shards
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = get_redis()
+        return self._redis
+
+    def stream(self, shard: int) -> str:
+        return f"{self.prefix}:{shard}"
+
+    async def enqueue(self, update: Dict[str, Any]):
+        """Запись обновления в шард его чата"""
+        chat_id = update_chat_id(update)
+        await self.redis.xadd(
+            self.stream(shard_for(chat_id, self.shards)),
+            {'chat': chat_id, 'update': json.dumps(update, ensure_ascii=False)},
+            maxlen=UPDATE_QUEUE_MAXLEN, approximate=True
+        )
+
+    def owned_shards(self, worker_index: int, worker_count: int) -> List[int]:
+        """Шарды, которые читает воркер с данным номером"""
+        return [s for s in range(self.shards) if s % worker_count == worker_index]
+
+    async def _ensure_group(self, stream: str):
+        try:
+            await self.redis.xgroup_create(stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def consume(self, shard: int, handle: Callable[[Dict[str, Any]], Awaitable[Any]],
+                      sequencer: ChatSequencer, consumer: str):
+        """Чтение одного шарда: сначала свои неподтверждённые записи, затем новые"""
+        stream = self.stream(shard)
+        await self._ensure_group(stream)
+        last_id = '0'
+
+        while True:
+            response = await self.redis.xreadgroup(
+                self.group, consumer, {stream: last_id},
+                count=UPDATE_QUEUE_BATCH, block=UPDATE_QUEUE_BLOCK_MS
+            )
+            entries = response[0][1] if response else []
+            if last_id == '0':
+                if not entries:
+                    last_id = '>'
+                    continue
+                # Неподтверждённые записи перечитываются, пока не будут обработаны
+                last_id = entries[-1][0]
+
+            for entry_id, fields in entries:
+                if not fields:
+                    # Запись удалена из потока по MAXLEN
+                    await self.redis.xack(stream, self.group, entry_id)
+                    continue
+                update = json.loads(fields[b'update'])
+                await sequencer.submit(
+                    int(fields[b'chat']),
+                    lambda u=update, i=entry_id: self._process(stream, i, u, handle)
+                )
+
+    async def _process(self, stream: str, entry_id: bytes, update: Dict[str, Any],
+                       handle: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        try:
+            await handle(update)
+        except Exception as e:
+            # Ошибочное обновление не обрабатывается повторно бесконечно
+            logger.error(f"Error processing update {update.get('update_id')}: {e}")
+        finally:
+            await self.redis.xack(stream, self.group, entry_id)
+
+async def run_worker(bot: Bot, dp: Dispatcher, worker_index: int, worker_count: int,
+                     queue: Optional[UpdateQueue] = None):
+    """Воркер: обработка обновлений из своих шардов очереди"""
+    queue = queue or UpdateQueue()
+    shards = queue.owned_shards(worker_index, worker_count)
+    if not shards:
+        logger.warning(f"Worker {worker_index}/{worker_count} owns no shards, "
+                       f"UPDATE_QUEUE_SHARDS={queue.shards} is too small")
+        return
+
+    sequencer = ChatSequencer()
+    handle = lambda update: dp.feed_raw_update(bot, update)
+    logger.info(f"Worker {worker_index}/{worker_count} consuming shards {shards}")
+    try:
+        await asyncio.gather(*(
+            queue.consume(shard, handle, sequencer, consumer=f"worker-{shard}")
+            for shard in shards
+        ))
+    finally:
+        await sequencer.drain()
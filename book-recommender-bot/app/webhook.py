@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import secrets
+import socket
+from typing import Dict, Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from dotenv import load_dotenv
+
+from .update_queue import ChatSequencer, UpdateQueue, update_chat_id
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Приём обновления: либо обработка в этом процессе, либо запись в очередь
+Ingress = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def direct_ingress(bot: Bot, dp: Dispatcher, sequencer: ChatSequencer) -> Ingress:
+    """Обработка обновлений в процессе вебхука с сохранением порядка по чатам"""
+    async def ingress(update: Dict[str, Any]):
+        # Ответ Telegram не ждёт окончания обработки
+        await sequencer.submit(update_chat_id(update), lambda: dp.feed_raw_update(bot, update))
+    return ingress
+
+def queue_ingress(queue: UpdateQueue) -> Ingress:
+    """Запись обновлений в очередь Redis для пула воркеров"""
+    return queue.enqueue
+
+def create_app(ingress: Ingress) -> web.Application:
+    """Приложение aiohttp с обработчиком вебхука Telegram"""
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not secrets.compare_digest(
+            request.headers.get(SECRET_HEADER, ''), WEBHOOK_SECRET
+        ):
+            return web.Response(status=401)
+        try:
+            update = json.loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        await ingress(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+async def set_webhook(bot: Bot, allowed_updates: list):
+    """Регистрация вебхука в Telegram"""
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=allowed_updates,
+        max_connections=WEBHOOK_MAX_CONNECTIONS
+    )
+    logger.info(f"Webhook set to {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}")
+
+async def serve(app: web.Application, reuse_port: bool = False) -> web.AppRunner:
+    """Запуск HTTP-сервера; с reuse_port несколько процессов слушают один порт"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(
+        runner, WEBHOOK_HOST, WEBHOOK_PORT,
+        reuse_port=reuse_port and hasattr(socket, 'SO_REUSEPORT')
+    )
+    await site.start()
+    logger.info(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return runner
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+from sqlalchemy import Table
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from dotenv import load_dotenv
+
+from .database import async_engine
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_BATCH = int(os.getenv('WRITE_BEHIND_BATCH', '500'))
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '1.0'))
+# При заполнении буфера обработчики ждут, пока запись догонит поток событий
+WRITE_BEHIND_MAX_PENDING = int(os.getenv('WRITE_BEHIND_MAX_PENDING', '10000'))
+WRITE_BEHIND_RETRIES = int(os.getenv('WRITE_BEHIND_RETRIES', '3'))
+# Предел asyncpg на число параметров одного запроса
+MAX_QUERY_PARAMETERS = 32767
+
+# Таблицы, в которые пишется upsert: ключ конфликта и обновляемые колонки
+UPSERTS: Dict[str, Tuple[List[str], List[str]]] = {
+    'users': (['telegram_id'], ['username', 'first_name', 'last_name', 'language_code', 'last_active']),
+}
+
+class WriteBehindBuffer:
+    """Отложенная пакетная запись событий в БД.
+
+    Обработчики только кладут строку в очередь; фоновая задача копит
+    строки и пишет их многострочными INSERT, когда набралось
+    WRITE_BEHIND_BATCH строк или прошло WRITE_BEHIND_INTERVAL секунд.
+    Каждая таблица пишется своими транзакциями, а строк в одном INSERT
+    не больше, чем позволяет предел параметров запроса. Очередь
+    ограничена - при её заполнении add() ждёт. Для таблицы можно
+    зарегистрировать агрегат - дополнительные запросы по тем же строкам,
+    выполняемые в той же транзакции.
+    """
+
+    def __init__(self, engine: AsyncEngine = async_engine, batch_size: int = WRITE_BEHIND_BATCH,
+                 interval: float = WRITE_BEHIND_INTERVAL, max_pending: int = WRITE_BEHIND_MAX_PENDING):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._aggregates: Dict[str, List[Callable[[List[Dict[str, Any]]], List[Any]]]] = {}
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def register_aggregate(self, model, build: Callable[[List[Dict[str, Any]]], List[Any]]):
+        """Запросы, которые по пакету строк таблицы обновляют производные данные"""
+        self._aggregates.setdefault(model.__table__.name, []).append(build)
+
+    async def add(self, model, row: Dict[str, Any]):
+        """Постановка строки в очередь записи"""
+        if self._closed:
+            raise RuntimeError("WriteBehindBuffer is closed")
+        self._ensure_started()
+        await self._queue.put((model.__table__, row))
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self):
+        """Сбор пакетов и запись по размеру или по времени"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _flush(self, batch: List[Tuple[Table, Dict[str, Any]]]):
+        """Запись пакета: по таблицам, частями не больше предела параметров"""
+        by_table: Dict[Table, List[Dict[str, Any]]] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+
+        for table, rows in by_table.items():
+            size = max(1, MAX_QUERY_PARAMETERS // len(table.columns))
+            for start in range(0, len(rows), size):
+                await self._write(table, rows[start:start + size])
+
+    async def _write(self, table: Table, rows: List[Dict[str, Any]]):
+        """Строки одной таблицы и её агрегаты в одной транзакции.
+
+        Сбой соединения повторяется с паузой. Строка, которую БД не
+        принимает, отвергает весь INSERT: тогда строки делятся пополам и
+        пишутся отдельно, пока не останется одна - она и отбрасывается.
+        """
+        for attempt in range(WRITE_BEHIND_RETRIES + 1):
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(self._statement(table, rows))
+                    for build in self._aggregates.get(table.name, []):
+                        for statement in build(rows):
+                            await conn.execute(statement)
+                self.written += len(rows)
+                return
+            except Exception as e:
+                if _is_row_error(e):
+                    if len(rows) == 1:
+                        self.dropped += 1
+                        logger.error(f"Dropping buffered {table.name} row {rows[0]}: {e}")
+                        return
+                    middle = len(rows) // 2
+                    await self._write(table, rows[:middle])
+                    await self._write(table, rows[middle:])
+                    return
+                if attempt == WRITE_BEHIND_RETRIES:
+                    self.dropped += len(rows)
+                    logger.error(f"Dropping {len(rows)} buffered {table.name} rows after error: {e}")
+                    return
+                logger.warning(f"Error writing buffered {table.name} rows, retrying: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+    @staticmethod
+    def _statement(table: Table, rows: List[Dict[str, Any]]):
+        upsert = UPSERTS.get(table.name)
+        if upsert is None:
+            return insert(table).values(rows)
+
+        keys, columns = upsert
+        # В одном INSERT ... ON CONFLICT строка не может обновиться дважды
+        unique = {tuple(row[k] for k in keys): row for row in rows}
+        statement = insert(table).values(list(unique.values()))
+        return statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={c: getattr(statement.excluded, c) for c in columns}
+        )
+
+    async def close(self):
+        """Запись всего накопленного и остановка фоновой задачи"""
+        self._closed = True
+        if self._queue is None:
+            return
+        if not self._queue.empty():
+            self._ensure_started()
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        logger.info(f"Write-behind buffer closed: {self.written} rows written, {self.dropped} dropped")
+
+def _is_row_error(error: Exception) -> bool:
+    """Ошибка из-за данных строки: повтор того же запроса её не исправит"""
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    # Ошибка подготовки параметров на стороне SQLAlchemy, до отправки в БД
+    return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
+
+write_behind = WriteBehindBuffer()
@@ -0,0 +1 @@
+# Бенчмарки: python -m benchmarks.<имя> из корня проекта
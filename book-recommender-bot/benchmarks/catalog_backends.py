@@ -0,0 +1,111 @@
+"""Сравнение памяти и задержки поиска: список словарей, CatalogIndex, ColumnarCatalog, MmapCatalog.
+
+Запуск: python -m benchmarks.catalog_backends [число книг]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Any, Callable
+
+from app.catalog_index import CatalogIndex, LANGUAGE_NAMES
+from app.columnar_catalog import ColumnarCatalog
+from app.mmap_catalog import MmapCatalog, write_catalog
+from benchmarks.synthetic import make_books, QUERIES
+
+def linear_search(books: List[Dict], params: Dict) -> List[Dict]:
+    """Исходный поиск полным перебором BOOKS_DATABASE (для сравнения)"""
+    filtered_books = books.copy()
+    if params.get('genre'):
+        filtered_books = [b for b in filtered_books if params['genre'] in b.get('tags', [])]
+    if params.get('rating') in ('4.5', '4.0', '3.5'):
+        filtered_books = [b for b in filtered_books if b.get('rating', 0) >= float(params['rating'])]
+    if params.get('price'):
+        if params['price'] == '0_500':
+            filtered_books = [b for b in filtered_books if b.get('price', 0) <= 500]
+        elif params['price'] == '500_1000':
+            filtered_books = [b for b in filtered_books if 500 < b.get('price', 0) <= 1000]
+        elif params['price'] == '1000_2000':
+            filtered_books = [b for b in filtered_books if 1000 < b.get('price', 0) <= 2000]
+        elif params['price'] == '2000':
+            filtered_books = [b for b in filtered_books if b.get('price', 0) > 2000]
+    if params.get('language') in LANGUAGE_NAMES:
+        filtered_books = [b for b in filtered_books if b.get('language') == LANGUAGE_NAMES[params['language']]]
+    if params.get('author'):
+        filtered_books = [b for b in filtered_books if params['author'].lower() in b['author'].lower()]
+    if params.get('year_from'):
+        filtered_books = [b for b in filtered_books if b.get('publication_year', 0) >= params['year_from']]
+    if params.get('year_to'):
+        filtered_books = [b for b in filtered_books if b.get('publication_year', 9999) <= params['year_to']]
+    filtered_books.sort(key=lambda x: x.get('rating', 0), reverse=True)
+    return filtered_books
+
+def measure_memory(build: Callable[[], Any]) -> int:
+    """Прирост выделенной памяти при построении структуры"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+def measure_latency(search: Callable[[Dict], List], repeat: int) -> float:
+    """Средняя задержка одного запроса из смеси QUERIES, мс"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for params in QUERIES:
+            search(params)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(QUERIES))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    repeat = 3
+
+    books_memory = measure_memory(lambda: make_books(n))
+    books = make_books(n)
+
+    # Структуры поиска ссылаются на те же книги, поэтому считаем только их прирост
+    index_memory = measure_memory(lambda: CatalogIndex(books))
+    columnar_memory = measure_memory(lambda: ColumnarCatalog(books))
+
+    index = CatalogIndex(books)
+    columnar = ColumnarCatalog(books)
+
+    # Файл строится один раз, процессы бота только открывают его
+    path = os.path.join(tempfile.mkdtemp(), 'catalog.bin')
+    started = time.perf_counter()
+    write_catalog(books, 'bench', path)
+    write_time = time.perf_counter() - started
+    mmap_memory = measure_memory(lambda: MmapCatalog(path))
+    started = time.perf_counter()
+    mapped = MmapCatalog(path)
+    open_time = time.perf_counter() - started
+
+    # Все движки должны давать одинаковую выдачу
+    for params in QUERIES:
+        expected = [b['id'] for b in linear_search(books, params)]
+        assert [b['id'] for b in index.search(params)] == expected, params
+        assert [b['id'] for b in columnar.search(params)] == expected, params
+        assert mapped.search(params).ids() == expected, params
+
+    print(f"Книг: {n}")
+    print(f"{'backend':<28}{'memory, MB':>12}{'latency, ms':>14}")
+    print(f"{'BOOKS_DATABASE (dicts)':<28}{books_memory / 2**20:>12.1f}"
+          f"{measure_latency(lambda p: linear_search(books, p), repeat):>14.2f}")
+    print(f"{'CatalogIndex (+ dicts)':<28}{index_memory / 2**20:>12.1f}"
+          f"{measure_latency(index.search, repeat):>14.2f}")
+    print(f"{'ColumnarCatalog (+ dicts)':<28}{columnar_memory / 2**20:>12.1f}"
+          f"{measure_latency(columnar.search, repeat):>14.2f}")
+    # Словари создаются только для показанной страницы
+    print(f"{'MmapCatalog (page of 3)':<28}{mmap_memory / 2**20:>12.1f}"
+          f"{measure_latency(lambda p: mapped.search(p)[:3], repeat):>14.2f}")
+    print(f"Колонки NumPy: {columnar.nbytes / 2**20:.1f} MB")
+    print(f"Файл mmap: {mapped.nbytes / 2**20:.1f} MB, запись {write_time:.1f} s, открытие {open_time * 1000:.2f} ms")
+    os.remove(path)
+
+if __name__ == "__main__":
+    main()
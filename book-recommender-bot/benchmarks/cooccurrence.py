@@ -0,0 +1,53 @@
+"""Время и память построения матрицы совместных показов и таблицы соседей.
+
+Взаимодействия синтетические: корзины (выдачи) по ~10 книг, популярность
+книг распределена по Ципфу.
+
+Запуск: python -m benchmarks.cooccurrence [число взаимодействий] [число книг]
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.cooccurrence import CooccurrenceCounter, COOCCURRENCE_CHUNK_ROWS, top_neighbours
+
+def make_interactions(rows: int, books: int, basket_size: int = 10, seed: int = 42):
+    """Пары (корзина, книга), упорядоченные по корзине"""
+    rng = np.random.default_rng(seed)
+    baskets = np.arange(rows, dtype=np.int64) // basket_size
+    # Ципф, обрезанный до размера каталога
+    items = (rng.zipf(1.3, size=rows) - 1) % books + 1
+    return baskets, items.astype(np.int64)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    books = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+
+    baskets, items = make_interactions(rows, books)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    counter = CooccurrenceCounter()
+    # Части по границам корзин, как их читает задача из БД
+    for offset in range(0, rows, COOCCURRENCE_CHUNK_ROWS):
+        end = min(offset + COOCCURRENCE_CHUNK_ROWS, rows)
+        counter.add(baskets[offset:end], items[offset:end])
+    book_a, book_b, counts = counter.pairs()
+    counted = time.perf_counter()
+    src, dst, scores = top_neighbours(book_a, book_b, counts, *counter.items())
+    finished = time.perf_counter()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Взаимодействий: {rows}, книг: {books}")
+    print(f"Пар книг: {len(counts)}, книг с соседями: {len(np.unique(src))}")
+    print(f"Подсчёт пар:      {counted - start:>8.2f} s")
+    print(f"Таблица соседей:  {finished - counted:>8.2f} s")
+    print(f"Всего:            {finished - start:>8.2f} s")
+    print(f"Матрица (итог):   {counter.nbytes / 2**20:>8.1f} MB")
+    print(f"Пик памяти:       {peak / 2**20:>8.1f} MB")
+
+if __name__ == "__main__":
+    main()
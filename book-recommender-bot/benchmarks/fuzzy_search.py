@@ -0,0 +1,45 @@
+"""Нечёткий поиск автора по триграммам против подстроки по всем книгам.
+
+Запуск: python -m benchmarks.fuzzy_search [число книг ...]
+"""
+import sys
+import time
+from typing import Dict, List, Callable
+
+from app.fuzzy_index import FuzzyIndex
+from benchmarks.synthetic import make_books
+
+# Точные части имени, опечатки и запись другим алфавитом
+AUTHORS = ['автор12', 'Avtor123', 'Автор1234', 'Anna Автор77', 'Aftor42', 'Марие Автор9']
+
+def substring_search(books: List[Dict], author: str) -> List[int]:
+    needle = author.lower()
+    return [rank for rank, book in enumerate(books) if needle in book['author'].lower()]
+
+def measure_latency(search: Callable[[str], List[int]], repeat: int = 5) -> float:
+    """Средняя задержка одного запроса из AUTHORS, мс"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for author in AUTHORS:
+            search(author)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(AUTHORS))
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 50_000, 200_000]
+    print(f"{'books':>8}{'build, s':>10}{'substring, ms':>15}{'trigram, ms':>13}")
+    for n in sizes:
+        books = make_books(n)
+        started = time.perf_counter()
+        index = FuzzyIndex(books)
+        build_time = time.perf_counter() - started
+
+        # Опечатка и запись латиницей находят книги автора
+        expected = {rank for rank, book in enumerate(books) if book['author'].lower().endswith('автор42')}
+        assert expected and expected <= set(index.match_ranks('Aftor42', 'author'))
+
+        print(f"{n:>8}{build_time:>10.1f}"
+              f"{measure_latency(lambda a: substring_search(books, a)):>15.2f}"
+              f"{measure_latency(lambda a: index.match_ranks(a, 'author')):>13.2f}")
+
+if __name__ == "__main__":
+    main()
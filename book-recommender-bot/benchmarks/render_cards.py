@@ -0,0 +1,55 @@
+"""Пропускная способность отрисовки карточек: без кэша и с BookCardCache.
+
+Запросы карточек распределены по закону Ципфа - популярные книги
+показываются гораздо чаще остальных.
+
+Запуск: python -m benchmarks.render_cards [число книг] [число показов]
+"""
+import random
+import sys
+import time
+from itertools import accumulate
+from typing import Dict, List, Callable
+
+from app.book_cards import BookCardCache, render_book_card
+from benchmarks.synthetic import make_books
+
+def zipf_requests(books: List[Dict], n: int, s: float = 1.1, seed: int = 42) -> List[Dict]:
+    """Последовательность показов карточек с популярностью по Ципфу"""
+    rnd = random.Random(seed)
+    weights = list(accumulate(1 / (rank ** s) for rank in range(1, len(books) + 1)))
+    return rnd.choices(books, cum_weights=weights, k=n)
+
+def measure(render: Callable[[Dict], str], requests: List[Dict]) -> float:
+    """Карточек в секунду"""
+    start = time.perf_counter()
+    for book in requests:
+        render(book)
+    return len(requests) / (time.perf_counter() - start)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    shows = int(sys.argv[2]) if len(sys.argv) > 2 else 300_000
+
+    books = make_books(n)
+    requests = zipf_requests(books, shows)
+
+    # Кэшированная карточка совпадает с отрисованной
+    cache = BookCardCache()
+    for book in requests[:1000]:
+        assert cache.card(book) == render_book_card(book)
+
+    cache = BookCardCache()
+    cold = measure(cache.card, requests)
+    hit_rate = cache.hits / (cache.hits + cache.misses)
+    warm = measure(cache.card, requests)
+
+    print(f"Книг: {n}, показов: {shows}, размер кэша: {cache.max_size}")
+    print(f"{'variant':<32}{'cards/s':>14}")
+    print(f"{'render_book_card':<32}{measure(render_book_card, requests):>14,.0f}")
+    print(f"{'BookCardCache (cold)':<32}{cold:>14,.0f}")
+    print(f"{'BookCardCache (warm)':<32}{warm:>14,.0f}")
+    print(f"Попаданий в кэш с холодного старта: {hit_rate:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import random
+from typing import List, Dict, Any
+
+from app.data.books_data import BOOKS_DATABASE
+
+GENRES = ["Фэнтези", "Научная фантастика", "Детектив", "Роман", "Классика", "Исторический",
+          "Биография", "Психология", "Поэзия", "Драма", "Приключения", "Хоррор"]
+LANGUAGES = ["Русский", "Английский", "Французский", "Немецкий"]
+TAGS = sorted({t for b in BOOKS_DATABASE for t in b.get('tags', [])} | set(GENRES))
+
+def make_books(n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Синтетический каталог из n книг с распределениями, похожими на реальный"""
+    rnd = random.Random(seed)
+    authors = [f"{rnd.choice(['Иван', 'Anna', 'Пётр', 'John', 'Marie'])} Автор{i}" for i in range(max(n // 20, 1))]
+    books = []
+    for i in range(1, n + 1):
+        base = BOOKS_DATABASE[i % len(BOOKS_DATABASE)]
+        books.append({
+            "id": i,
+            "title": f"{base['title']} #{i}",
+            "author": rnd.choice(authors),
+            "genre": rnd.choice(GENRES),
+            "isbn": f"978-{i:010d}",
+            "publisher": base.get('publisher'),
+            "publication_year": rnd.randint(1800, 2024),
+            "pages": rnd.randint(80, 1200),
+            "language": rnd.choice(LANGUAGES),
+            "rating": round(rnd.uniform(3.0, 5.0), 1),
+            "price": rnd.choice([250, 390, 450, 600, 800, 990, 1200, 1500, 1800, 2200, 3100]),
+            "currency": "RUB",
+            "description": base.get('description'),
+            "tags": rnd.sample(TAGS, 4),
+            "available_formats": base.get('available_formats', []),
+        })
+    return books
+
+# Типичная смесь запросов из клавиатур бота
+QUERIES = [
+    {'genre': 'Фэнтези'},
+    {'genre': 'классика', 'rating': '4.5'},
+    {'rating': '4.0', 'price': '500_1000'},
+    {'language': 'en', 'price': '2000'},
+    {'genre': 'Детектив', 'language': 'ru', 'rating': '3.5'},
+    {'year_from': 1990, 'year_to': 2010, 'rating': '4.5'},
+    {'author': 'автор12'},
+    {'price': '0_500'},
+]
@@ -0,0 +1,88 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Таблицы раньше создавались через create_all - существующие не трогаем
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if 'books' not in existing:
+        op.create_table(
+            'books',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('title', sa.String(255), nullable=False),
+            sa.Column('author', sa.String(255), nullable=False),
+            sa.Column('genre', sa.String(100)),
+            sa.Column('isbn', sa.String(20), unique=True),
+            sa.Column('publisher', sa.String(255)),
+            sa.Column('publication_year', sa.Integer()),
+            sa.Column('pages', sa.Integer()),
+            sa.Column('language', sa.String(50)),
+            sa.Column('rating', sa.Float()),
+            sa.Column('price', sa.Float()),
+            sa.Column('currency', sa.String(3)),
+            sa.Column('description', sa.Text()),
+            sa.Column('tags', sa.JSON()),
+            sa.Column('available_formats', sa.JSON()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+    if 'users' not in existing:
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('telegram_id', sa.String(100), unique=True, nullable=False),
+            sa.Column('username', sa.String(100)),
+            sa.Column('first_name', sa.String(100)),
+            sa.Column('last_name', sa.String(100)),
+            sa.Column('language_code', sa.String(10)),
+            sa.Column('preferences', sa.JSON()),
+            sa.Column('search_history', sa.JSON()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+            sa.Column('last_active', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+    if 'search_sessions' not in existing:
+        op.create_table(
+            'search_sessions',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('search_params', sa.JSON()),
+            sa.Column('results', sa.JSON()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+    if 'recommendations' not in existing:
+        op.create_table(
+            'recommendations',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('book_id', sa.Integer(), nullable=False),
+            sa.Column('ai_analysis', sa.Text()),
+            sa.Column('match_score', sa.Float()),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('recommendations')
+    op.drop_table('search_sessions')
+    op.drop_table('users')
+    op.drop_table('books')
@@ -0,0 +1,71 @@
+"""book search indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # GIN-индекс по тегам работает только для jsonb
+    op.alter_column(
+        'books', 'tags',
+        type_=postgresql.JSONB(),
+        postgresql_using='tags::jsonb'
+    )
+
+    # Индексы строятся без блокировки записи, поэтому вне транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_books_tags', 'books', ['tags'],
+            postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_books_rating_id', 'books', [sa.text('rating DESC NULLS LAST'), 'id'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_books_price', 'books', ['price'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_books_publication_year', 'books', ['publication_year'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_books_language', 'books', ['language'],
+            postgresql_concurrently=True, if_not_exists=True
+        )
+        op.create_index(
+            'ix_books_author_trgm', 'books', ['author'],
+            postgresql_using='gin', postgresql_ops={'author': 'gin_trgm_ops'},
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in ('ix_books_author_trgm', 'ix_books_language', 'ix_books_publication_year',
+                     'ix_books_price', 'ix_books_rating_id', 'ix_books_tags'):
+            op.drop_index(name, table_name='books', postgresql_concurrently=True, if_exists=True)
+
+    op.alter_column(
+        'books', 'tags',
+        type_=sa.JSON(),
+        postgresql_using='tags::json'
+    )
@@ -0,0 +1,59 @@
+"""item co-occurrence tables
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:02
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Логи поисков и рекомендаций пишутся с Telegram id, которые не помещаются в integer
+    op.alter_column('search_sessions', 'user_id', type_=sa.BigInteger())
+    op.alter_column('recommendations', 'user_id', type_=sa.BigInteger())
+
+    op.create_table(
+        'job_watermarks',
+        sa.Column('name', sa.String(100), primary_key=True),
+        sa.Column('last_id', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_table(
+        'item_cooccurrence',
+        sa.Column('book_a', sa.Integer(), primary_key=True),
+        sa.Column('book_b', sa.Integer(), primary_key=True),
+        sa.Column('count', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_item_cooccurrence_book_b', 'item_cooccurrence', ['book_b'])
+    op.create_table(
+        'item_interactions',
+        sa.Column('book_id', sa.Integer(), primary_key=True),
+        sa.Column('baskets', sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        'book_neighbours',
+        sa.Column('book_id', sa.Integer(), primary_key=True),
+        sa.Column('neighbour_id', sa.Integer(), primary_key=True),
+        sa.Column('score', sa.Float(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('book_neighbours')
+    op.drop_table('item_interactions')
+    op.drop_index('ix_item_cooccurrence_book_b', table_name='item_cooccurrence')
+    op.drop_table('item_cooccurrence')
+    op.drop_table('job_watermarks')
+    op.alter_column('recommendations', 'user_id', type_=sa.Integer())
+    op.alter_column('search_sessions', 'user_id', type_=sa.Integer())
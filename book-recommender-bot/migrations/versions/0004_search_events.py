@@ -0,0 +1,106 @@
+"""partitioned search events and preference summary
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Секции по месяцам создаёт app.search_events.ensure_partitions;
+    # строки вне созданных секций попадают в секцию по умолчанию
+    op.execute("""
+        CREATE TABLE search_events (
+            id bigint GENERATED BY DEFAULT AS IDENTITY,
+            created_at timestamp NOT NULL DEFAULT now(),
+            user_id bigint NOT NULL,
+            params jsonb,
+            result_count integer,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE TABLE search_events_default PARTITION OF search_events DEFAULT")
+    op.create_index('ix_search_events_user_created', 'search_events', ['user_id', 'created_at'])
+
+    op.create_table(
+        'user_preference_summary',
+        sa.Column('user_id', sa.BigInteger(), primary_key=True),
+        sa.Column('searches', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('counts', postgresql.JSONB()),
+        sa.Column('last_search_at', sa.DateTime()),
+    )
+
+    # Сложение счётчиков двух jsonb-объектов: {"a": 1} + {"a": 2, "b": 1} = {"a": 3, "b": 1}
+    op.execute("""
+        CREATE OR REPLACE FUNCTION jsonb_add_counts(a jsonb, b jsonb) RETURNS jsonb
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT coalesce(jsonb_object_agg(key, total), '{}'::jsonb)
+            FROM (
+                SELECT key, sum(value::bigint) AS total
+                FROM (
+                    SELECT * FROM jsonb_each_text(coalesce(a, '{}'::jsonb))
+                    UNION ALL
+                    SELECT * FROM jsonb_each_text(coalesce(b, '{}'::jsonb))
+                ) s
+                GROUP BY key
+            ) t
+        $$
+    """)
+
+    # Перенос накопленной истории из users.search_history
+    op.execute("""
+        INSERT INTO search_events (user_id, created_at, params)
+        SELECT u.telegram_id::bigint, coalesce(u.last_active, now()), item
+        FROM users u, jsonb_array_elements(u.search_history::jsonb) AS item
+        WHERE jsonb_typeof(u.search_history::jsonb) = 'array'
+          AND jsonb_typeof(item) = 'object'
+          AND u.telegram_id ~ '^-?[0-9]+$'
+    """)
+    op.drop_column('users', 'search_history')
+
+    # Сводки по перенесённой истории (те же ключи, что в search_events.preference_counts)
+    op.execute("""
+        WITH keys AS (
+            SELECT e.user_id,
+                   p.key || ':' || CASE WHEN p.key = 'author' THEN lower(trim(p.value)) ELSE trim(p.value) END AS k
+            FROM search_events e, jsonb_each_text(e.params) AS p
+            WHERE p.key IN ('genre', 'author', 'language', 'rating', 'price')
+              AND trim(p.value) NOT IN ('', 'any')
+        ), counts AS (
+            SELECT user_id, jsonb_object_agg(k, n) AS counts
+            FROM (SELECT user_id, k, count(*) AS n FROM keys GROUP BY user_id, k) c
+            GROUP BY user_id
+        )
+        INSERT INTO user_preference_summary (user_id, searches, counts, last_search_at)
+        SELECT e.user_id, count(*), coalesce(c.counts, '{}'::jsonb), max(e.created_at)
+        FROM search_events e LEFT JOIN counts c USING (user_id)
+        GROUP BY e.user_id, c.counts
+    """)
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('search_history', sa.JSON()))
+    op.execute("""
+        UPDATE users u SET search_history = h.history
+        FROM (
+            SELECT user_id, json_agg(params ORDER BY created_at) AS history
+            FROM search_events GROUP BY user_id
+        ) h
+        WHERE u.telegram_id = h.user_id::text
+    """)
+    op.execute("DROP FUNCTION IF EXISTS jsonb_add_counts(jsonb, jsonb)")
+    op.drop_table('user_preference_summary')
+    op.execute("DROP TABLE search_events")
@@ -0,0 +1,47 @@
+"""saved searches with anchor predicate index
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:04
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'saved_searches',
+        sa.Column('id', sa.BigInteger(), sa.Identity(), primary_key=True),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('params', postgresql.JSONB(), nullable=False),
+        sa.Column('anchor', sa.String(150), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index('uq_saved_searches_user_params', 'saved_searches', ['user_id', 'params'], unique=True)
+    # Обратный индекс: по признакам новой книги находятся только подписки с тем же якорем
+    op.create_index('ix_saved_searches_anchor', 'saved_searches', ['anchor', 'id'])
+
+    # Уведомления начинаются с книг, добавленных после миграции
+    op.execute("""
+        INSERT INTO job_watermarks (name, last_id, updated_at)
+        SELECT 'saved_searches:books', coalesce(max(id), 0), now() FROM books
+        ON CONFLICT (name) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM job_watermarks WHERE name = 'saved_searches:books'")
+    op.drop_index('ix_saved_searches_anchor', table_name='saved_searches')
+    op.drop_index('uq_saved_searches_user_params', table_name='saved_searches')
+    op.drop_table('saved_searches')